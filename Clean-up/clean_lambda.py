@@ -1,5 +1,6 @@
 "A script to remove unsubscribed products from the database"
 
+from datetime import timedelta
 from os import _Environ, environ as ENV
 import logging
 import json
@@ -9,6 +10,9 @@ from psycopg2 import connect
 from psycopg2.extras import RealDictCursor
 from psycopg2.extensions import connection, cursor
 
+# Provision's product cache is loaded in full at least this often (CACHE_MAX_AGE in
+# ETL/Provision/product_cache.py), so older deletions have already been applied.
+DELETION_RETENTION = timedelta(hours=6)
 
 def get_connection(config: _Environ) -> connection:
     "Establishes a connection with the database"
@@ -53,15 +57,39 @@ def delete_unsubscribed(conn: connection, table: str) -> list[dict]:
     return [dict(i) for i in data]
 
 
+def prune_product_deletions(conn: connection) -> int:
+    "Deletes the product deletions older than DELETION_RETENTION and returns how many"
+    try:
+        with get_cursor(conn) as cur:
+            cur.execute("""
+                DELETE FROM product_deletions
+                WHERE deleted_at < NOW() - %s;""", (DELETION_RETENTION,))
+            pruned = cur.rowcount
+        conn.commit()
+        logging.info("Pruned %s product deletions", pruned)
+
+    except Exception as e:
+        logging.error("Error pruning product deletions: %s", e)
+        conn.rollback()
+        raise
+
+    return pruned
+
+
 def handler(_event, _context) -> str:
     "Main function which connects to the database and deletes the products"
     logging.basicConfig(level="INFO")
     db_conn = get_connection(ENV)
     deleted_readings = delete_unsubscribed(db_conn, "price_readings")
+    delete_unsubscribed(db_conn, "latest_prices")
+    deleted_failures = delete_unsubscribed(db_conn, "product_failures")
     deleted_products = delete_unsubscribed(db_conn, "products")
+    pruned_deletions = prune_product_deletions(db_conn)
 
     return json.dumps({"deleted_readings": deleted_readings,
-                       "deleted_products": deleted_products}, default=str)
+                       "deleted_failures": deleted_failures,
+                       "deleted_products": deleted_products,
+                       "pruned_deletions": pruned_deletions}, default=str)
 
 
 if __name__ == "__main__":
@@ -6,7 +6,8 @@ from unittest.mock import patch, MagicMock
 from psycopg2.extensions import connection, cursor
 import pytest
 
-from clean_lambda import delete_unsubscribed, handler, get_cursor
+from clean_lambda import (delete_unsubscribed, handler, get_cursor, prune_product_deletions,
+                          DELETION_RETENTION)
 
 
 def test_delete_unsubscribed(unsubscribed_products: list[dict]) -> None:
@@ -29,9 +30,34 @@ def test_delete_unsubscribed(unsubscribed_products: list[dict]) -> None:
     mock_conn.commit.assert_called_once()
 
 
+def test_prune_product_deletions() -> None:
+    """Tests deletions older than the retention are pruned"""
+    mock_conn = MagicMock(spec=connection)
+    mock_cur = MagicMock(spec=cursor)
+    mock_conn.cursor.return_value.__enter__.return_value = mock_cur
+    mock_cur.rowcount = 3
+
+    assert prune_product_deletions(mock_conn) == 3
+    query, params = mock_cur.execute.call_args[0]
+    assert "DELETE FROM product_deletions" in query
+    assert "deleted_at < NOW() - %s" in query
+    assert params == (DELETION_RETENTION,)
+    mock_conn.commit.assert_called_once()
+
+
+def test_prune_product_deletions_error() -> None:
+    """Tests a failed prune is rolled back and raised"""
+    mock_conn = MagicMock(spec=connection)
+    mock_conn.cursor.return_value.__enter__.return_value.execute.side_effect = ValueError
+    with pytest.raises(ValueError):
+        prune_product_deletions(mock_conn)
+    mock_conn.rollback.assert_called_once()
+
+
 @patch("clean_lambda.get_connection")
+@patch("clean_lambda.prune_product_deletions", return_value=3)
 @patch("clean_lambda.delete_unsubscribed")
-def test_handler(mock_delete_unsubscribed, mock_get_connection,
+def test_handler(mock_delete_unsubscribed, mock_prune_product_deletions, mock_get_connection,
                  unsubscribed_products: list[dict]) -> None:
     """Tests the handler function"""
     mock_delete_unsubscribed.return_value = unsubscribed_products
@@ -41,9 +67,14 @@ def test_handler(mock_delete_unsubscribed, mock_get_connection,
     result_data = json.loads(result)
 
     assert "deleted_readings" in result_data
+    assert "deleted_failures" in result_data
     assert "deleted_products" in result_data
     assert result_data["deleted_readings"] == unsubscribed_products
     assert result_data["deleted_products"] == unsubscribed_products
+    assert [call.args[1] for call in mock_delete_unsubscribed.call_args_list] == [
+        "price_readings", "latest_prices", "product_failures", "products"]
+    assert result_data["pruned_deletions"] == 3
+    mock_prune_product_deletions.assert_called_once_with(mock_get_connection.return_value)
 
 
 @pytest.mark.parametrize("invalid_types", [0, "test", {"key": "value"}, [0, 1, 2], (0, 1, 2), {0, 1, 2}])
@@ -1,4 +1,4 @@
-DROP TABLE IF EXISTS websites, price_readings, subscriptions, users, products;
+DROP TABLE IF EXISTS websites, price_readings, latest_prices, product_failures, product_deletions, subscriptions, users, products;
 
 CREATE TABLE websites (
     website_id SMALLINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
@@ -10,9 +10,14 @@ CREATE TABLE products(
     url TEXT UNIQUE NOT NULL,
     product_code TEXT NOT NULL,
     product_name TEXT NOT NULL,
-    website_id SMALLINT NOT NULL REFERENCES websites (website_id)
+    website_id SMALLINT NOT NULL REFERENCES websites (website_id),
+    next_due_at TIMESTAMP(0),
+    fetch_seconds REAL,
+    row_version BIGINT NOT NULL DEFAULT pg_current_xact_id()::TEXT::BIGINT
 );
 
+CREATE INDEX products_row_version_idx ON products (row_version);
+
 CREATE TABLE users (
     user_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
     email TEXT UNIQUE NOT NULL,
@@ -32,3 +37,78 @@ CREATE TABLE price_readings (
     reading_at TIMESTAMP(0) NOT NULL,
     price DECIMAL(12, 2) NOT NULL
 );
+
+CREATE INDEX price_readings_product_idx ON price_readings (product_id, reading_at);
+
+CREATE TABLE latest_prices (
+    product_id INTEGER PRIMARY KEY REFERENCES products (product_id),
+    reading_at TIMESTAMP(0) NOT NULL,
+    price DECIMAL(12, 2) NOT NULL,
+    first_reading_at TIMESTAMP(0) NOT NULL,
+    price_changes INTEGER NOT NULL DEFAULT 0,
+    last_change_at TIMESTAMP(0)
+);
+
+CREATE TABLE product_failures (
+    product_id INTEGER PRIMARY KEY REFERENCES products (product_id),
+    reason TEXT NOT NULL,
+    failure_count INTEGER NOT NULL DEFAULT 1,
+    first_failed_at TIMESTAMP(0) NOT NULL,
+    last_failed_at TIMESTAMP(0) NOT NULL
+);
+
+CREATE TABLE product_deletions (
+    product_id INTEGER NOT NULL,
+    row_version BIGINT NOT NULL,
+    deleted_at TIMESTAMP(0) NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX product_deletions_row_version_idx ON product_deletions (row_version);
+
+CREATE OR REPLACE FUNCTION bump_row_version() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.row_version := pg_current_xact_id()::TEXT::BIGINT;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_product_version() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE products SET row_version = pg_current_xact_id()::TEXT::BIGINT
+        WHERE product_id = OLD.product_id;
+    ELSE
+        UPDATE products SET row_version = pg_current_xact_id()::TEXT::BIGINT
+        WHERE product_id = NEW.product_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION record_product_deletion() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO product_deletions (product_id, row_version)
+    VALUES (OLD.product_id, pg_current_xact_id()::TEXT::BIGINT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_row_version
+BEFORE UPDATE OF url, product_code, product_name, website_id
+ON products FOR EACH ROW EXECUTE FUNCTION bump_row_version();
+
+CREATE TRIGGER products_requeued
+BEFORE UPDATE OF next_due_at ON products FOR EACH ROW
+WHEN (NEW.next_due_at IS NULL AND OLD.next_due_at IS NOT NULL)
+EXECUTE FUNCTION bump_row_version();
+
+CREATE TRIGGER products_deletion
+AFTER DELETE ON products FOR EACH ROW EXECUTE FUNCTION record_product_deletion();
+
+CREATE TRIGGER latest_prices_product_version
+AFTER INSERT OR UPDATE OR DELETE ON latest_prices
+FOR EACH ROW EXECUTE FUNCTION bump_product_version();
+
+CREATE TRIGGER subscriptions_product_version
+AFTER INSERT OR UPDATE OR DELETE ON subscriptions
+FOR EACH ROW EXECUTE FUNCTION bump_product_version();
@@ -64,7 +64,8 @@ resource "aws_lambda_function" "test_lambda" {
             DB_USER = "${var.DB_USER}",
             DB_PASSWORD = "${var.DB_PASSWORD}",
             ACCESS_KEY = "${var.ACCESS_KEY}",
-            SECRET_ACCESS_KEY = "${var.SECRET_ACCESS_KEY}"
+            SECRET_ACCESS_KEY = "${var.SECRET_ACCESS_KEY}",
+            CLAIM_CHECK = "${var.CLAIM_CHECK}"
         }
     }
     package_type = "Image"
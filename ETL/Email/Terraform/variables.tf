@@ -34,4 +34,9 @@ variable "DB_USER" {
 
 variable "DB_NAME" {
     type = string
-}
\ No newline at end of file
+}
+
+variable "CLAIM_CHECK" {
+    type = string
+    default = ""
+}
@@ -0,0 +1,78 @@
+"""Backfill Script: loads the readings Pipeline/reparse_archive.py re-derived from the raw
+response archive into price_readings and latest_prices, e.g. after a parser fix.
+
+Only readings with a product_id, a price and no error are loaded, so run reparse_archive.py
+with --products. Readings are written in batches with the same upsert as the lambda, so a
+reading older than a product's latest price leaves latest_prices as it is.
+
+Usage:
+    python backfill_readings.py readings.jsonl
+    python backfill_readings.py readings.jsonl --batch-size 500
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime
+import json
+import logging
+from os import environ as CONFIG
+from typing import Iterable, Iterator
+
+from dotenv import load_dotenv
+from psycopg2.extensions import connection
+
+from email_helpers import get_connection
+from combined_load import write_new_price_entries_to_db
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def read_loadable_readings(lines: Iterable[str]) -> Iterator[dict]:
+    """Yields every re-parsed reading with a product_id, a price and no error, in the shape
+    write_new_price_entries_to_db takes."""
+    for line in lines:
+        if not line.strip():
+            continue
+        reading = json.loads(line)
+        if (reading.get("error") or reading.get("product_id") is None
+                or reading.get("current_price") is None):
+            continue
+        yield {"product_id": reading["product_id"],
+               "reading_at": datetime.fromisoformat(reading["reading_at"]),
+               "current_price": reading["current_price"]}
+
+
+def backfill_readings(conn: connection, readings: Iterable[dict],
+                      batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Writes the readings to the database, committing every batch_size readings.
+    Returns the number of readings written."""
+    if not isinstance(batch_size, int) or batch_size <= 0:
+        logging.error("Batch size must be a positive integer.")
+        raise ValueError("Batch size must be a positive integer.")
+    written = 0
+    batch = []
+    for reading in readings:
+        batch.append(reading)
+        if len(batch) == batch_size:
+            write_new_price_entries_to_db(conn, batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        write_new_price_entries_to_db(conn, batch)
+        written += len(batch)
+    return written
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("readings", help="JSON lines written by reparse_archive.py.")
+    arg_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level="INFO")
+    load_dotenv()
+    db_conn = get_connection(CONFIG)
+    with open(args.readings, encoding="utf-8") as readings_file:
+        count = backfill_readings(db_conn, read_loadable_readings(readings_file),
+                                  args.batch_size)
+    db_conn.close()
+    logging.info("Backfilled %s readings.", count)
@@ -0,0 +1,151 @@
+"""Claim check: stores a stage's payload as a gzip-compressed JSON object in a local directory
+or S3 and passes on a small reference to it instead, so the Step Functions payload limit
+bounds how many batches a run can carry rather than how many products.
+
+The Provision, Pipeline and Email lambdas each ship an identical copy of this module."""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+import gzip
+import json
+import logging
+from os import environ as ENV
+import os
+from threading import Lock
+from uuid import uuid4
+
+import boto3
+
+CLAIM_CHECK_THREADS = 32
+
+CLAIM_STORES = {"pid": None, "stores": {}}
+CLAIM_STORES_LOCK = Lock()
+
+
+class FileClaimStore:
+    """Stores claimed payloads as files under a local directory, for tests and local runs."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def put_object(self, key: str, data: bytes) -> None:
+        """Stores a compressed payload. It is written to a temporary file first, so a reader
+        never sees a partial payload."""
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as claim_file:
+            claim_file.write(data)
+        os.replace(temporary_path, path)
+
+    def get_object(self, key: str) -> bytes:
+        """Returns a compressed payload."""
+        with open(os.path.join(self.root, key), "rb") as claim_file:
+            return claim_file.read()
+
+
+class S3ClaimStore:
+    """Stores claimed payloads as objects in S3, so that every stage of a run can read them.
+    The bucket should expire old claims with a lifecycle rule."""
+
+    def __init__(self, bucket: str, prefix: str, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client(
+            "s3",
+            aws_access_key_id=ENV.get("ACCESS_KEY"),
+            aws_secret_access_key=ENV.get("SECRET_ACCESS_KEY")
+        )
+
+    def put_object(self, key: str, data: bytes) -> None:
+        """Stores a compressed payload."""
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def get_object(self, key: str) -> bytes:
+        """Returns a compressed payload."""
+        response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        return response["Body"].read()
+
+
+def create_claim_store(location: str):
+    """Returns a claim store for a location of the form file://<directory> or
+    s3://<bucket>/<prefix>."""
+    if not isinstance(location, str):
+        logging.error("Claim check location must be of type string.")
+        raise TypeError("Claim check location must be of type string.")
+    scheme, _, path = location.partition("://")
+    if not path:
+        logging.error("Invalid claim check location %s", location)
+        raise ValueError(f"Invalid claim check location {location}")
+    if scheme == "file":
+        return FileClaimStore(path)
+    if scheme == "s3":
+        bucket, _, prefix = path.partition("/")
+        return S3ClaimStore(bucket, prefix)
+    logging.error("Unknown claim check store %s", scheme)
+    raise ValueError(f"Unknown claim check store {scheme}")
+
+
+def get_claim_store(location: str):
+    """Returns the claim store of a location, created once per process and location."""
+    with CLAIM_STORES_LOCK:
+        if CLAIM_STORES["pid"] != os.getpid():
+            CLAIM_STORES["stores"] = {}
+            CLAIM_STORES["pid"] = os.getpid()
+        if location not in CLAIM_STORES["stores"]:
+            CLAIM_STORES["stores"][location] = create_claim_store(location)
+        return CLAIM_STORES["stores"][location]
+
+
+def get_claim_check_location() -> str | None:
+    """Returns the store configured by CLAIM_CHECK, or None if payloads are passed inline."""
+    return ENV.get("CLAIM_CHECK") or None
+
+
+def encode_value(value):
+    """Encodes the database values JSON has no type for: prices as numbers and times in
+    ISO format."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def is_claim_check(value) -> bool:
+    """Returns True if a value is a reference to a claimed payload."""
+    return isinstance(value, dict) and "claim_check" in value and "key" in value
+
+
+def check_in(payload, location: str) -> dict:
+    """Stores a payload in the claim store at location and returns the reference to it."""
+    key = f"claims/{datetime.now():%Y-%m-%d}/{uuid4().hex}.json.gz"
+    data = gzip.compress(json.dumps(payload, separators=(",", ":"),
+                                    default=encode_value).encode())
+    get_claim_store(location).put_object(key, data)
+    return {"claim_check": location, "key": key}
+
+
+def check_out(value):
+    """Returns the payload a reference points to. Any other value is returned unchanged, so a
+    stage accepts inline payloads as well as references."""
+    if not is_claim_check(value):
+        return value
+    data = get_claim_store(value["claim_check"]).get_object(value["key"])
+    return json.loads(gzip.decompress(data))
+
+
+def check_in_all(payloads: list, location: str) -> list[dict]:
+    """Stores every payload concurrently and returns their references in order."""
+    with ThreadPoolExecutor(max_workers=CLAIM_CHECK_THREADS) as executor:
+        return list(executor.map(lambda payload: check_in(payload, location), payloads))
+
+
+def check_out_all(values: list) -> list:
+    """Returns the payload of every reference concurrently, in order, leaving inline
+    payloads unchanged."""
+    if not any(is_claim_check(value) for value in values):
+        return values
+    with ThreadPoolExecutor(max_workers=CLAIM_CHECK_THREADS) as executor:
+        return list(executor.map(check_out, values))
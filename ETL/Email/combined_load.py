@@ -4,11 +4,22 @@
 
 import logging
 from itertools import chain
+from operator import itemgetter
 
 from psycopg2.extensions import connection
 
 from email_helpers import get_cursor
 
+PERSISTENT_FAILURES = ("NotFound", "WrongPage", "MissingPrice")
+FETCH_COST_WEIGHT = 0.3
+LATEST_PRICE_UPSERT = """ ON CONFLICT (product_id) DO UPDATE
+    SET reading_at = EXCLUDED.reading_at, price = EXCLUDED.price,
+    price_changes = latest_prices.price_changes
+        + (latest_prices.price <> EXCLUDED.price)::INTEGER,
+    last_change_at = CASE WHEN latest_prices.price <> EXCLUDED.price
+                     THEN EXCLUDED.reading_at ELSE latest_prices.last_change_at END
+    WHERE latest_prices.reading_at <= EXCLUDED.reading_at;"""
+
 def create_single_insert_format_string(num_of_values: int) -> str:
     """Creates a single insert format string that can be used to insert a single row."""
     if not isinstance(num_of_values, int):
@@ -44,10 +55,29 @@ def create_multiple_insert_format_string(num_of_values: int, single_insert_forma
         raise TypeError("the single insert format string that is repeated must be of type string.")
     return ", ".join([single_insert_format]*num_of_values) + ";"
 
+def get_price_rounds(readings: tuple[tuple]) -> list[list[tuple]]:
+    """Splits a batch of (product_id, reading_at, price) readings into rounds holding at most
+    one reading of each product, oldest first. An upsert can only change a row once, so each
+    round is upserted into latest_prices on its own and no price change is missed."""
+    by_product = {}
+    for reading in readings:
+        by_product.setdefault(reading[0], []).append(reading)
+    rounds = []
+    for product_readings in by_product.values():
+        for index, reading in enumerate(sorted(product_readings, key=itemgetter(1))):
+            if index == len(rounds):
+                rounds.append([])
+            rounds[index].append(reading)
+    return rounds
+
 def write_new_price_entries_to_db(conn: connection,
                                   products: list[dict]) -> None:
     """Writes new entries into the price_readings table in
-    the database given a list of products."""
+    the database given a list of products, and updates each product's row in latest_prices
+    in the same transaction, so provision never reads a price older than the history.
+    The upsert also counts the product's price changes and when it last changed, which
+    provision's polling planner reads instead of scanning the history. Readings older than
+    a product's latest price leave its row as it is."""
     logging.info("Start performing type checks.")
     if not isinstance(conn, connection):
         logging.error("Database connection object must be of type connection.")
@@ -71,12 +101,103 @@ def write_new_price_entries_to_db(conn: connection,
         create_single_insert_format_string(len(data_to_be_inserted[0]))
     )
     query = "INSERT INTO price_readings (product_id, reading_at, price) VALUES " + formatted_input
+    price_rounds = get_price_rounds(data_to_be_inserted)
     logging.info("Successfully format insert query.")
     logging.info("Start entering data into database.")
     with get_cursor(conn) as cur:
         cur.execute(query, tuple(chain.from_iterable(data_to_be_inserted)))
+        for price_round in price_rounds:
+            cur.execute("INSERT INTO latest_prices (product_id, reading_at, price, "
+                        "first_reading_at) VALUES "
+                        + ", ".join([create_single_insert_format_string(4)] * len(price_round))
+                        + LATEST_PRICE_UPSERT,
+                        tuple(chain.from_iterable((*reading, reading[1])
+                                                  for reading in price_round)))
     conn.commit()
     logging.info("Successfully enter data into database.")
 
+def requeue_unfinished_products(conn: connection, product_ids: list[int]) -> None:
+    """Clears the next poll time of products the pipeline did not finish before its
+    deadline, so provision emits them on its next run."""
+    if not isinstance(conn, connection):
+        logging.error("Database connection object must be of type connection.")
+        raise TypeError("Database connection object must be of type connection.")
+    if not isinstance(product_ids, list):
+        logging.error("Product ids must be a list.")
+        raise TypeError("Product ids must be a list.")
+    if len(product_ids) == 0:
+        return
+    with get_cursor(conn) as cur:
+        cur.execute("UPDATE products SET next_due_at = NULL WHERE product_id IN %s",
+                    (tuple(product_ids),))
+    conn.commit()
+    logging.info("Re-queued %s unfinished products.", len(product_ids))
+
+def record_product_failures(conn: connection, failures: list[dict]) -> None:
+    """Adds the products that failed for a persistent reason (a missing page, the wrong page
+    or no price) to the failure ledger, counting how many runs in a row they have failed.
+    Transient failures such as timeouts are not recorded."""
+    if not isinstance(conn, connection):
+        logging.error("Database connection object must be of type connection.")
+        raise TypeError("Database connection object must be of type connection.")
+    if not isinstance(failures, list):
+        logging.error("Failures must be a list.")
+        raise TypeError("Failures must be a list.")
+    reasons = {failure["product_id"]: failure["error"] for failure in failures
+               if isinstance(failure, dict) and failure.get("error") in PERSISTENT_FAILURES}
+    if len(reasons) == 0:
+        return
+    query = ("INSERT INTO product_failures "
+             "(product_id, reason, failure_count, first_failed_at, last_failed_at) VALUES "
+             + ", ".join(["(%s, %s, 1, NOW(), NOW())"] * len(reasons))
+             + """ ON CONFLICT (product_id) DO UPDATE SET reason = EXCLUDED.reason,
+                 failure_count = product_failures.failure_count + 1,
+                 last_failed_at = EXCLUDED.last_failed_at""")
+    with get_cursor(conn) as cur:
+        cur.execute(query, tuple(chain.from_iterable(reasons.items())))
+    conn.commit()
+    logging.info("Recorded %s persistently failing products.", len(reasons))
+
+def clear_product_failures(conn: connection, product_ids: list[int]) -> None:
+    """Removes products that gave a reading again from the failure ledger."""
+    if not isinstance(conn, connection):
+        logging.error("Database connection object must be of type connection.")
+        raise TypeError("Database connection object must be of type connection.")
+    if not isinstance(product_ids, list):
+        logging.error("Product ids must be a list.")
+        raise TypeError("Product ids must be a list.")
+    if len(product_ids) == 0:
+        return
+    with get_cursor(conn) as cur:
+        cur.execute("DELETE FROM product_failures WHERE product_id IN %s",
+                    (tuple(product_ids),))
+    conn.commit()
+    logging.info("Cleared %s recovered products from the failure ledger.", len(product_ids))
+
+def record_fetch_costs(conn: connection, costs: list[dict]) -> None:
+    """Folds the seconds each product took to extract into its products.fetch_seconds, an
+    exponentially weighted average giving the latest run FETCH_COST_WEIGHT, so Provision can
+    pack batches by expected runtime without one slow run skewing them."""
+    if not isinstance(conn, connection):
+        logging.error("Database connection object must be of type connection.")
+        raise TypeError("Database connection object must be of type connection.")
+    if not isinstance(costs, list):
+        logging.error("Costs must be a list.")
+        raise TypeError("Costs must be a list.")
+    seconds = {cost["product_id"]: float(cost["seconds"]) for cost in costs
+               if isinstance(cost, dict) and isinstance(cost.get("product_id"), int)
+               and isinstance(cost.get("seconds"), (int, float))}
+    if len(seconds) == 0:
+        return
+    query = ("UPDATE products SET fetch_seconds = COALESCE("
+             "products.fetch_seconds * (1 - %s) + costs.seconds * %s, costs.seconds) "
+             "FROM (VALUES " + ", ".join(["(%s, %s::REAL)"] * len(seconds))
+             + ") AS costs (product_id, seconds) WHERE products.product_id = costs.product_id")
+    with get_cursor(conn) as cur:
+        cur.execute(query, (FETCH_COST_WEIGHT, FETCH_COST_WEIGHT)
+                    + tuple(chain.from_iterable(seconds.items())))
+    conn.commit()
+    logging.info("Recorded the fetch cost of %s products.", len(seconds))
+
 if __name__ == "__main__":
     logging.basicConfig(level="INFO")
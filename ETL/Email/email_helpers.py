@@ -50,3 +50,40 @@ def filter_on_current_price_less_than_previous_price(price_reading):
     """Provides a filter on the current price being less than the previous price."""
     return ((not price_reading["price"]) or
             price_reading["current_price"] < price_reading["price"])
+
+
+def split_pipeline_outputs(outputs: list) -> tuple[list[dict], list[int]]:
+    """Splits the pipeline outputs of the map state into their readings and the ids of the
+    products left unfinished. Outputs may also be plain lists of readings."""
+    readings, unfinished = [], []
+    for output in outputs:
+        if isinstance(output, dict):
+            readings.extend(output.get("readings", []))
+            unfinished.extend(output.get("unfinished", []))
+        elif isinstance(output, list):
+            readings.extend(output)
+        else:
+            logging.error("Pipeline outputs must be lists or dicts.")
+            raise TypeError("Pipeline outputs must be lists or dicts.")
+    return readings, unfinished
+
+
+def split_failure_outputs(outputs: list) -> tuple[list[dict], list[int]]:
+    """Collects the failure records of the pipeline outputs and the ids of the previously
+    failing products that gave a reading. Plain lists of readings have neither."""
+    failures, recovered = [], []
+    for output in outputs:
+        if isinstance(output, dict):
+            failures.extend(output.get("failures", []))
+            recovered.extend(output.get("recovered", []))
+    return failures, recovered
+
+
+def split_cost_outputs(outputs: list) -> list[dict]:
+    """Collects the cost records of the pipeline outputs, the seconds each finished product
+    took to extract. Plain lists of readings have none."""
+    costs = []
+    for output in outputs:
+        if isinstance(output, dict):
+            costs.extend(output.get("costs", []))
+    return costs
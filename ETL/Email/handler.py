@@ -4,32 +4,47 @@
 from os import environ as CONFIG
 import logging
 from datetime import datetime
-from itertools import chain
-
 
 from email_helpers import (get_connection, get_ses_client,
-                           filter_on_current_price_less_than_previous_price)
-from combined_load import write_new_price_entries_to_db
+                           filter_on_current_price_less_than_previous_price,
+                           split_pipeline_outputs, split_failure_outputs,
+                           split_cost_outputs)
+from claim_check import check_out_all
+from combined_load import (write_new_price_entries_to_db, requeue_unfinished_products,
+                           record_product_failures, clear_product_failures,
+                           record_fetch_costs)
 from email_service import PRODUCT_READING_KEYS, verify_keys, send_emails
 
 
-def handler(_event: list[list[dict]], _context) -> None:
+def handler(_event: list[dict], _context) -> None:
     """Handler takes in product readings where price has decreased
     or product is on sale.
 
-    Using this it emails customers and inserts the readings into the database."""
+    Using this it emails customers and inserts the readings into the database.
+    Products the pipeline did not finish are re-queued for the next run, and the failure
+    ledger is updated with the products that failed or recovered. The time each product
+    took to extract is folded into its fetch cost, which Provision packs batches by.
+    Outputs the pipeline checked in are read from the claim check store first."""
 
     logging.basicConfig(level="INFO")
 
     if not isinstance(_event, list):
-        logging.error("_event must be a list of lists.")
-        return {"status": "Product entries are not a list of lists."}
+        logging.error("_event must be a list of pipeline outputs.")
+        return {"status": "Pipeline outputs are not a list."}
+    _event = check_out_all(_event)
 
-    _event = list(chain.from_iterable(_event))
+    failures, recovered = split_failure_outputs(_event)
+    costs = split_cost_outputs(_event)
+    try:
+        _event, unfinished = split_pipeline_outputs(_event)
+    except TypeError:
+        return {"status": "Pipeline outputs are not lists or dicts."}
 
-    if not isinstance(_event, list):
-        logging.error("Product entries are not of type list.")
-        return {"status": "Product entries are not a list."}
+    conn = get_connection(CONFIG)
+    requeue_unfinished_products(conn, unfinished)
+    record_product_failures(conn, failures)
+    clear_product_failures(conn, recovered)
+    record_fetch_costs(conn, costs)
 
     _event = list(
         filter(lambda x: (isinstance(x, dict)
@@ -49,7 +64,6 @@ def handler(_event: list[list[dict]], _context) -> None:
             _event.pop(i)
     logging.info("Successfully converted Datetime.")
 
-    conn = get_connection(CONFIG)
     ses_client = get_ses_client(CONFIG)
     logging.info("Start entering new price entries to database.")
     write_new_price_entries_to_db(conn, _event)
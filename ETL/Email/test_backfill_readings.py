@@ -0,0 +1,48 @@
+"""test file for backfill_readings.py"""
+
+from unittest.mock import MagicMock, patch
+from datetime import datetime
+import json
+
+import pytest
+from psycopg2.extensions import connection
+
+from backfill_readings import read_loadable_readings, backfill_readings
+
+
+def test_read_loadable_readings():
+    """test only readings with a product_id, a price and no error are loaded."""
+    lines = [json.dumps({"url": "u", "website_name": "patagonia", "product_id": 7,
+                         "reading_at": "2024-06-01 12:00:00", "current_price": 70,
+                         "is_on_sale": True}),
+             json.dumps({"product_id": None, "reading_at": "2024-06-01 12:00:00",
+                         "current_price": 10, "error": "UnknownProduct"}),
+             json.dumps({"product_id": 8, "reading_at": "2024-06-01 12:00:00",
+                         "current_price": None, "error": "MissingPrice"}),
+             ""]
+    assert list(read_loadable_readings(lines)) == [
+        {"product_id": 7, "reading_at": datetime(2024, 6, 1, 12), "current_price": 70}]
+
+
+@patch("backfill_readings.write_new_price_entries_to_db")
+def test_backfill_readings_batches(mock_write):
+    """test the readings are written in batches."""
+    mock_conn = MagicMock(spec=connection)
+    readings = [{"product_id": product_id, "reading_at": datetime(2024, 6, 1),
+                 "current_price": 10} for product_id in range(5)]
+    assert backfill_readings(mock_conn, iter(readings), 2) == 5
+    assert [len(call[0][1]) for call in mock_write.call_args_list] == [2, 2, 1]
+
+
+@patch("backfill_readings.write_new_price_entries_to_db")
+def test_backfill_readings_nothing_to_load(mock_write):
+    """test nothing is written without readings."""
+    assert backfill_readings(MagicMock(spec=connection), []) == 0
+    mock_write.assert_not_called()
+
+
+@pytest.mark.parametrize("batch_size", [0, -1, 1.5])
+def test_backfill_readings_invalid_batch_size(batch_size):
+    """test for value error in the batch size."""
+    with pytest.raises(ValueError):
+        backfill_readings(MagicMock(spec=connection), [], batch_size)
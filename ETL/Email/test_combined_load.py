@@ -8,7 +8,12 @@ from psycopg2.extensions import connection
 
 from combined_load import (create_single_insert_format_string,
                            create_multiple_insert_format_string,
-                           write_new_price_entries_to_db)
+                           write_new_price_entries_to_db,
+                           get_price_rounds,
+                           requeue_unfinished_products,
+                           record_product_failures,
+                           clear_product_failures,
+                           record_fetch_costs)
 
 
 @pytest.mark.parametrize("inp_out", [[1, "(%s)"], [2, "(%s,%s)"], [3, "(%s,%s,%s)"],
@@ -76,15 +81,25 @@ def test_write_new_price_entries_to_db_valid(mock_get_cursor,
                                              fake_products):
     """test a valid case."""
     mock_conn = MagicMock(spec=connection)
+    mock_create_single_insert_format_string.return_value = "(%s,%s,%s)"
     write_new_price_entries_to_db(mock_conn, fake_products)
     assert mock_get_cursor.return_value.__enter__.call_count == 1
-    assert mock_get_cursor.return_value.__enter__.return_value.execute.call_count == 1
-    assert mock_get_cursor.return_value.__enter__.return_value.execute.call_args[0][1] == (
+    execute = mock_get_cursor.return_value.__enter__.return_value.execute
+    assert execute.call_count == 2
+    assert execute.call_args_list[0][0][1] == (
         1, datetime(2024, 6, 19, 17, 28), 83.99, 2, datetime(
             2024, 6, 19, 17, 28), 340.99, 3,
         datetime(2024, 6, 19, 17, 28), 18.99)
-    assert mock_create_single_insert_format_string.call_count == 1
-    assert mock_create_single_insert_format_string.call_args[0][0] == 3
+    assert "INSERT INTO latest_prices" in execute.call_args_list[1][0][0]
+    assert "price_changes = latest_prices.price_changes" in execute.call_args_list[1][0][0]
+    assert execute.call_args_list[1][0][1] == (
+        1, datetime(2024, 6, 19, 17, 28), 83.99, datetime(2024, 6, 19, 17, 28),
+        2, datetime(2024, 6, 19, 17, 28), 340.99, datetime(2024, 6, 19, 17, 28),
+        3, datetime(2024, 6, 19, 17, 28), 18.99, datetime(2024, 6, 19, 17, 28))
+    assert mock_conn.commit.call_count == 1
+    assert mock_create_single_insert_format_string.call_count == 2
+    assert mock_create_single_insert_format_string.call_args_list[0][0][0] == 3
+    assert mock_create_single_insert_format_string.call_args[0][0] == 4
     assert mock_create_multiple_insert_format_string.call_count == 1
     assert mock_create_multiple_insert_format_string.call_args[0][0] == 3
 
@@ -111,3 +126,137 @@ def test_write_new_price_entries_to_db_type_error_3(fake_products):
     mock_conn = MagicMock(spec=connection)
     with pytest.raises(TypeError):
         write_new_price_entries_to_db(mock_conn, fake_products)
+
+
+def test_get_price_rounds():
+    """test each round holds at most one reading of each product, oldest first."""
+    readings = ((1, datetime(2024, 6, 19, 17, 0), 10), (2, datetime(2024, 6, 19, 17, 0), 20),
+                (1, datetime(2024, 6, 19, 18, 0), 9), (1, datetime(2024, 6, 19, 16, 0), 11))
+    assert get_price_rounds(readings) == [
+        [(1, datetime(2024, 6, 19, 16, 0), 11), (2, datetime(2024, 6, 19, 17, 0), 20)],
+        [(1, datetime(2024, 6, 19, 17, 0), 10)],
+        [(1, datetime(2024, 6, 19, 18, 0), 9)]]
+
+
+@patch("combined_load.get_cursor")
+def test_write_new_price_entries_to_db_upserts_each_round(mock_get_cursor, fake_products):
+    """test a product read twice in a batch is upserted once per reading, oldest first."""
+    later = {**fake_products[0], "reading_at": datetime(2024, 6, 19, 18, 0),
+             "current_price": 80.0}
+    write_new_price_entries_to_db(MagicMock(spec=connection), [later, *fake_products])
+    execute = mock_get_cursor.return_value.__enter__.return_value.execute
+    assert execute.call_count == 3
+    assert execute.call_args_list[1][0][1][:4] == (
+        1, datetime(2024, 6, 19, 17, 28), 83.99, datetime(2024, 6, 19, 17, 28))
+    assert execute.call_args_list[2][0][1] == (
+        1, datetime(2024, 6, 19, 18, 0), 80.0, datetime(2024, 6, 19, 18, 0))
+
+
+@patch("combined_load.get_cursor")
+def test_requeue_unfinished_products_valid(mock_get_cursor):
+    """test unfinished products are re-queued in one update."""
+    mock_conn = MagicMock(spec=connection)
+    requeue_unfinished_products(mock_conn, [1, 3])
+    execute = mock_get_cursor.return_value.__enter__.return_value.execute
+    assert execute.call_count == 1
+    assert "SET next_due_at = NULL" in execute.call_args[0][0]
+    assert execute.call_args[0][1] == ((1, 3),)
+    assert mock_conn.commit.call_count == 1
+
+
+@patch("combined_load.get_cursor")
+def test_requeue_unfinished_products_empty(mock_get_cursor):
+    """test nothing is executed when every product finished."""
+    mock_conn = MagicMock(spec=connection)
+    requeue_unfinished_products(mock_conn, [])
+    assert mock_get_cursor.call_count == 0
+    assert mock_conn.commit.call_count == 0
+
+
+@pytest.mark.parametrize("conn_type, product_ids", [(int, [1]), (dict, [1]),
+                                                    (connection, (1,)), (connection, 1)])
+def test_requeue_unfinished_products_type_error(conn_type, product_ids):
+    """test for type errors in the connection obj and product ids."""
+    mock_conn = MagicMock(spec=conn_type)
+    with pytest.raises(TypeError):
+        requeue_unfinished_products(mock_conn, product_ids)
+
+
+@patch("combined_load.get_cursor")
+def test_record_product_failures_valid(mock_get_cursor):
+    """test only persistent failures are upserted into the ledger, once per product."""
+    mock_conn = MagicMock(spec=connection)
+    record_product_failures(mock_conn, [
+        {"product_id": 1, "error": "NotFound", "elapsed_seconds": 0.1},
+        {"product_id": 2, "error": "NoReading", "elapsed_seconds": 0.1},
+        {"product_id": 3, "error": "KeyError", "elapsed_seconds": 0.1},
+        {"product_id": 4, "error": "MissingPrice", "elapsed_seconds": 0.1},
+        {"product_id": 4, "error": "WrongPage", "elapsed_seconds": 0.1}])
+    execute = mock_get_cursor.return_value.__enter__.return_value.execute
+    assert execute.call_count == 1
+    assert "ON CONFLICT (product_id)" in execute.call_args[0][0]
+    assert execute.call_args[0][1] == (1, "NotFound", 4, "WrongPage")
+    assert mock_conn.commit.call_count == 1
+
+
+@patch("combined_load.get_cursor")
+def test_record_product_failures_transient_only(mock_get_cursor):
+    """test nothing is executed when no failure is persistent."""
+    mock_conn = MagicMock(spec=connection)
+    record_product_failures(mock_conn, [{"product_id": 2, "error": "NoReading"}])
+    assert mock_get_cursor.call_count == 0
+
+
+@pytest.mark.parametrize("conn_type, failures", [(int, []), (connection, {}),
+                                                 (connection, None)])
+def test_record_product_failures_type_error(conn_type, failures):
+    """test for type errors in the connection obj and failures."""
+    mock_conn = MagicMock(spec=conn_type)
+    with pytest.raises(TypeError):
+        record_product_failures(mock_conn, failures)
+
+
+@patch("combined_load.get_cursor")
+def test_clear_product_failures_valid(mock_get_cursor):
+    """test recovered products are removed from the ledger in one delete."""
+    mock_conn = MagicMock(spec=connection)
+    clear_product_failures(mock_conn, [5, 6])
+    execute = mock_get_cursor.return_value.__enter__.return_value.execute
+    assert "DELETE FROM product_failures" in execute.call_args[0][0]
+    assert execute.call_args[0][1] == ((5, 6),)
+    assert mock_conn.commit.call_count == 1
+
+
+@patch("combined_load.get_cursor")
+def test_clear_product_failures_empty(mock_get_cursor):
+    """test nothing is executed when no product recovered."""
+    clear_product_failures(MagicMock(spec=connection), [])
+    assert mock_get_cursor.call_count == 0
+
+
+@patch("combined_load.get_cursor")
+def test_record_fetch_costs_valid(mock_get_cursor):
+    """test valid costs are folded into products.fetch_seconds in one update."""
+    mock_conn = MagicMock(spec=connection)
+    record_fetch_costs(mock_conn, [{"product_id": 1, "seconds": 0.5},
+                                   {"product_id": 2, "seconds": None},
+                                   {"product_id": 3, "seconds": 2}])
+    execute = mock_get_cursor.return_value.__enter__.return_value.execute
+    assert execute.call_count == 1
+    assert "UPDATE products SET fetch_seconds" in execute.call_args[0][0]
+    assert execute.call_args[0][1] == (0.3, 0.3, 1, 0.5, 3, 2.0)
+    assert mock_conn.commit.call_count == 1
+
+
+@patch("combined_load.get_cursor")
+def test_record_fetch_costs_empty(mock_get_cursor):
+    """test nothing is executed when there are no costs."""
+    record_fetch_costs(MagicMock(spec=connection), [])
+    assert mock_get_cursor.call_count == 0
+
+
+@pytest.mark.parametrize("conn_type, costs", [(int, []), (connection, {}), (connection, None)])
+def test_record_fetch_costs_type_error(conn_type, costs):
+    """test for type errors in the connection obj and costs."""
+    with pytest.raises(TypeError):
+        record_fetch_costs(MagicMock(spec=conn_type), costs)
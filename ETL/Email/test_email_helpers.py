@@ -6,7 +6,8 @@ import pytest
 import botocore.client
 from psycopg2.extensions import connection, cursor
 
-from email_helpers import get_cursor, is_ses
+from email_helpers import (get_cursor, is_ses, split_pipeline_outputs, split_failure_outputs,
+                           split_cost_outputs)
 
 
 def test_get_cursor_valid():
@@ -46,3 +47,34 @@ def test_is_ses_invalid(invalid_types):
     mock_client._service_model = MagicMock()
     mock_client._service_model.service_name = invalid_types[1]
     assert not is_ses(mock_client)
+
+
+def test_split_pipeline_outputs_valid():
+    """test readings and unfinished products are collected from every output."""
+    outputs = [{"readings": [{"product_id": 1}], "unfinished": [2, 3]},
+               {"readings": [{"product_id": 4}], "unfinished": []},
+               [{"product_id": 5}]]
+    assert split_pipeline_outputs(outputs) == (
+        [{"product_id": 1}, {"product_id": 4}, {"product_id": 5}], [2, 3])
+
+
+@pytest.mark.parametrize("invalid_output", ["", 1, None, ("",)])
+def test_split_pipeline_outputs_invalid(invalid_output):
+    """test for invalid pipeline outputs."""
+    with pytest.raises(TypeError):
+        split_pipeline_outputs([invalid_output])
+
+
+def test_split_failure_outputs():
+    """test failures and recovered products are collected from dict outputs only."""
+    failure = {"product_id": 2, "error": "NotFound", "elapsed_seconds": 0.1}
+    outputs = [{"readings": [], "failures": [failure], "recovered": [3]},
+               {"readings": []}, [{"product_id": 4}]]
+    assert split_failure_outputs(outputs) == ([failure], [3])
+
+
+def test_split_cost_outputs():
+    """test costs are collected from dict outputs only."""
+    outputs = [{"readings": [], "costs": [{"product_id": 1, "seconds": 0.5}]},
+               {"readings": []}, [{"product_id": 4}]]
+    assert split_cost_outputs(outputs) == [{"product_id": 1, "seconds": 0.5}]
@@ -0,0 +1,205 @@
+"""Benchmark Script: Runs the real extraction engines against local retailer stand-ins and
+reports throughput, task latency percentiles, CPU time, peak RSS and worker pool start time.
+
+Every case runs in a fresh process so CPU time and peak RSS belong to that case alone.
+Rate limits are lifted unless --keep-rate-limits is given, so the numbers show what the
+pipeline itself can do.
+
+Usage:
+    python benchmark_extract.py --sizes 100 1000 10000 --modes pool async
+    python benchmark_extract.py --latency-ms 150 --error-rate 0.02 --patagonia-html page.html
+"""
+
+from argparse import ArgumentParser
+import json
+import logging
+import multiprocessing
+from os import environ as ENV
+import resource
+from time import perf_counter
+
+import extract_main
+import fetch_policy
+import rate_limiter
+from benchmark_patagonia_parser import build_synthetic_page
+from benchmark_server import RetailerStandIn, StandInServer, make_handler, ASOS_PATH
+from retailer_registry import RETAILERS, supports_stages
+from worker_pool import get_pool_stats, discard_worker_pool, WORKER_POOL
+
+FORK = multiprocessing.get_context("fork")
+TIMING = {"process_task": extract_main.process_task, "latencies": None}
+
+
+def timed_process_task(task):
+    """Runs a task through the pipeline's process_task and records how long it took."""
+    start = perf_counter()
+    try:
+        return TIMING["process_task"](task)
+    finally:
+        TIMING["latencies"].put(perf_counter() - start)
+
+
+def build_products(size: int, patagonia_share: float, patagonia_port: int) -> list[dict]:
+    """Returns size synthetic products, patagonia_share of them from Patagonia."""
+    patagonia_count = round(size * patagonia_share)
+    products = []
+    for i in range(size):
+        is_patagonia = i < patagonia_count
+        products.append({
+            "product_id": i + 1,
+            "product_code": 100000 + i,
+            "product_name": f"Product {i}",
+            "url": (f"http://127.0.0.1:{patagonia_port}/gb/en/product/{i}.html"
+                    if is_patagonia else f"https://www.asos.com/prd/{100000 + i}"),
+            "website_name": "patagonia" if is_patagonia else "asos"
+        })
+    return products
+
+
+def stop_worker_pool() -> None:
+    """Closes the worker pool and waits for its workers to exit, so that their CPU time is
+    counted and the case process can exit."""
+    pool = WORKER_POOL["pool"]
+    if pool is not None:
+        pool.close()
+        pool.join()
+    discard_worker_pool()
+
+
+def get_percentile(ordered: list[float], fraction: float) -> float:
+    """Returns the given percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def get_cpu_seconds() -> float:
+    """Returns the user and system CPU time of this process and its finished children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def get_peak_rss_mb() -> float:
+    """Returns the peak resident set size of this process or any of its children."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def run_case(products: list[dict], mode: str, keep_rate_limits: bool) -> dict:
+    """Extracts every product with the given engine and measures the run."""
+    if not keep_rate_limits:
+        for profile in RETAILERS.values():
+            profile["requests_per_second"] = None
+    rate_limiter.RATE_LIMITERS.clear()
+    fetch_policy.HOST_POLICIES.clear()
+    TIMING["latencies"] = FORK.Queue()
+    extract_main.process_task = timed_process_task
+    task_count = len([task for task in extract_main.build_tasks([dict(p) for p in products])
+                      if mode != "staged"
+                      or not supports_stages(extract_main.get_task_website_name(task))])
+
+    cpu_start = get_cpu_seconds()
+    start = perf_counter()
+    readings, _, _ = extract_main.get_extraction_engine(mode)(products)
+    elapsed = perf_counter() - start
+    pool_start_seconds = get_pool_stats()["start_seconds"]
+    stop_worker_pool()
+    cpu_seconds = get_cpu_seconds() - cpu_start
+
+    latencies = sorted(TIMING["latencies"].get(timeout=10) for _ in range(task_count))
+    return {
+        "mode": mode,
+        "products": len(products),
+        "readings": len(readings),
+        "seconds": elapsed,
+        "products_per_second": len(products) / elapsed,
+        "p50_ms": get_percentile(latencies, 0.50) * 1000,
+        "p95_ms": get_percentile(latencies, 0.95) * 1000,
+        "p99_ms": get_percentile(latencies, 0.99) * 1000,
+        "cpu_seconds": cpu_seconds,
+        "peak_rss_mb": get_peak_rss_mb(),
+        "pool_start_ms": pool_start_seconds * 1000
+    }
+
+
+def run_case_in_process(products: list[dict], mode: str, keep_rate_limits: bool) -> dict:
+    """Runs a case in a fresh process and returns its measurements."""
+    receiver, sender = FORK.Pipe(duplex=False)
+
+    def target():
+        sender.send(json.dumps(run_case(products, mode, keep_rate_limits)))
+
+    process = FORK.Process(target=target)
+    process.start()
+    row = json.loads(receiver.recv())
+    process.join()
+    return row
+
+
+def start_stand_in(stand_in: RetailerStandIn):
+    """Binds a stand-in server and serves it from a separate process, so the server's
+    CPU time is not counted against the pipeline."""
+    server = StandInServer(("127.0.0.1", 0), make_handler(stand_in))
+    process = FORK.Process(target=server.serve_forever, daemon=True)
+    process.start()
+    return server, process
+
+
+def print_rows(rows: list[dict]) -> None:
+    """Prints the benchmark results as a table."""
+    print(f"{'mode':<7}{'products':>9}{'readings':>9}{'seconds':>9}{'prod/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'CPU s':>8}{'RSS MB':>8}{'pool ms':>9}")
+    for row in rows:
+        print(f"{row['mode']:<7}{row['products']:>9}{row['readings']:>9}"
+              f"{row['seconds']:>9.2f}{row['products_per_second']:>9.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+              f"{row['cpu_seconds']:>8.2f}{row['peak_rss_mb']:>8.0f}{row['pool_start_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    arg_parser.add_argument("--modes", nargs="+", default=["pool", "async"],
+                            choices=list(extract_main.EXTRACTION_ENGINES))
+    arg_parser.add_argument("--patagonia-share", type=float, default=0.2,
+                            help="Fraction of the products that are Patagonia pages.")
+    arg_parser.add_argument("--latency-ms", type=float, default=80)
+    arg_parser.add_argument("--jitter-ms", type=float, default=40)
+    arg_parser.add_argument("--error-rate", type=float, default=0.0)
+    arg_parser.add_argument("--page-kb", type=int, default=100,
+                            help="Size of the synthetic Patagonia page.")
+    arg_parser.add_argument("--asos-json", help="A recorded ASOS stockprice response.")
+    arg_parser.add_argument("--patagonia-html", help="A recorded Patagonia product page.")
+    arg_parser.add_argument("--keep-rate-limits", action="store_true")
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    ASOS_TEMPLATE = None
+    if args.asos_json:
+        with open(args.asos_json, encoding="utf-8") as asos_file:
+            ASOS_TEMPLATE = json.load(asos_file)[0]
+    PATAGONIA_PAGE = build_synthetic_page(args.page_kb)
+    if args.patagonia_html:
+        with open(args.patagonia_html, encoding="utf-8") as page_file:
+            PATAGONIA_PAGE = page_file.read()
+
+    servers = [start_stand_in(RetailerStandIn(args.latency_ms, args.jitter_ms, args.error_rate,
+                                              ASOS_TEMPLATE, PATAGONIA_PAGE))
+               for _ in range(2)]
+    asos_server, patagonia_server = servers[0][0], servers[1][0]
+    ENV["ASOS_STOCKPRICE_URL"] = f"http://127.0.0.1:{asos_server.server_port}{ASOS_PATH}"
+    ENV.pop("RESPONSE_CACHE", None)
+
+    results = []
+    for case_size in args.sizes:
+        case_products = build_products(case_size, args.patagonia_share,
+                                       patagonia_server.server_port)
+        for case_mode in args.modes:
+            results.append(run_case_in_process(case_products, case_mode,
+                                               args.keep_rate_limits))
+    print_rows(results)
+
+    for _, server_process in servers:
+        server_process.terminate()
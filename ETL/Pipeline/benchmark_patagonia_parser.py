@@ -0,0 +1,107 @@
+"""Benchmark Script: Compares CPU time and peak memory per page of the full BeautifulSoup
+parse against the fast-path parser in extract_patagonia.
+
+Usage:
+    python benchmark_patagonia_parser.py saved_page_1.html saved_page_2.html
+    python benchmark_patagonia_parser.py --synthetic-kb 600
+"""
+
+from argparse import ArgumentParser
+from time import process_time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from extract_patagonia import get_price_and_sale, get_price_and_sale_fast
+
+SYNTHETIC_PRICE_BLOCK = """
+<div class="product-detail">
+<span class="js-buy-config-price buy-config-price">
+    <span class="sales"><span class="value" content="{price}">£{price}</span></span>
+    <span class="discount-percentage">-30%</span>
+</span>
+</div>
+"""
+SYNTHETIC_FILLER = """
+<div class="tile"><a href="/gb/en/product/{i}.html"><img src="/{i}.jpg" alt="Product {i}">
+<span class="name">Product {i}</span><p>Recycled polyester shell with a DWR finish.</p></a></div>
+"""
+
+
+def build_synthetic_page(size_kb: int, price: int = 100) -> str:
+    """Returns a product page of roughly size_kb with the price block about a third of
+    the way in, similar to where it sits on a real Patagonia page."""
+    filler = []
+    i = 0
+    while sum(len(block) for block in filler) < size_kb * 1024:
+        filler.append(SYNTHETIC_FILLER.format(i=i))
+        i += 1
+    split = len(filler) // 3
+    return ("<html><head><title>Patagonia</title></head><body>"
+            + "".join(filler[:split]) + SYNTHETIC_PRICE_BLOCK.format(price=price)
+            + "".join(filler[split:]) + "</body></html>")
+
+
+def full_parse(html: str):
+    """The original parser: builds the whole tree then searches it."""
+    return get_price_and_sale(BeautifulSoup(html, features="html.parser"))
+
+
+def measure(parser, html: str, repeats: int) -> tuple[float, int, object]:
+    """Returns the CPU seconds per page, peak traced bytes and the parser result."""
+    tracemalloc.start()
+    result = parser(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = process_time()
+    for _ in range(repeats):
+        parser(html)
+    return (process_time() - start) / repeats, peak, result
+
+
+def run_benchmark(pages: dict[str, str], repeats: int) -> list[dict]:
+    """Benchmarks both parsers over every page."""
+    rows = []
+    for name, html in pages.items():
+        full_cpu, full_peak, full_result = measure(full_parse, html, repeats)
+        fast_cpu, fast_peak, fast_result = measure(get_price_and_sale_fast, html, repeats)
+        rows.append({
+            "page": name,
+            "size_kb": len(html) / 1024,
+            "full_ms": full_cpu * 1000,
+            "fast_ms": fast_cpu * 1000,
+            "full_peak_kb": full_peak / 1024,
+            "fast_peak_kb": fast_peak / 1024,
+            "same_result": fast_result is None or fast_result == full_result
+        })
+    return rows
+
+
+def print_rows(rows: list[dict]) -> None:
+    """Prints the benchmark results as a table."""
+    print(f"{'page':<30}{'size KB':>9}{'full ms':>10}{'fast ms':>10}"
+          f"{'full peak KB':>14}{'fast peak KB':>14}{'match':>7}")
+    for row in rows:
+        print(f"{row['page'][-30:]:<30}{row['size_kb']:>9.0f}{row['full_ms']:>10.2f}"
+              f"{row['fast_ms']:>10.2f}{row['full_peak_kb']:>14.0f}"
+              f"{row['fast_peak_kb']:>14.0f}{str(row['same_result']):>7}")
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("pages", nargs="*", help="Saved Patagonia product pages.")
+    arg_parser.add_argument("--synthetic-kb", type=int, default=500,
+                            help="Size of the synthetic page used when no pages are given.")
+    arg_parser.add_argument("--repeats", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    if args.pages:
+        saved_pages = {}
+        for path in args.pages:
+            with open(path, encoding="utf-8") as page_file:
+                saved_pages[path] = page_file.read()
+    else:
+        saved_pages = {"synthetic": build_synthetic_page(args.synthetic_kb)}
+
+    print_rows(run_benchmark(saved_pages, args.repeats))
@@ -0,0 +1,138 @@
+"""Benchmark Server: A local stand-in for the retailers that replays ASOS stockprice JSON
+and Patagonia product pages with configurable latency, jitter and error rate.
+
+Usage:
+    python benchmark_server.py --port 8080 --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+"""
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+from threading import Thread
+from time import sleep
+from urllib.parse import urlparse, parse_qs
+
+from benchmark_patagonia_parser import build_synthetic_page
+
+ASOS_PATH = "/api/product/catalogue/v4/stockprice"
+PATAGONIA_PATH = "/gb/en/product/"
+DEFAULT_PAGE_KB = 100
+
+
+def get_asos_product_info(product_code: int) -> dict:
+    """Returns a stockprice entry for a product, shaped like the real ASOS response.
+    The price is derived from the product code so repeated runs see the same prices."""
+    price = 10 + product_code % 90
+    discount = 20 if product_code % 5 == 0 else 0
+    return {
+        "productId": product_code,
+        "productPrice": {
+            "current": {"value": price, "text": f"£{price}.00"},
+            "discountPercentage": discount
+        }
+    }
+
+
+class RetailerStandIn:
+    """Holds the responses and the fault settings shared by every request handler."""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                 asos_template: dict | None = None, patagonia_page: str | None = None):
+        if not 0 <= error_rate <= 1:
+            raise ValueError("error_rate must be between 0 and 1.")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.asos_template = asos_template
+        self.patagonia_page = (patagonia_page or
+                               build_synthetic_page(DEFAULT_PAGE_KB)).encode()
+
+    def get_delay(self) -> float:
+        """Returns the seconds to wait before answering a request."""
+        delay_ms = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, delay_ms / 1000)
+
+    def should_fail(self) -> bool:
+        """Returns True if this request should be answered with an error."""
+        return random.random() < self.error_rate
+
+    def get_asos_body(self, query: str) -> bytes:
+        """Returns the stockprice JSON for every product ID in the query string."""
+        product_ids = parse_qs(query).get("productIds", [""])[0]
+        product_infos = []
+        for product_id in product_ids.split(","):
+            if not product_id.strip().isdigit():
+                continue
+            product_info = get_asos_product_info(int(product_id))
+            if self.asos_template:
+                product_info = {**self.asos_template, "productId": int(product_id)}
+            product_infos.append(product_info)
+        return json.dumps(product_infos).encode()
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Threaded server with a backlog large enough for thousands of concurrent requests."""
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def make_handler(stand_in: RetailerStandIn) -> type:
+    """Returns a request handler class bound to a stand-in."""
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        """Answers ASOS stockprice and Patagonia product page requests."""
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            """Serves a single request after the configured delay."""
+            sleep(stand_in.get_delay())
+            url = urlparse(self.path)
+            if stand_in.should_fail():
+                self.send_response(503)
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if url.path == ASOS_PATH:
+                body, content_type = stand_in.get_asos_body(url.query), "application/json"
+            elif url.path.startswith(PATAGONIA_PATH):
+                body, content_type = stand_in.patagonia_page, "text/html; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+            """Keeps the benchmark output free of access logs."""
+
+    return StandInHandler
+
+
+def start_server(stand_in: RetailerStandIn, port: int = 0) -> StandInServer:
+    """Starts the stand-in on a background thread. Port 0 picks a free port."""
+    server = StandInServer(("127.0.0.1", port), make_handler(stand_in))
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--port", type=int, default=8080)
+    arg_parser.add_argument("--latency-ms", type=float, default=80)
+    arg_parser.add_argument("--jitter-ms", type=float, default=40)
+    arg_parser.add_argument("--error-rate", type=float, default=0.0)
+    cli_args = arg_parser.parse_args()
+
+    running_server = start_server(
+        RetailerStandIn(cli_args.latency_ms, cli_args.jitter_ms, cli_args.error_rate),
+        cli_args.port)
+    print(f"Serving on http://127.0.0.1:{running_server.server_port}")
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        running_server.shutdown()
@@ -2,6 +2,23 @@
 
 import pytest
 
+import deadline
+import fetch_policy
+import rate_limiter
+import worker_pool
+
+
+@pytest.fixture(autouse=True)
+def reset_fetch_state(monkeypatch):
+    """Gives every test fresh circuit breakers and rate limiters, no retry backoff and no
+    deadline, so failures in one test cannot trip the breaker for the next. Each test also
+    starts without a worker pool."""
+    monkeypatch.setattr(fetch_policy, "BACKOFF_BASE_SECONDS", 0)
+    monkeypatch.setitem(deadline.DEADLINE, "at", None)
+    monkeypatch.setitem(worker_pool.WORKER_POOL, "pool", None)
+    fetch_policy.HOST_POLICIES.clear()
+    rate_limiter.RATE_LIMITERS.clear()
+
 
 @pytest.fixture(name="fake_headers")
 def fixture_fake_headers() -> dict:
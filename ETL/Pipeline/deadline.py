@@ -0,0 +1,61 @@
+"""Run deadline: the time left before the Lambda is killed, shared by every request so that
+no request is allowed to outlive the invocation."""
+
+import logging
+from time import monotonic
+
+import requests
+
+DEADLINE_MARGIN_SECONDS = 5.0
+MIN_REQUEST_SECONDS = 0.5
+
+DEADLINE = {"at": None}
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """Raised instead of sending a request when the run has no time left for it."""
+
+
+def set_deadline(remaining_seconds: float | None,
+                 margin_seconds: float = DEADLINE_MARGIN_SECONDS) -> None:
+    """Sets the deadline to remaining_seconds from now, less a margin kept back for returning
+    the results. None removes the deadline."""
+    if remaining_seconds is None:
+        DEADLINE["at"] = None
+        return
+    if not isinstance(remaining_seconds, (int, float)) or isinstance(remaining_seconds, bool):
+        logging.error("remaining_seconds must be a number.")
+        raise TypeError("remaining_seconds must be a number.")
+    DEADLINE["at"] = monotonic() + remaining_seconds - margin_seconds
+
+
+def get_remaining_seconds() -> float | None:
+    """Returns the seconds left before the deadline, or None if there is no deadline."""
+    if DEADLINE["at"] is None:
+        return None
+    return DEADLINE["at"] - monotonic()
+
+
+def is_out_of_time() -> bool:
+    """Returns True if there is not enough time left before the deadline to send a request."""
+    remaining = get_remaining_seconds()
+    return remaining is not None and remaining < MIN_REQUEST_SECONDS
+
+
+def fit_timeout(timeout: tuple[float, float]) -> tuple[float, float]:
+    """Shortens a (connect, read) timeout so that the request ends before the deadline.
+    Raises DeadlineExceeded if there is not enough time left to send a request at all."""
+    remaining = get_remaining_seconds()
+    if remaining is None:
+        return timeout
+    if remaining < MIN_REQUEST_SECONDS:
+        raise DeadlineExceeded(f"Only {max(remaining, 0):.2f}s left before the deadline")
+    return min(timeout[0], remaining), min(timeout[1], remaining)
+
+
+def get_lambda_remaining_seconds(context) -> float | None:
+    """Returns the seconds the Lambda has left to run, or None without a Lambda context."""
+    get_remaining_time = getattr(context, "get_remaining_time_in_millis", None)
+    if get_remaining_time is None:
+        return None
+    return get_remaining_time() / 1000
@@ -2,9 +2,27 @@
 
 from datetime import datetime
 import logging
+from os import environ as ENV
 
 import requests
 
+from pipeline_helpers import (fetch, ThrottledError, record_failure_reason,
+                              NOT_FOUND_STATUS_CODES, NOT_FOUND, MISSING_PRICE)
+from response_archive import archive_response
+
+WEBSITE_NAME = "asos"
+ASOS_MAX_PRODUCTS_PER_REQUEST = 50
+ASOS_STOCKPRICE_URL = "https://www.asos.com/api/product/catalogue/v4/stockprice"
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)\
+    AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"}
+
+
+def get_asos_stockprice_url() -> str:
+    """Returns the ASOS stockprice endpoint. Setting ASOS_STOCKPRICE_URL points the
+    pipeline at a local stand-in, e.g. for benchmarks."""
+    return ENV.get("ASOS_STOCKPRICE_URL", ASOS_STOCKPRICE_URL)
+
 
 def get_asos_api_url(product_code: int) -> str | None:
     """Returns the API URL for a given product on the ASOS website."""
@@ -12,12 +30,30 @@ def get_asos_api_url(product_code: int) -> str | None:
         logging.error("Product ID must be a integer to get the url.")
         return None
 
-    return f"https://www.asos.com/api/product/catalogue/v4/stockprice?productIds=\
+    return f"{get_asos_stockprice_url()}?productIds=\
         {product_code}&store=COM&currency=GBP&keyStoreDataversion=ornjx7v-36&country=GB"
 
 
+def get_asos_batch_api_url(product_codes: list[int]) -> str | None:
+    """Returns the API URL for several products on the ASOS website at once."""
+    if (not isinstance(product_codes, list) or not product_codes
+            or not all(isinstance(code, int) and not isinstance(code, bool)
+                       for code in product_codes)):
+        logging.error("Product IDs must be a non-empty list of integers to get the url.")
+        return None
+    if len(product_codes) > ASOS_MAX_PRODUCTS_PER_REQUEST:
+        logging.error("At most %s product IDs can be requested at once.",
+                      ASOS_MAX_PRODUCTS_PER_REQUEST)
+        return None
+
+    product_ids = ",".join(str(code) for code in product_codes)
+    return (f"{get_asos_stockprice_url()}?productIds="
+            f"{product_ids}&store=COM&currency=GBP&keyStoreDataversion=ornjx7v-36&country=GB")
+
+
 def get_product_info(product_data: dict, headers: dict) -> dict | None:
-    """Gets the price information for a specified product from the ASOS API."""
+    """Gets the price information for a specified product from the ASOS API, archiving the
+    response when RESPONSE_ARCHIVE is set."""
     if not isinstance(product_data, dict):
         logging.error("product_info must be of type dict")
         raise TypeError("product_info must be of type dict")
@@ -33,25 +69,71 @@ def get_product_info(product_data: dict, headers: dict) -> dict | None:
         return None
 
     try:
-        response = requests.get(price_endpoint, headers, timeout=40)
+        response = fetch(price_endpoint, headers, WEBSITE_NAME, timeout=40)
         response.raise_for_status()
 
+    except ThrottledError as e:
+        logging.warning("Request was throttled in get_product_info: %s", e)
+        return None
     except requests.exceptions.Timeout as e:
         logging.error("Timeout occurred in get_product_info: %s", e)
         return None
     except requests.exceptions.RequestException as e:
         logging.error("RequestException occurred in get_product_info: %s", e)
+        if e.response is not None and e.response.status_code in NOT_FOUND_STATUS_CODES:
+            record_failure_reason(NOT_FOUND, product_data.get("product_id"))
         return None
 
+    archive_response(price_endpoint, response.text, WEBSITE_NAME, response.status_code)
     response_json = response.json()
 
     if "errorCode" in response_json or response_json is None or len(response_json) == 0:
         logging.error("No valid ProductIds requested")
+        record_failure_reason(NOT_FOUND, product_data.get("product_id"))
         return None
 
     return response_json[0]
 
 
+def get_batch_product_info(product_codes: list[int], headers: dict) -> dict[int, dict]:
+    """Gets the price information for several products from the ASOS API in one request.
+    Returns a dictionary of product code to product information; products missing from
+    the response are left out. The response is archived when RESPONSE_ARCHIVE is set."""
+    if not isinstance(headers, dict):
+        logging.error("header must be of type dict")
+        raise TypeError("header must be of type dict")
+
+    price_endpoint = get_asos_batch_api_url(product_codes)
+
+    if not price_endpoint:
+        logging.error("No API found for %s", product_codes)
+        return {}
+
+    try:
+        response = fetch(price_endpoint, headers, WEBSITE_NAME, timeout=40)
+        response.raise_for_status()
+
+    except ThrottledError as e:
+        logging.warning("Request was throttled in get_batch_product_info: %s", e)
+        return {}
+    except requests.exceptions.Timeout as e:
+        logging.error("Timeout occurred in get_batch_product_info: %s", e)
+        return {}
+    except requests.exceptions.RequestException as e:
+        logging.error("RequestException occurred in get_batch_product_info: %s", e)
+        return {}
+
+    archive_response(price_endpoint, response.text, WEBSITE_NAME, response.status_code)
+    response_json = response.json()
+
+    if not isinstance(response_json, list):
+        logging.error("No valid ProductIds requested")
+        return {}
+
+    return {product_info["productId"]: product_info for product_info in response_json
+            if isinstance(product_info, dict) and "productId" in product_info}
+
+
 def get_current_price(product_info: dict) -> int | None:
     """Extracts the current price of the product from the product information."""
     if not isinstance(product_info, dict):
@@ -80,22 +162,49 @@ def get_sale_status(product_info: dict) -> bool | None:
         return None
 
 
-def process_product(product: dict) -> dict | None:
-    """Populates a single product dictionary with current price, reading time, and sale status."""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)\
-        AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"}
+def add_price_reading(product: dict, product_info: dict) -> dict | None:
+    """Populates a single product dictionary with current price, reading time, and sale status
+    from its API product information."""
+    curr_price = get_current_price(product_info)
+    sale = get_sale_status(product_info)
 
-    product_info = get_product_info(product, headers)
+    if not sale is None and not curr_price is None:
+        product["current_price"] = curr_price
+        product["is_on_sale"] = sale
+        product["reading_at"] = datetime.now().isoformat(".", "seconds")
+        return product
+    record_failure_reason(MISSING_PRICE, product.get("product_id"))
+    return None
 
-    if product_info:
-        curr_price = get_current_price(product_info)
-        sale = get_sale_status(product_info)
 
-        if not sale is None and not curr_price is None:
-            product["current_price"] = curr_price
-            product["is_on_sale"] = sale
-            product["reading_at"] = datetime.now().isoformat(".", "seconds")
-            return product
+def process_product(product: dict) -> dict | None:
+    """Populates a single product dictionary with current price, reading time, and sale status."""
+    product_info = get_product_info(product, HEADERS)
+
+    if product_info and add_price_reading(product, product_info):
+        return product
     logging.error("Error processing product %s", product["product_code"])
     return None
+
+
+def process_products(products: list[dict]) -> list[dict | None]:
+    """Populates a list of product dictionaries with current price, reading time, and sale
+    status, using as few API requests as possible. Returns a list in the same order as products,
+    with None for every product that could not be processed."""
+    results = []
+    for start in range(0, len(products), ASOS_MAX_PRODUCTS_PER_REQUEST):
+        batch = products[start:start + ASOS_MAX_PRODUCTS_PER_REQUEST]
+        product_infos = get_batch_product_info(
+            [product["product_code"] for product in batch], HEADERS)
+
+        for product in batch:
+            product_info = product_infos.get(product["product_code"])
+            if product_infos and not product_info:
+                # missing from an otherwise successful response, so ASOS no longer lists it
+                record_failure_reason(NOT_FOUND, product.get("product_id"))
+            if product_info and add_price_reading(product, product_info):
+                results.append(product)
+            else:
+                logging.error("Error processing product %s", product["product_code"])
+                results.append(None)
+    return results
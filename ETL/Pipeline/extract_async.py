@@ -0,0 +1,91 @@
+"""Asyncio Extract Engine: Runs product extractions concurrently with a global
+and a per-website limit on the number of requests in flight."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from typing import Callable
+
+UNFINISHED = object()
+
+
+def get_website_key(product_data) -> str | None:
+    """Returns the website name used to pick the per-website limit.
+    A batch of products is keyed by the website of its first product."""
+    if isinstance(product_data, list) and product_data:
+        product_data = product_data[0]
+    if isinstance(product_data, dict):
+        return product_data.get("website_name")
+    return None
+
+
+async def run_with_limits(product_data, process_function: Callable,
+                          global_limit: asyncio.Semaphore,
+                          website_limit: asyncio.Semaphore,
+                          executor: ThreadPoolExecutor):
+    """Runs a single blocking extraction once both limits have a free slot."""
+    loop = asyncio.get_running_loop()
+    async with global_limit, website_limit:
+        return await loop.run_in_executor(executor, process_function, product_data)
+
+
+async def gather_readings(product_list: list[dict], process_function: Callable, limits: dict,
+                          *, timeout: float | None = None) -> list:
+    """Schedules every product at once and waits for all of them to finish, or until timeout
+    seconds have passed. Results are returned in the same order as product_list, with
+    UNFINISHED for every product still in flight at the timeout; those are cancelled."""
+    global_limit = asyncio.Semaphore(limits["max_concurrency"])
+    max_per_website = limits["max_per_website"]
+    website_limits = limits.get("website_limits") or {}
+    semaphores = {}
+    for website_name in {get_website_key(product_data) for product_data in product_list}:
+        semaphores[website_name] = asyncio.Semaphore(
+            min(max_per_website, website_limits.get(website_name, max_per_website)))
+    executor = ThreadPoolExecutor(max_workers=limits["max_concurrency"])
+    tasks = [asyncio.ensure_future(
+                 run_with_limits(product_data, process_function, global_limit,
+                                 semaphores[get_website_key(product_data)], executor))
+             for product_data in product_list]
+    try:
+        await asyncio.wait(tasks, timeout=timeout)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    results = []
+    for task in tasks:
+        if task.done():
+            results.append(task.result())
+        else:
+            task.cancel()
+            results.append(UNFINISHED)
+    unfinished = sum(result is UNFINISHED for result in results)
+    if unfinished:
+        logging.warning("Cancelled %s extractions still running at the deadline", unfinished)
+    return results
+
+
+def extract_concurrently(product_list: list[dict], process_function: Callable, limits: dict,
+                         *, timeout: float | None = None) -> list:
+    """Runs process_function over product_list on an asyncio event loop.
+
+    The extractors use blocking `requests` calls, so each call is handed to a
+    thread pool sized to limits["max_concurrency"], while the event loop enforces
+    the global limit and limits["max_per_website"]. The optional
+    limits["website_limits"] can lower the per-website limit of individual
+    websites. With a timeout, extractions still running after timeout seconds are
+    cancelled and returned as UNFINISHED."""
+    if not isinstance(product_list, list):
+        logging.error("product_list must be of type list")
+        raise TypeError("product_list must be of type list")
+    if not isinstance(limits, dict):
+        logging.error("limits must be of type dict")
+        raise TypeError("limits must be of type dict")
+    for limit in (limits.get("max_concurrency"), limits.get("max_per_website")):
+        if not isinstance(limit, int) or isinstance(limit, bool):
+            logging.error("Concurrency limits must be integers.")
+            raise TypeError("Concurrency limits must be integers.")
+        if limit <= 0:
+            logging.error("Concurrency limits must be positive integers.")
+            raise ValueError("Concurrency limits must be positive integers.")
+    if not product_list:
+        return []
+    return asyncio.run(gather_readings(product_list, process_function, limits, timeout=timeout))
@@ -1,17 +1,55 @@
 """Combined Extract Script: Identifies the store name and executes the relevant extraction"""
+from os import environ as ENV
 import logging
+from collections import Counter
+from time import perf_counter
+from typing import Iterator
 
-from lambda_multiprocessing import Pool
+from pipeline_helpers import (configure_log, validate_input, remove_stale_products,
+                              configure_session_pool, get_connection_stats,
+                              get_stream_stats, clear_failure_reasons, get_failure_reason,
+                              NO_READING)
+from extract_async import extract_concurrently, UNFINISHED
+from claim_check import check_in, check_out, get_claim_check_location
+from staged_extract import run_stages
+from deadline import (set_deadline, get_remaining_seconds, get_lambda_remaining_seconds,
+                      is_out_of_time, DeadlineExceeded, DEADLINE)
+from rate_limiter import configure_rate_limits
+from fetch_policy import configure_hedge_workers
+from worker_pool import (get_worker_pool, discard_worker_pool, get_pool_stats, run_chunk,
+                         WORKER_POOL)
+from retailer_registry import (register_retailer, get_retailer, get_concurrency_limits,
+                               get_cost_rank, get_batch_key, supports_stages, RETAILERS)
+from extract_asos import (process_product as extract_from_asos,
+                          process_products as extract_batch_from_asos,
+                          ASOS_MAX_PRODUCTS_PER_REQUEST)
+from extract_patagonia import (process_product as extract_from_patagonia,
+                               process_products as extract_pages_from_patagonia,
+                               get_page_key as get_patagonia_page_key,
+                               fetch_products_page as fetch_patagonia_page,
+                               parse_products_page as parse_patagonia_page)
 
-from pipeline_helpers import configure_log, validate_input, remove_stale_products
-from extract_asos import process_product as extract_from_asos
-from extract_patagonia import process_product as extract_from_patagonia
 
+PATAGONIA_MAX_COLOURWAYS_PER_PAGE = 20
 
-EXTRACT_FUNCTIONS = {
-    "asos": extract_from_asos,
-    "patagonia": extract_from_patagonia
-}
+register_retailer("asos", extract_from_asos, cost_class="api", max_concurrency=25,
+                  requests_per_second=20.0, batch_extract=extract_batch_from_asos,
+                  batch_size=ASOS_MAX_PRODUCTS_PER_REQUEST)
+register_retailer("patagonia", extract_from_patagonia, cost_class="html", max_concurrency=8,
+                  requests_per_second=5.0, batch_extract=extract_pages_from_patagonia,
+                  batch_size=PATAGONIA_MAX_COLOURWAYS_PER_PAGE,
+                  coalesce_key=get_patagonia_page_key, fetch_page=fetch_patagonia_page,
+                  parse_page=parse_patagonia_page)
+
+DEFAULT_EXTRACTION_MODE = "pool"
+DEFAULT_MAX_CONCURRENCY = 100
+DEFAULT_MAX_CONCURRENCY_PER_WEBSITE = 25
+COMPLETION_POLL_SECONDS = 0.05
+DEFAULT_FETCH_THREADS = 16
+DEFAULT_FETCHED_QUEUE_SIZE = 32
+UNFINISHED_REASON = "Unfinished"
+
+TASK_COSTS = {}
 
 
 def get_website_name(product_data: dict) -> str | None:
@@ -38,12 +76,13 @@ def process(product_data: dict):
         return None
     website_name = get_website_name(clean_data)
 
-    if not website_name:
+    retailer = get_retailer(website_name)
+    if not retailer:
         logging.error("No API found for %s", product_data["product_code"])
         return None
     logging.info("Starting to run %s extract script.", website_name)
     try:
-        website_data = EXTRACT_FUNCTIONS[website_name](product_data)
+        website_data = retailer["extract"](product_data)
         return website_data
     except ValueError:
         logging.error("extract from product %s failed! for %s ",
@@ -51,27 +90,485 @@ def process(product_data: dict):
         return None
 
 
-def extract_price_and_sales_data(product_list: list[dict]) -> list[dict]:
+def get_rate_limits() -> dict[str, float | None]:
+    """Returns the requests per second allowed for each website."""
+    return {website_name: profile["requests_per_second"]
+            for website_name, profile in RETAILERS.items()}
+
+
+def process_batch(product_list: list[dict]) -> list[dict | None]:
+    """Processes a list of products from the same website with a single batched
+    extraction function."""
+    clean_data = [product for product in product_list if validate_input(product)]
+    if len(clean_data) < len(product_list):
+        logging.error("%s products did not pass validation",
+                      len(product_list) - len(clean_data))
+    if not clean_data:
+        return []
+    website_name = get_website_name(clean_data[0])
+    logging.info("Starting to run %s batch extract script.", website_name)
+    try:
+        return get_retailer(website_name)["batch_extract"](clean_data)
+    except ValueError:
+        logging.error("batch extract from %s failed! for %s products",
+                      website_name, len(clean_data))
+        return []
+
+
+def process_task(task: dict | list[dict]) -> list[dict | None]:
+    """Processes a single task, which is either a single product or a list of products
+    that can be looked up together."""
+    if isinstance(task, list):
+        return process_batch(task)
+    return [process(task)]
+
+
+def get_failure_record(product_id: int, error: Exception | str, elapsed_seconds: float) -> dict:
+    """Returns a record of a product whose extraction raised an exception, or that gave no
+    reading for the reason given."""
+    return {"product_id": product_id,
+            "error": error if isinstance(error, str) else type(error).__name__,
+            "elapsed_seconds": round(elapsed_seconds, 3)}
+
+
+def stamp_elapsed(readings: list[dict | None], start: float) -> list[dict | None]:
+    """Adds the time the task has taken so far to each of its readings as elapsed_seconds,
+    the same field its failure records carry."""
+    elapsed = round(perf_counter() - start, 3)
+    for reading in readings:
+        if isinstance(reading, dict):
+            reading["elapsed_seconds"] = elapsed
+    return readings
+
+
+def get_missing_records(task: dict | list[dict], readings: list[dict | None],
+                        start: float) -> list[dict]:
+    """Returns a failure record for every product of a task that finished without a reading,
+    with the reason its extractor recorded on this thread (e.g. NotFound or MissingPrice).
+    Products without a recorded reason once the run is out of time were cut short by the
+    deadline, so they are recorded as unfinished."""
+    elapsed = perf_counter() - start
+    out_of_time = is_out_of_time()
+    read = {reading["product_id"] for reading in readings
+            if isinstance(reading, dict) and "product_id" in reading}
+    records = []
+    for product_id in get_product_ids(task):
+        if product_id not in read:
+            reason = get_failure_reason(product_id)
+            if out_of_time and reason == NO_READING:
+                reason = UNFINISHED_REASON
+            records.append(get_failure_record(product_id, reason, elapsed))
+    return records
+
+
+def run_isolated(task: dict | list[dict]) -> tuple[list[dict | None], list[dict]]:
+    """Processes a task, turning any exception into a failure record per product instead of
+    failing the whole run. When a batch fails, each of its products is processed on its own,
+    so one bad product does not lose the readings of the rest. Products that finish without
+    a reading get a failure record with the reason their extractor recorded, and products
+    stopped by the deadline get an UNFINISHED_REASON record. Returns the readings and the
+    failure records."""
+    start = perf_counter()
+    clear_failure_reasons()
+    try:
+        readings = process_task(task)
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        if isinstance(task, list) and len(task) > 1 and not isinstance(error, DeadlineExceeded):
+            logging.error("Batch of %s products failed with %s; processing them one by one",
+                          len(task), type(error).__name__)
+            readings, failures = [], []
+            for product_data in task:
+                product_readings, product_failures = run_isolated(product_data)
+                readings.extend(product_readings)
+                failures.extend(product_failures)
+            return readings, failures
+        return [], get_failure_records(task, error, start)
+    return stamp_elapsed(readings, start), get_missing_records(task, readings, start)
+
+
+def get_failure_records(task: dict | list[dict], error: Exception, start: float) -> list[dict]:
+    """Returns a failure record for every product of a task that raised an exception. A task
+    refused for the deadline is recorded as unfinished instead."""
+    elapsed = perf_counter() - start
+    if isinstance(error, DeadlineExceeded):
+        logging.warning("Extraction stopped by the deadline after %.3fs", elapsed)
+        return [get_failure_record(product_id, UNFINISHED_REASON, elapsed)
+                for product_id in get_product_ids(task)]
+    logging.error("Extraction failed with %s after %.3fs: %s",
+                  type(error).__name__, elapsed, error)
+    return [get_failure_record(product_id, error, elapsed)
+            for product_id in get_product_ids(task)]
+
+
+def fetch_stage(task: dict | list[dict]) -> tuple[bool, object]:
+    """The I/O stage of the staged engine. Fetches the raw page of a task whose retailer has
+    a parse stage, and processes any other task completely. Returns whether the task still
+    needs parsing, along with the page and the seconds it took to fetch, or the task's
+    isolated result."""
+    if not supports_stages(get_task_website_name(task)):
+        return False, run_isolated(task)
+    products = [product for product in (task if isinstance(task, list) else [task])
+                if validate_input(product)]
+    if not products:
+        logging.error("Data did not pass validation")
+        return False, ([], [])
+    start = perf_counter()
+    clear_failure_reasons()
+    try:
+        page = get_retailer(products[0]["website_name"])["fetch_page"](products)
+        return True, (page, perf_counter() - start)
+    except ValueError:
+        logging.error("Fetching the page of %s products failed", len(products))
+        return False, ([None] * len(products), get_missing_records(products, [], start))
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        return False, ([], get_failure_records(products, error, start))
+
+
+def parse_stage(task: dict | list[dict], page,
+                fetch_seconds: float = 0.0) -> tuple[list[dict | None], list[dict]]:
+    """The CPU stage of the staged engine, run on a worker process. Parses a page fetched by
+    fetch_stage into the task's readings, with the same isolation as run_isolated. The
+    elapsed time of the readings and failures includes the fetch_seconds spent fetching."""
+    products = [product for product in (task if isinstance(task, list) else [task])
+                if validate_input(product)]
+    start = perf_counter() - fetch_seconds
+    clear_failure_reasons()
+    try:
+        readings = get_retailer(products[0]["website_name"])["parse_page"](products, page)
+    except ValueError:
+        logging.error("Parsing the page of %s products failed", len(products))
+        readings = [None] * len(products)
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        return [], get_failure_records(products, error, start)
+    return stamp_elapsed(readings, start), get_missing_records(products, readings, start)
+
+
+def record_task_costs(task: dict | list[dict], result: tuple[list, list[dict]]) -> None:
+    """Records each finished product's share of the time its task took, from the
+    elapsed_seconds of its reading or failure record, so Provision can pack batches by
+    cost. The products of a batch share its requests, so a batch's time is split evenly
+    between them. The field is removed from the readings, which are passed on."""
+    product_count = max(1, len(get_product_ids(task)))
+    for reading in result[0]:
+        if isinstance(reading, dict) and "elapsed_seconds" in reading:
+            TASK_COSTS[reading.get("product_id")] = reading.pop("elapsed_seconds") / product_count
+    for failure in result[1]:
+        TASK_COSTS[failure["product_id"]] = failure["elapsed_seconds"] / product_count
+
+
+def get_task_costs() -> list[dict]:
+    """Returns the cost, in seconds, of every product recorded since the costs were cleared."""
+    return [{"product_id": product_id, "seconds": round(seconds, 3)}
+            for product_id, seconds in TASK_COSTS.items() if product_id is not None]
+
+
+def get_recovered_products(product_list: list[dict], unfinished: list[int],
+                           failures: list[dict]) -> list[int]:
+    """Returns the IDs of the products Provision sent with a failure_count that gave a reading
+    this time, so that their failure ledger entries can be cleared. Every product without a
+    reading has a failure record or is unfinished."""
+    missed = set(unfinished) | {failure["product_id"] for failure in failures}
+    return [product["product_id"] for product in product_list
+            if isinstance(product, dict) and product.get("failure_count")
+            and product.get("product_id") not in missed]
+
+
+def summarise_failures(failures: list[dict]) -> dict[str, int]:
+    """Returns the number of failed products for each error class."""
+    return dict(Counter(failure["error"] for failure in failures))
+
+
+def get_task_website_name(task: dict | list[dict]) -> str | None:
+    """Returns the website of a task, which for a batch is the website of its first product."""
+    if isinstance(task, list):
+        task = task[0] if task else None
+    return task.get("website_name") if isinstance(task, dict) else None
+
+
+def get_task_priority(task: dict | list[dict]) -> float:
+    """Returns the scrape priority Provision gave a task's products, which for a batch is the
+    priority of its most urgent product."""
+    products = task if isinstance(task, list) else [task]
+    priorities = [product.get("priority") for product in products if isinstance(product, dict)]
+    return max((priority for priority in priorities
+                if isinstance(priority, (int, float)) and not isinstance(priority, bool)),
+               default=0.0)
+
+
+def build_tasks(product_list: list[dict]) -> list[dict | list[dict]]:
+    """Groups products from websites that support batched lookups into lists of up to the
+    website's batch size, and products of a website with a coalesce key (e.g. colourways of
+    the same Patagonia page) into one list per key. A coalesced group of a single product and
+    all other products are left as single tasks.
+    Tasks are ordered by the priority Provision gave their products, so products close to a
+    subscriber's threshold are never the ones left unfinished at the deadline. Among tasks of
+    equal priority, expensive (HTML) retailers are ordered before cheap (API) ones, so that
+    the slow scrapes start first rather than finishing last."""
+    tasks = []
+    batches = {}
+    for product_data in product_list:
+        website_name = (product_data.get("website_name")
+                        if isinstance(product_data, dict) else None)
+        batch_key = get_batch_key(website_name, product_data)
+        if batch_key is None:
+            tasks.append(product_data)
+            continue
+        batch = batches.setdefault(batch_key, [])
+        batch.append(product_data)
+        if len(batch) >= get_retailer(website_name)["batch_size"]:
+            tasks.append(batch)
+            batches[batch_key] = []
+    for batch_key, batch in batches.items():
+        if len(batch) == 1 and isinstance(batch_key, tuple):
+            tasks.append(batch[0])
+        elif batch:
+            tasks.append(batch)
+    return sorted(tasks, key=lambda task: (-get_task_priority(task),
+                                           get_cost_rank(get_task_website_name(task))))
+
+
+def get_product_ids(task: dict | list[dict]) -> list[int]:
+    """Returns the product IDs of a task."""
+    products = task if isinstance(task, list) else [task]
+    return [product["product_id"] for product in products
+            if isinstance(product, dict) and "product_id" in product]
+
+
+def clean_task_readings(result: list[dict | None]) -> list[dict]:
+    """Drops the failed extractions of a finished task and the readings whose price has not
+    decreased."""
+    return remove_stale_products([reading for reading in result if reading is not None])
+
+
+def split_results(tasks: list[dict | list[dict]],
+                  results: list) -> tuple[list[dict], list[int], list[dict]]:
+    """Splits the isolated results of every task into the readings worth passing on, the IDs
+    of the products whose task did not finish before the deadline and the failure records."""
+    return collect_stream(get_task_outcome(task, result)
+                          for task, result in zip(tasks, results))
+
+
+def iter_completed(async_results: list) -> Iterator[tuple[int, object]]:
+    """Yields the index and result of each pool result as soon as it is ready, in the order
+    they finish. Results not ready by the run's deadline are yielded last as UNFINISHED."""
+    pending = list(enumerate(async_results))
+    while pending:
+        still_pending = []
+        for index, async_result in pending:
+            if async_result.ready():
+                yield index, async_result.get(0)
+            else:
+                still_pending.append((index, async_result))
+        pending = still_pending
+        if not pending:
+            return
+        remaining = get_remaining_seconds()
+        if remaining is not None and remaining <= 0:
+            break
+        pending[0][1].wait(COMPLETION_POLL_SECONDS if remaining is None
+                           else min(COMPLETION_POLL_SECONDS, remaining))
+    for index, _ in pending:
+        yield index, UNFINISHED
+
+
+def get_chunks(tasks: list, chunk_size: int) -> list[list]:
+    """Splits the tasks into consecutive chunks of up to chunk_size tasks."""
+    return [tasks[start:start + chunk_size] for start in range(0, len(tasks), chunk_size)]
+
+
+def get_task_outcome(task: dict | list[dict], result
+                     ) -> tuple[list[dict], list[int], list[dict]]:
+    """Turns the isolated result of a task into a (readings, unfinished, failures) triple,
+    cleaning its readings and recording the cost of its products. Products recorded with
+    UNFINISHED_REASON are returned as unfinished rather than failed."""
+    if result is UNFINISHED:
+        return [], get_product_ids(task), []
+    readings, records = result
+    unfinished = [record["product_id"] for record in records
+                  if record["error"] == UNFINISHED_REASON]
+    failures = [record for record in records if record["error"] != UNFINISHED_REASON]
+    record_task_costs(task, (readings, failures))
+    return clean_task_readings(readings), unfinished, failures
+
+
+def stream_price_and_sales_data(product_list: list[dict]
+                                ) -> Iterator[tuple[list[dict], list[int], list[dict]]]:
+    """Extracts the product list on the persistent worker pool and yields a (readings,
+    unfinished, failures) triple for each task as soon as its chunk finishes, so that
+    consumers can write readings or evaluate alerts while other fetches are still in flight.
+    Each worker process runs a chunk of tasks on its I/O threads, and returns the results of
+    its finished tasks shortly before the deadline. Readings are cleaned as they arrive; tasks
+    not finished before the deadline yield their product IDs as unfinished, and the pool is
+    discarded so its busy workers are terminated."""
+    logging.info("Starting Extraction")
+    pool = get_worker_pool()
+    processes, threads = WORKER_POOL["processes"], WORKER_POOL["threads"]
+    tasks = build_tasks(product_list)
+    chunks = get_chunks(tasks, threads)
+    logging.info("Adding the current price and sale status")
+    finished = 0
+    try:
+        for index, results in iter_completed(
+                [pool.apply_async(run_chunk, (run_isolated, chunk, DEADLINE["at"],
+                                              get_rate_limits(), processes, threads))
+                 for chunk in chunks]):
+            if results is UNFINISHED:
+                results = [UNFINISHED] * len(chunks[index])
+            for task, result in zip(chunks[index], results):
+                result = UNFINISHED if result is None else result
+                finished += result is not UNFINISHED
+                yield get_task_outcome(task, result)
+    finally:
+        if finished < len(tasks):
+            discard_worker_pool()
+    logging.info("Finished Extraction.")
+
+
+def stream_price_and_sales_data_staged(product_list: list[dict]
+                                       ) -> Iterator[tuple[list[dict], list[int], list[dict]]]:
+    """Extracts the product list in two stages and yields a (readings, unfinished, failures)
+    triple for each task as soon as it finishes. I/O threads in this process fetch raw pages
+    into a bounded queue and the persistent worker pool parses them, so that network and CPU
+    work overlap on large Patagonia batches. Tasks of retailers without a parse stage are
+    processed entirely on the I/O threads."""
+    logging.info("Starting Extraction")
+    fetch_threads = int(ENV.get("FETCH_THREADS", DEFAULT_FETCH_THREADS))
+    configure_session_pool(fetch_threads)
+    configure_hedge_workers(fetch_threads)
+    configure_rate_limits(get_rate_limits())
+    pool = get_worker_pool()
+    tasks = build_tasks(product_list)
+    finished = 0
+    try:
+        for index, result in run_stages(
+                tasks, fetch_stage,
+                lambda task, fetched: pool.apply_async(parse_stage, (task, *fetched)),
+                fetch_threads, int(ENV.get("FETCHED_QUEUE_SIZE", DEFAULT_FETCHED_QUEUE_SIZE)),
+                2 * WORKER_POOL["processes"]):
+            finished += result is not UNFINISHED
+            yield get_task_outcome(tasks[index], result)
+    finally:
+        if finished < len(tasks):
+            discard_worker_pool()
+    logging.info("Finished Extraction.")
+
+
+def collect_stream(stream: Iterator[tuple[list[dict], list[int], list[dict]]]
+                   ) -> tuple[list[dict], list[int], list[dict]]:
+    """Collects a stream of (readings, unfinished, failures) triples into a single triple."""
+    readings = []
+    unfinished = []
+    failures = []
+    for task_readings, task_unfinished, task_failures in stream:
+        readings.extend(task_readings)
+        unfinished.extend(task_unfinished)
+        failures.extend(task_failures)
+    if unfinished:
+        logging.warning("%s products were not finished before the deadline", len(unfinished))
+    return readings, unfinished, failures
+
+
+def extract_price_and_sales_data(product_list: list[dict]
+                                 ) -> tuple[list[dict], list[int], list[dict]]:
+    """Populates each product dictionary in the product list with current price, reading time,
+    and sale status using multiprocessing. Returns the readings, in the order their tasks
+    finished, the IDs of the products that were not finished before the deadline and the
+    failure records of the products whose extraction raised."""
+    return collect_stream(stream_price_and_sales_data(product_list))
+
+
+def extract_price_and_sales_data_staged(product_list: list[dict]
+                                        ) -> tuple[list[dict], list[int], list[dict]]:
+    """Populates each product dictionary in the product list using the two-stage fetch and
+    parse engine. Returns the same readings, unfinished IDs and failure records as the pool
+    engine."""
+    return collect_stream(stream_price_and_sales_data_staged(product_list))
+
+
+def extract_price_and_sales_data_async(product_list: list[dict]
+                                       ) -> tuple[list[dict], list[int], list[dict]]:
     """Populates each product dictionary in the product list with current price, reading time,
-    and sale status using multiprocessing."""
+    and sale status using the asyncio engine, so that every request in the batch is in flight
+    at once (up to MAX_CONCURRENCY overall, and per retailer the lower of
+    MAX_CONCURRENCY_PER_WEBSITE and the retailer's max_concurrency). Returns the readings, the
+    IDs of the products that were not finished before the deadline and the failure records."""
     logging.info("Starting Extraction")
-    with Pool(processes=4) as pool:
-        logging.info("Adding the current price and sale status")
-        results = list(pool.map(process, product_list))
-        logging.info("Finished Extraction. Removing erroneous / missing data")
-        results = [i for i in results if i is not None]
-    return results
+    max_concurrency = int(ENV.get("MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+    max_per_website = int(ENV.get("MAX_CONCURRENCY_PER_WEBSITE",
+                                  DEFAULT_MAX_CONCURRENCY_PER_WEBSITE))
+    configure_session_pool(max_per_website)
+    configure_hedge_workers(max_concurrency)
+    configure_rate_limits(get_rate_limits())
+    logging.info("Adding the current price and sale status")
+    tasks = build_tasks(product_list)
+    remaining = get_remaining_seconds()
+    results = extract_concurrently(tasks, run_isolated,
+                                   {"max_concurrency": max_concurrency,
+                                    "max_per_website": max_per_website,
+                                    "website_limits": get_concurrency_limits()},
+                                   timeout=None if remaining is None else max(0.0, remaining))
+    logging.info("Finished Extraction. Removing erroneous / stale data")
+    return split_results(tasks, results)
+
+
+EXTRACTION_ENGINES = {
+    "pool": extract_price_and_sales_data,
+    "async": extract_price_and_sales_data_async,
+    "staged": extract_price_and_sales_data_staged
+}
+
+
+def get_extraction_engine(mode: str):
+    """Returns the extraction function for the given EXTRACTION_MODE."""
+    if mode not in EXTRACTION_ENGINES:
+        logging.error("Unknown extraction mode %s", mode)
+        raise ValueError(f"Unknown extraction mode {mode}")
+    return EXTRACTION_ENGINES[mode]
 
 
-def handler(_event, _context=None) -> list:
-    """Main function which lambda will call"""
+def handler(_event, _context=None) -> dict[str, list]:
+    """Main function which lambda will call. Extraction stops shortly before the Lambda times
+    out; the readings taken so far are returned along with the IDs of the unfinished
+    products, so they can be re-queued for the next run, a record of every product whose
+    extraction failed, the IDs of previously failing products that gave a reading and the
+    cost in seconds of every finished product. The event may be a claim check reference to
+    the product list, and with CLAIM_CHECK set the output is checked in and only its
+    reference is returned."""
     configure_log()
-    product_readings = extract_price_and_sales_data(_event)
-    return remove_stale_products(product_readings)
+    set_deadline(get_lambda_remaining_seconds(_context))
+    TASK_COSTS.clear()
+    extract = get_extraction_engine(
+        ENV.get("EXTRACTION_MODE", DEFAULT_EXTRACTION_MODE))
+    product_list = check_out(_event)
+    product_readings, unfinished, failures = extract(product_list)
+    if failures:
+        logging.warning("%s products failed: %s", len(failures), summarise_failures(failures))
+    pool_stats = get_pool_stats()
+    if pool_stats["starts"]:
+        logging.info("Worker pool start took %.3fs (%s starts in this container)",
+                     pool_stats["start_seconds"], pool_stats["starts"])
+    connection_stats = get_connection_stats()
+    logging.info("Opened %s connections in %.3fs in this process",
+                 connection_stats["connections"], connection_stats["connect_seconds"])
+    stream_stats = get_stream_stats()
+    if stream_stats["pages"]:
+        logging.info("Streamed %s pages (%s bytes), %.0f%% closed early",
+                     stream_stats["pages"], stream_stats["bytes_transferred"],
+                     100 * stream_stats["closed_early"] / stream_stats["pages"])
+    output = {"readings": product_readings, "unfinished": unfinished, "failures": failures,
+              "recovered": get_recovered_products(product_list, unfinished, failures),
+              "costs": get_task_costs()}
+    location = get_claim_check_location()
+    return check_in(output, location) if location else output
+
+
+if ("AWS_LAMBDA_FUNCTION_NAME" in ENV
+        and ENV.get("EXTRACTION_MODE", DEFAULT_EXTRACTION_MODE) in ("pool", "staged")):
+    get_worker_pool()
 
 
 if __name__ == "__main__":
     configure_log()
     cleaned_data = _event
-    product_readings = extract_price_and_sales_data(cleaned_data)
-    print(remove_stale_products(product_readings))
+    for finished_readings, _, _ in stream_price_and_sales_data(cleaned_data):
+        print(finished_readings)
@@ -2,10 +2,33 @@
 
 from datetime import datetime
 import logging
+from os import environ as ENV
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 from bs4 import BeautifulSoup
 from bs4.element import Tag
-from pipeline_helpers import get_soup
+from pipeline_helpers import (get_product_page, get_product_response, get_product_page_streamed,
+                              read_body, record_failure_reason, WRONG_PAGE, MISSING_PRICE)
+from response_cache import (get_response_cache, get_conditional_headers,
+                            get_fragment_hash)
+
+WEBSITE_NAME = "patagonia"
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)\
+    AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"}
+
+PRICE_SPAN_PATTERN = re.compile(
+    r"<span\b[^>]*class=[\"'][^\"']*\b(?:js-)?buy-config-price\b[^>]*>")
+SPAN_TAG_PATTERN = re.compile(r"<(/?)span\b[^>]*>")
+SCAN_OVERLAP = 1024
+MAX_PRICE_BLOCK_CHARS = 65536
+PRODUCT_DETAIL_PATTERN = re.compile(
+    r"<div\b[^>]*class=[\"'](?:[^\"']*\s)?product-detail(?:\s[^\"']*)?[\"']")
+COLOUR_PARAM_PATTERN = re.compile(r"^dwvar_.+_color$")
+VARIANT_PARAMS = ("cgid",)
+SWATCH_TAG_PATTERN = re.compile(r"<[a-z]+\b[^>]*\bdata-attr-value=[\"']([^\"']+)[\"'][^>]*>")
+SWATCH_PRICE_PATTERN = re.compile(r"\bdata-price=[\"'](\d+(?:\.\d+)?)[\"']")
 
 
 def get_product_info(soup: BeautifulSoup) -> BeautifulSoup | None:
@@ -69,21 +92,64 @@ def is_correct_page(soup: BeautifulSoup) -> bool:
     return single_product_identifier is not None
 
 
-def process_product(product: dict) -> dict | None:
-    """Populates a single product dictionary with current price, reading time, and sale status."""
+def get_price_fragment(html: str) -> str | None:
+    """Returns the raw HTML of the buy-config-price span, including its nested spans,
+    without parsing the rest of the page."""
+    if not isinstance(html, str):
+        logging.error("html must be of type str")
+        raise TypeError("html must be of type str")
+
+    opening_tag = PRICE_SPAN_PATTERN.search(html)
+    if not opening_tag:
+        return None
+    depth = 0
+    for span_tag in SPAN_TAG_PATTERN.finditer(html, opening_tag.start()):
+        depth += -1 if span_tag.group(1) else 1
+        if depth == 0:
+            return html[opening_tag.start():span_tag.end()]
+    return None
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)\
-        AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"}
 
-    logging.info("Extraction started")
-    soup = get_soup(product["url"], headers=headers)
-    if not soup:
-        logging.error("Failed to scrape website for unknown reason.")
-        raise ValueError("Failed to scrape website for unknown reason.")
+class PriceBlockScanner:  # pylint: disable=too-few-public-methods
+    """Incremental scanner fed with the page as it downloads. Reports once the product-detail
+    marker and the complete buy-config-price span have been seen, so the rest of the page does
+    not need to be downloaded. Each feed only scans the new text plus a small overlap for
+    tags split across chunks, and only the text from the price block onwards is kept (up to
+    MAX_PRICE_BLOCK_CHARS), so the page is never copied as it grows."""
 
+    def __init__(self):
+        self.tail = ""
+        self.product_detail_seen = False
+        self.price_text = None
+        self.fragment = None
+
+    def feed(self, text: str) -> bool:
+        """Adds the next piece of the page. Returns True once the price block is complete."""
+        window = self.tail + text
+        if not self.product_detail_seen:
+            self.product_detail_seen = PRODUCT_DETAIL_PATTERN.search(window) is not None
+        if self.price_text is None:
+            opening_tag = PRICE_SPAN_PATTERN.search(window)
+            if opening_tag:
+                self.price_text = window[opening_tag.start():]
+        elif self.fragment is None and len(self.price_text) < MAX_PRICE_BLOCK_CHARS:
+            self.price_text += text
+        if self.price_text is not None and self.fragment is None:
+            self.fragment = get_price_fragment(self.price_text)
+        self.tail = window[-SCAN_OVERLAP:]
+        return self.product_detail_seen and self.fragment is not None
+
+
+def is_streaming_enabled() -> bool:
+    """Returns True if product pages should be streamed and closed once the price is found."""
+    return ENV.get("STREAM_PAGES", "false").lower() == "true"
+
+
+def get_price_and_sale(soup: BeautifulSoup) -> tuple[int, bool] | None:
+    """Returns the current price and sale status of a parsed product page."""
     if not is_correct_page(soup):
         logging.error("Website page is invalid, it must be a product page.")
+        record_failure_reason(WRONG_PAGE)
         raise ValueError("Website page is invalid!")
 
     product_info = get_product_info(soup)
@@ -93,9 +159,258 @@ def process_product(product: dict) -> dict | None:
         sale = get_sale_status(product_info)
 
         if not sale is None and not curr_price is None:
-            product["current_price"] = curr_price
-            product["is_on_sale"] = sale
-            product["reading_at"] = datetime.now().isoformat(".", "seconds")
-            return product
+            return curr_price, sale
+    record_failure_reason(MISSING_PRICE)
+    return None
+
+
+def get_price_and_sale_fast(html: str) -> tuple[int, bool] | None:
+    """Returns the current price and sale status of a product page by pre-scanning the raw
+    HTML for the product-detail marker and parsing only the buy-config-price fragment.
+    Returns None whenever the fast path cannot decide, so the full parse can take over."""
+    if not PRODUCT_DETAIL_PATTERN.search(html):
+        return None
+    fragment = get_price_fragment(html)
+    if fragment is None:
+        return None
+    product_info = get_product_info(BeautifulSoup(fragment, features="html.parser"))
+    if product_info is None:
+        return None
+    try:
+        curr_price = get_current_price(product_info)
+        sale = get_sale_status(product_info)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if sale is None or curr_price is None:
+        return None
+    return curr_price, sale
+
+
+def parse_price_and_sale(html: str) -> tuple[int, bool] | None:
+    """Returns the current price and sale status of a product page, using the fast path
+    where possible and falling back to parsing the full page."""
+    price_and_sale = get_price_and_sale_fast(html)
+    if price_and_sale is not None:
+        return price_and_sale
+    logging.info("Fast path failed, parsing the full page.")
+    return get_price_and_sale(BeautifulSoup(html, features="html.parser"))
+
+
+def add_price_reading(product: dict, curr_price: int, sale: bool) -> dict:
+    """Populates a single product dictionary with current price, reading time, and sale status."""
+    product["current_price"] = curr_price
+    product["is_on_sale"] = sale
+    product["reading_at"] = datetime.now().isoformat(".", "seconds")
+    return product
+
+
+def get_canonical_url(url: str) -> str:
+    """Returns the product page URL with the colourway and category parameters removed,
+    so every colourway of a style maps to the same page."""
+    if not isinstance(url, str):
+        logging.error("url must be of type str")
+        raise TypeError("url must be of type str")
+    parts = urlsplit(url)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if key not in VARIANT_PARAMS and not COLOUR_PARAM_PATTERN.match(key))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path,
+                       urlencode(query), ""))
+
+
+def get_colour_code(url: str) -> str | None:
+    """Returns the colourway selected by a product URL, if any."""
+    for key, value in parse_qsl(urlsplit(url).query):
+        if COLOUR_PARAM_PATTERN.match(key):
+            return value
+    return None
+
+
+def get_page_key(product: dict) -> str | None:
+    """Returns the canonical page of a product, used to fetch each page once per run."""
+    url = product.get("url") if isinstance(product, dict) else None
+    return get_canonical_url(url) if isinstance(url, str) else None
+
+
+def get_colour_prices(html: str) -> dict[str, float]:
+    """Returns the price of every colour swatch on the page that carries one."""
+    colour_prices = {}
+    for swatch in SWATCH_TAG_PATTERN.finditer(html):
+        price = SWATCH_PRICE_PATTERN.search(swatch.group(0))
+        if price:
+            colour_prices[swatch.group(1)] = float(price.group(1))
+    return colour_prices
+
+
+def get_colour_price_and_sale(price_and_sale: tuple[int, bool] | None,
+                              colour_prices: dict[str, float],
+                              page_colour: str | None,
+                              colour: str | None) -> tuple[int, bool] | None:
+    """Returns the price and sale status of a colourway read from the page of page_colour,
+    another colourway of the same style, or None if that page cannot tell. The discount shown
+    on a page belongs to its own colourway, so the page's reading is only shared with the
+    colourways whose swatch carries exactly the page price."""
+    if price_and_sale is None:
+        return None
+    if colour == page_colour or colour_prices.get(colour) == price_and_sale[0]:
+        return price_and_sale
+    return None
+
+
+def get_page_price_and_sale_with_cache(url: str, cache) -> tuple[tuple[int, bool] | None,
+                                                                 dict[str, float]]:
+    """Returns the price and sale status and the colour prices of a page using a conditional
+    request. If the page has not been modified, or its price fragment is unchanged, the
+    cached price is reused without parsing the page."""
+    entry = cache.get(url)
+    streaming = is_streaming_enabled()
+    response = get_product_response(url,
+                                    headers=get_conditional_headers(HEADERS, entry),
+                                    website_name=WEBSITE_NAME, stream=streaming)
+    if response is None:
+        logging.error("Failed to scrape website for unknown reason.")
+        raise ValueError("Failed to scrape website for unknown reason.")
+
+    if response.status_code == 304:
+        response.close()
+        if not entry:
+            logging.error("Page not modified but no cached price for %s", url)
+            raise ValueError("Page not modified but no cached price.")
+        logging.info("Page not modified, reusing cached price.")
+        return (entry["current_price"], entry["is_on_sale"]), entry.get("colour_prices", {})
+
+    html = read_body(response, PriceBlockScanner()) if streaming else response.text
+    if html is None:
+        logging.error("Failed to read the page body.")
+        raise ValueError("Failed to read the page body.")
+
+    fragment_hash = get_fragment_hash(get_price_fragment(html))
+    if entry and fragment_hash and fragment_hash == entry.get("fragment_hash"):
+        logging.info("Price fragment unchanged, reusing cached price.")
+        price_and_sale = entry["current_price"], entry["is_on_sale"]
+    else:
+        price_and_sale = parse_price_and_sale(html)
+
+    if not price_and_sale:
+        return None, {}
+
+    colour_prices = get_colour_prices(html)
+    cache.set(url, {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fragment_hash": fragment_hash,
+        "current_price": price_and_sale[0],
+        "is_on_sale": price_and_sale[1],
+        "colour_prices": colour_prices
+    })
+    return price_and_sale, colour_prices
+
+
+def fetch_page_html(url: str) -> str:
+    """Fetches a product page, streaming it when STREAM_PAGES is set."""
+    if is_streaming_enabled():
+        html = get_product_page_streamed(url, HEADERS, PriceBlockScanner(),
+                                         website_name=WEBSITE_NAME)
+    else:
+        html = get_product_page(url, headers=HEADERS, website_name=WEBSITE_NAME)
+    if not html:
+        logging.error("Failed to scrape website for unknown reason.")
+        raise ValueError("Failed to scrape website for unknown reason.")
+    return html
+
+
+def parse_page_html(html: str) -> tuple[tuple[int, bool] | None, dict[str, float]]:
+    """Returns the price and sale status and the colour prices of a fetched product page."""
+    price_and_sale = parse_price_and_sale(html)
+    return price_and_sale, get_colour_prices(html) if price_and_sale else {}
+
+
+def get_page_price_and_sale(url: str) -> tuple[tuple[int, bool] | None, dict[str, float]]:
+    """Returns the price and sale status and the colour prices of a product page."""
+    cache = get_response_cache()
+    if cache is not None:
+        return get_page_price_and_sale_with_cache(url, cache)
+    return parse_page_html(fetch_page_html(url))
+
+
+def process_product_with_cache(product: dict, cache) -> dict | None:
+    """Populates a single product dictionary using a conditional request."""
+    price_and_sale, _ = get_page_price_and_sale_with_cache(product["url"], cache)
+    if not price_and_sale:
+        logging.error("Error processing product %s", product["product_code"])
+        return None
+    return add_price_reading(product, *price_and_sale)
+
+
+def process_product(product: dict) -> dict | None:
+    """Populates a single product dictionary with current price, reading time, and sale status."""
+    logging.info("Extraction started")
+    cache = get_response_cache()
+    if cache is not None:
+        return process_product_with_cache(product, cache)
+
+    price_and_sale, _ = get_page_price_and_sale(product["url"])
+
+    if price_and_sale:
+        return add_price_reading(product, *price_and_sale)
     logging.error("Error processing product %s", product["product_code"])
     return None
+
+
+def process_products(products: list[dict],
+                     pages: dict[str, tuple] | None = None) -> list[dict | None]:
+    """Populates a list of product dictionaries, fetching each style's page once for all of
+    its tracked colourways where the page can tell their price. The page fetched is the first
+    tracked colourway's own URL. A colourway the page cannot price, because its swatch is
+    missing or priced differently, is fetched on its own, as is every colourway until one of
+    its style's pages has been read. pages holds the pages already read, by canonical URL.
+    Returns a list in the same order as products, with None for every product that could
+    not be processed."""
+    pages = {} if pages is None else pages
+    fetches = 0
+    results = []
+    for product in products:
+        canonical_url = get_canonical_url(product["url"])
+        colour = get_colour_code(product["url"])
+        price_and_sale = None
+        if canonical_url in pages:
+            price_and_sale = get_colour_price_and_sale(*pages[canonical_url], colour)
+        if price_and_sale is None:
+            fetches += 1
+            try:
+                page_price_and_sale, colour_prices = get_page_price_and_sale(product["url"])
+            except ValueError:
+                logging.error("Failed to scrape page %s", product["url"])
+                page_price_and_sale, colour_prices = None, {}
+            if page_price_and_sale is not None:
+                pages.setdefault(canonical_url, (page_price_and_sale, colour_prices, colour))
+            price_and_sale = page_price_and_sale
+        if price_and_sale:
+            results.append(add_price_reading(product, *price_and_sale))
+        else:
+            logging.error("Error processing product %s", product["product_code"])
+            results.append(None)
+    logging.info("Fetched %s pages for %s products", fetches, len(products))
+    return results
+
+
+def fetch_products_page(products: list[dict]) -> str:
+    """Fetches the page of the first of a list of colourways of the same style. This is the
+    I/O stage of the staged engine; the conditional-request cache is not used."""
+    return fetch_page_html(products[0]["url"])
+
+
+def parse_products_page(products: list[dict], html: str) -> list[dict | None]:
+    """Populates colourways of the same style from the first colourway's fetched page. This is
+    the CPU stage of the staged engine; the colourways the page cannot price are fetched on
+    their own, as process_products does."""
+    try:
+        price_and_sale, colour_prices = parse_page_html(html)
+    except ValueError:
+        price_and_sale, colour_prices = None, {}
+    first = products[0]
+    if price_and_sale is None:
+        logging.error("Error processing product %s", first["product_code"])
+        return [None, *process_products(products[1:])]
+    return process_products(products, {
+        get_canonical_url(first["url"]): (price_and_sale, colour_prices,
+                                          get_colour_code(first["url"]))})
@@ -0,0 +1,232 @@
+"""Fetch Policy: jittered exponential retries, hedged requests and a per-host circuit breaker
+wrapped around every product request."""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import logging
+import os
+import random
+from threading import Event, Lock
+from time import monotonic, perf_counter, sleep
+from typing import Callable
+
+import requests
+
+from deadline import DeadlineExceeded, get_remaining_seconds
+
+DEFAULT_MAX_RETRIES = 2
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_CAP_SECONDS = 4.0
+
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+HEDGE_WORKERS = 32
+
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+
+RETRYABLE_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+HOST_POLICIES = {}
+HOST_POLICIES_LOCK = Lock()
+HEDGE_EXECUTOR = {"pid": None, "workers": HEDGE_WORKERS, "executor": None}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of sending a request while a host's circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive connection failures or timeouts, fails fast
+    while open, and lets a single trial request through once reset_seconds have passed."""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = Lock()
+
+    def allow_request(self) -> bool:
+        """Returns True if a request may be sent to the host."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_in_flight or monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        """Closes the breaker."""
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Frees the trial slot after a trial that ended without a verdict on the host."""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        """Counts a failure, opening the breaker once the threshold is reached or
+        re-opening it if the trial request failed."""
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    logging.warning("Circuit breaker opened after %s failures", self.failures)
+                self.opened_at = monotonic()
+                self.trial_in_flight = False
+
+
+class LatencyTracker:
+    """Keeps the most recent request latencies of a host."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.lock = Lock()
+
+    def record(self, seconds: float) -> None:
+        """Adds a latency sample."""
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def percentile(self, fraction: float) -> float | None:
+        """Returns the given percentile, or None until there are enough samples."""
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def get_host_policy(host: str) -> tuple[CircuitBreaker, LatencyTracker]:
+    """Returns the circuit breaker and latency tracker of a host."""
+    with HOST_POLICIES_LOCK:
+        if host not in HOST_POLICIES:
+            HOST_POLICIES[host] = (CircuitBreaker(), LatencyTracker())
+        return HOST_POLICIES[host]
+
+
+def configure_hedge_workers(concurrency: int) -> None:
+    """Sizes the hedge thread pool for the number of requests the engine keeps in flight.
+    Each hedged request can have its first attempt and its hedge running at once, so the
+    pool gets two threads per request and never caps the engine's concurrency."""
+    if not isinstance(concurrency, int) or concurrency <= 0:
+        logging.error("concurrency must be a positive integer.")
+        raise ValueError("concurrency must be a positive integer.")
+    with HOST_POLICIES_LOCK:
+        if HEDGE_EXECUTOR["workers"] != 2 * concurrency:
+            if HEDGE_EXECUTOR["executor"] is not None:
+                HEDGE_EXECUTOR["executor"].shutdown(wait=False)
+            HEDGE_EXECUTOR["executor"] = None
+            HEDGE_EXECUTOR["workers"] = 2 * concurrency
+
+
+def get_hedge_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool used for hedged requests, creating one per process."""
+    with HOST_POLICIES_LOCK:
+        if HEDGE_EXECUTOR["pid"] != os.getpid() or HEDGE_EXECUTOR["executor"] is None:
+            HEDGE_EXECUTOR["executor"] = ThreadPoolExecutor(
+                max_workers=HEDGE_EXECUTOR["workers"])
+            HEDGE_EXECUTOR["pid"] = os.getpid()
+        return HEDGE_EXECUTOR["executor"]
+
+
+def get_backoff(attempt: int) -> float:
+    """Returns a full-jitter exponential backoff for the given retry attempt."""
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def close_losing_response(future) -> None:
+    """Closes the response of a request that lost the race to its hedge, so a streamed body
+    is not left holding its connection."""
+    if not future.cancelled() and future.exception() is None:
+        if isinstance(future.result(), requests.Response):
+            future.result().close()
+
+
+def call_with_hedge(send: Callable[[], requests.Response], hedge_after: float | None,
+                    acquire: Callable[[], None] | None = None) -> requests.Response:
+    """Calls send, and if it has not returned hedge_after seconds after it started sends a
+    second identical request, once acquire (the host's rate limiter) allows it. Returns
+    whichever succeeds first and closes the other's response. The caller acquires the first
+    attempt, so time spent waiting for the limiter or for a free thread does not count
+    towards hedge_after."""
+    if hedge_after is None:
+        return send()
+    started = Event()
+
+    def send_first():
+        started.set()
+        return send()
+
+    def send_hedge():
+        if acquire is not None:
+            acquire()
+        return send()
+
+    executor = get_hedge_executor()
+    pending = {executor.submit(send_first)}
+    started.wait()
+    done, pending = wait(pending, timeout=hedge_after)
+    if not done:
+        logging.info("Request slower than %.2fs, sending a hedged request", hedge_after)
+        pending.add(executor.submit(send_hedge))
+    error = None
+    while pending or done:
+        for future in done:
+            if future.exception() is None:
+                for other in (done | pending) - {future}:
+                    other.add_done_callback(close_losing_response)
+                return future.result()
+            error = error or future.exception()
+        if not pending:
+            break
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+    raise error
+
+
+def call_with_policy(send: Callable[[], requests.Response], host: str,
+                     max_retries: int = DEFAULT_MAX_RETRIES,
+                     acquire: Callable[[], None] | None = None) -> requests.Response:
+    """Calls send through the host's circuit breaker, hedging slow requests and retrying
+    connection errors and timeouts with jittered exponential backoff. acquire is called
+    before every request that is sent, including hedges and retries. Nothing is retried
+    once the run's deadline is too close for the backoff."""
+    breaker, tracker = get_host_policy(host)
+    for attempt in range(max_retries + 1):
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"Circuit breaker is open for {host}")
+        try:
+            if acquire is not None:
+                acquire()
+            start = perf_counter()
+            response = call_with_hedge(send, tracker.percentile(HEDGE_PERCENTILE), acquire)
+        except DeadlineExceeded:
+            breaker.release_trial()
+            raise
+        except RETRYABLE_EXCEPTIONS as e:
+            breaker.record_failure()
+            if attempt == max_retries:
+                raise
+            backoff = get_backoff(attempt)
+            remaining = get_remaining_seconds()
+            if remaining is not None and backoff >= remaining:
+                raise
+            logging.warning("Request to %s failed (%s), retrying in %.2fs", host, e, backoff)
+            sleep(backoff)
+            continue
+        except Exception:
+            # The host answered (e.g. a throttled response), so it is not down.
+            breaker.record_success()
+            raise
+        tracker.record(perf_counter() - start)
+        breaker.record_success()
+        return response
+    raise CircuitOpenError(f"No attempts left for {host}")
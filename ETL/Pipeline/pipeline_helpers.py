@@ -1,11 +1,41 @@
 """This file contains functions that are used throughout this directory"""
 
+import codecs
 import logging
+import os
+from threading import Lock, local
+from time import perf_counter
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.request import ACCEPT_ENCODING
 from bs4 import BeautifulSoup
 
+from rate_limiter import THROTTLE_STATUS_CODES, get_rate_limiter, parse_retry_after
+from deadline import fit_timeout
+from fetch_policy import call_with_policy
+from response_archive import archive_response
+
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 5
 DEFAULT_REQUEST_TIMEOUT_SECONDS = 30
+DEFAULT_SESSION_POOL_SIZE = 10
+STREAM_CHUNK_BYTES = 16 * 1024
+MAX_BODY_BYTES = 5 * 1024 * 1024
+NOT_FOUND_STATUS_CODES = (404, 410)
+
+NOT_FOUND = "NotFound"
+WRONG_PAGE = "WrongPage"
+MISSING_PRICE = "MissingPrice"
+NO_READING = "NoReading"
+
+SESSION_POOL = {"pid": None, "pool_size": DEFAULT_SESSION_POOL_SIZE, "sessions": {}}
+SESSION_LOCK = Lock()
+CONNECTION_STATS = {"connections": 0, "connect_seconds": 0.0}
+STREAM_STATS = {"pages": 0, "closed_early": 0, "bytes_transferred": 0}
+FAILURE_REASONS = local()
 
 
 def configure_log() -> None:
@@ -16,6 +46,27 @@ def configure_log() -> None:
     )
 
 
+def clear_failure_reasons() -> None:
+    """Forgets the failure reasons recorded by the previous task on this thread."""
+    FAILURE_REASONS.reasons = {}
+
+
+def record_failure_reason(reason: str, product_id: int | None = None) -> None:
+    """Records why a product gave no reading, or without a product_id, why none of the
+    products of the current task did. The first reason recorded is kept, so a 404 is not
+    later reported as the wrong page."""
+    if not hasattr(FAILURE_REASONS, "reasons"):
+        clear_failure_reasons()
+    FAILURE_REASONS.reasons.setdefault(product_id, reason)
+
+
+def get_failure_reason(product_id: int) -> str:
+    """Returns the reason recorded for a product without a reading on this thread, or
+    NO_READING if its extractor did not record one (e.g. a timeout)."""
+    reasons = getattr(FAILURE_REASONS, "reasons", {})
+    return reasons.get(product_id, reasons.get(None, NO_READING))
+
+
 def has_required_keys(entry, required_keys):
     """Check if all required keys are present in the dictionary."""
     return all(key in entry for key in required_keys)
@@ -61,8 +112,151 @@ def remove_stale_products(products: list[dict]) -> list[dict]:
             or product["current_price"] <= product["previous_price"]]
 
 
-def get_product_page(url: str, headers: dict) -> str | None:
-    """Fetch the HTML content of a product page from a given URL."""
+def record_connection(host: str, seconds: float) -> None:
+    """Records the time it took to open a new connection (DNS, TCP and TLS)."""
+    with SESSION_LOCK:
+        CONNECTION_STATS["connections"] += 1
+        CONNECTION_STATS["connect_seconds"] += seconds
+    logging.info("Opened new connection to %s in %.3fs", host, seconds)
+
+
+def get_connection_stats() -> dict:
+    """Returns the number of connections opened by this process and the total
+    time spent opening them."""
+    with SESSION_LOCK:
+        return dict(CONNECTION_STATS)
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """HTTP connection which records how long connecting took."""
+
+    def connect(self) -> None:
+        start = perf_counter()
+        super().connect()
+        record_connection(self.host, perf_counter() - start)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """HTTPS connection which records how long connecting and the TLS handshake took."""
+
+    def connect(self) -> None:
+        start = perf_counter()
+        super().connect()  # pylint: disable=no-member
+        record_connection(self.host, perf_counter() - start)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    """HTTP connection pool using timed connections."""
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    """HTTPS connection pool using timed connections."""
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Keep-alive adapter whose pools record connection setup time."""
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool
+        }
+
+
+def create_session(pool_size: int) -> requests.Session:
+    """Returns a session that keeps up to pool_size connections alive per host."""
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def configure_session_pool(pool_size: int) -> None:
+    """Sets how many connections each host session keeps alive. This should match the
+    number of requests that can be in flight against one website at once."""
+    if not isinstance(pool_size, int) or isinstance(pool_size, bool):
+        raise TypeError("pool_size must be an integer.")
+    if pool_size <= 0:
+        raise ValueError("pool_size must be a positive integer.")
+    with SESSION_LOCK:
+        if SESSION_POOL["pool_size"] != pool_size:
+            for session in SESSION_POOL["sessions"].values():
+                session.close()
+            SESSION_POOL["sessions"] = {}
+            SESSION_POOL["pool_size"] = pool_size
+
+
+def get_session(url: str) -> requests.Session:
+    """Returns the pooled session for the host of the given URL.
+    Sessions are created once per process and reused across warm invocations;
+    a forked worker process builds its own rather than sharing its parent's sockets."""
+    host = urlparse(url).netloc
+    with SESSION_LOCK:
+        if SESSION_POOL["pid"] != os.getpid():
+            SESSION_POOL["pid"] = os.getpid()
+            SESSION_POOL["sessions"] = {}
+        if host not in SESSION_POOL["sessions"]:
+            SESSION_POOL["sessions"][host] = create_session(SESSION_POOL["pool_size"])
+        return SESSION_POOL["sessions"][host]
+
+
+class ThrottledError(requests.exceptions.HTTPError):
+    """Raised when a website answers with 429 Too Many Requests or 503 Service Unavailable."""
+
+
+def get_timeout(timeout: float | tuple[float, float]) -> tuple[float, float]:
+    """Returns separate (connect, read) timeouts. A single number is used as the read
+    timeout, so a dead host fails on the short connect timeout instead."""
+    if isinstance(timeout, tuple):
+        return timeout
+    return (min(DEFAULT_CONNECT_TIMEOUT_SECONDS, timeout), timeout)
+
+
+def acquire_rate_limit(website_name: str | None) -> None:
+    """Waits until the website's rate limiter allows another request."""
+    limiter = get_rate_limiter(website_name)
+    if limiter:
+        limiter.acquire()
+
+
+def send_request(url: str, headers: dict, website_name: str | None,
+                 timeout: tuple[float, float], stream: bool = False) -> requests.Response:
+    """Sends a single GET request through the pooled session for the URL's host, feeding the
+    outcome back into the website's rate limiter. The caller waits for the limiter first.
+    The timeout is shortened to fit the run's deadline."""
+    limiter = get_rate_limiter(website_name)
+    timeout = fit_timeout(timeout)
+    response = get_session(url).get(url, headers=headers, timeout=timeout, stream=stream)
+    if response.status_code in THROTTLE_STATUS_CODES:
+        response.close()
+        if limiter:
+            limiter.on_throttle(parse_retry_after(response.headers.get("Retry-After")))
+        raise ThrottledError(f"{website_name or url} answered {response.status_code}",
+                             response=response)
+    if limiter:
+        limiter.on_success()
+    return response
+
+
+def fetch(url: str, headers: dict, website_name: str | None = None,
+          timeout: float | tuple[float, float] = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+          stream: bool = False) -> requests.Response:
+    """Sends a GET request with the fetch policy: retries, hedging and the host's
+    circuit breaker. With stream=True the body is left unread for read_body."""
+    timeout = get_timeout(timeout)
+    return call_with_policy(lambda: send_request(url, headers, website_name, timeout, stream),
+                            urlparse(url).netloc,
+                            acquire=lambda: acquire_rate_limit(website_name))
+
+
+def get_product_response(url: str, headers: dict, website_name: str | None = None,
+                         stream: bool = False) -> requests.Response | None:
+    """Fetch the response for a product page from a given URL."""
     if not isinstance(url, str):
         raise TypeError("URL must be of type string.")
     if not isinstance(headers, dict):
@@ -72,9 +266,13 @@ def get_product_page(url: str, headers: dict) -> str | None:
         logging.error("URL is empty")
         return None
     try:
-        response = requests.get(url, headers=headers,
-                                timeout=DEFAULT_REQUEST_TIMEOUT_SECONDS)
-        return response.text
+        response = fetch(url, headers, website_name, stream=stream)
+        if response.status_code in NOT_FOUND_STATUS_CODES:
+            logging.error("%s answered %s", url, response.status_code)
+            record_failure_reason(NOT_FOUND)
+        return response
+    except ThrottledError as e:
+        logging.warning("Request was throttled: %s", e)
     except requests.exceptions.RequestException as e:
         logging.error("A request error has occurred: %s", e)
     except TimeoutError as e:
@@ -82,6 +280,69 @@ def get_product_page(url: str, headers: dict) -> str | None:
     return None
 
 
+def get_product_page(url: str, headers: dict, website_name: str | None = None) -> str | None:
+    """Fetch the HTML content of a product page from a given URL, archiving it when
+    RESPONSE_ARCHIVE is set."""
+    response = get_product_response(url, headers, website_name)
+    if response is None:
+        return None
+    archive_response(url, response.text, website_name, response.status_code)
+    return response.text
+
+
+def get_stream_stats() -> dict:
+    """Returns the number of streamed pages, how many were closed early and the total
+    bytes transferred by this process."""
+    with SESSION_LOCK:
+        return dict(STREAM_STATS)
+
+
+def read_body(response: requests.Response, scanner=None,
+              max_bytes: int = MAX_BODY_BYTES) -> str | None:
+    """Reads a streamed response body in chunks, feeding the decoded text to scanner.
+    Stops and closes the connection as soon as scanner.feed returns True, or returns None
+    if the body grows beyond max_bytes first."""
+    start = perf_counter()
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    chunks = []
+    size = 0
+    closed_early = False
+    try:
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+            size += len(chunk)
+            if size > max_bytes:
+                logging.error("Response body from %s is over %s bytes", response.url, max_bytes)
+                return None
+            text = decoder.decode(chunk)
+            chunks.append(text)
+            if scanner is not None and scanner.feed(text):
+                closed_early = True
+                break
+        chunks.append(decoder.decode(b"", final=True))
+    finally:
+        bytes_transferred = response.raw.tell() if hasattr(response.raw, "tell") else size
+        response.close()
+
+    with SESSION_LOCK:
+        STREAM_STATS["pages"] += 1
+        STREAM_STATS["closed_early"] += closed_early
+        STREAM_STATS["bytes_transferred"] += bytes_transferred
+    logging.info("Streamed %s: %s bytes transferred, %s after %.3fs", response.url,
+                 bytes_transferred, "price found" if closed_early else "full page read",
+                 response.elapsed.total_seconds() + perf_counter() - start)
+    return "".join(chunks)
+
+
+def get_product_page_streamed(url: str, headers: dict, scanner,
+                              website_name: str | None = None) -> str | None:
+    """Fetch the HTML content of a product page, closing the connection as soon as
+    scanner has seen everything it needs."""
+    response = get_product_response(url, headers, website_name, stream=True)
+    if response is None:
+        return None
+    return read_body(response, scanner)
+
+
 def get_soup(url: str, headers: dict) -> BeautifulSoup | None:
     """Returns a soup object for a game given the web address."""
     if not isinstance(url, str):
@@ -0,0 +1,130 @@
+"""Per-retailer adaptive rate limiting: a token bucket per website whose rate is halved
+when the website pushes back (429 / 503) and grown back slowly on success (AIMD)."""
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import logging
+from threading import Lock
+from time import monotonic, sleep
+
+from deadline import get_remaining_seconds, DeadlineExceeded, MIN_REQUEST_SECONDS
+
+THROTTLE_STATUS_CODES = (429, 503)
+DEFAULT_MIN_RATE = 0.2
+DEFAULT_DECREASE_FACTOR = 0.5
+DEFAULT_INCREASE_FRACTION = 0.05
+
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = Lock()
+
+
+class AdaptiveRateLimiter:  # pylint: disable=too-many-instance-attributes
+    """Thread-safe token bucket. Every request takes one token; tokens refill at the current
+    rate up to a burst of one second's worth. The rate starts at max_rate, is multiplied by
+    decrease_factor on every throttled response and increases by a fixed fraction of max_rate
+    on every successful one."""
+
+    def __init__(self, max_rate: float, min_rate: float = DEFAULT_MIN_RATE,
+                 decrease_factor: float = DEFAULT_DECREASE_FACTOR,
+                 increase_fraction: float = DEFAULT_INCREASE_FRACTION):
+        if not isinstance(max_rate, (int, float)) or isinstance(max_rate, bool):
+            raise TypeError("max_rate must be a number.")
+        if max_rate <= 0:
+            raise ValueError("max_rate must be positive.")
+        self.max_rate = float(max_rate)
+        self.min_rate = min(min_rate, self.max_rate)
+        self.decrease_factor = decrease_factor
+        self.increase = increase_fraction * self.max_rate
+        self.rate = self.max_rate
+        self.tokens = max(1.0, self.rate)
+        self.updated_at = monotonic()
+        self.blocked_until = 0.0
+        self.lock = Lock()
+
+    def refill(self, now: float) -> None:
+        """Adds the tokens earned since the last update."""
+        self.tokens = min(max(1.0, self.rate),
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def get_wait(self) -> float:
+        """Takes a token if one is free and returns 0, otherwise returns how long to wait."""
+        with self.lock:
+            now = monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> float:
+        """Blocks until a request may be sent. Returns the time spent waiting. Raises
+        DeadlineExceeded instead of waiting when the wait (e.g. a Retry-After pause) would
+        leave no time to send the request before the run's deadline."""
+        waited = 0.0
+        wait = self.get_wait()
+        while wait > 0:
+            remaining = get_remaining_seconds()
+            if remaining is not None and remaining - wait < MIN_REQUEST_SECONDS:
+                raise DeadlineExceeded(
+                    f"Waiting {wait:.2f}s for the rate limit would pass the deadline")
+            sleep(wait)
+            waited += wait
+            wait = self.get_wait()
+        return waited
+
+    def on_success(self) -> None:
+        """Additive increase after a successful response."""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after: float | None = None) -> None:
+        """Multiplicative decrease after a 429 / 503, pausing for Retry-After if given."""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, monotonic() + retry_after)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Returns the number of seconds a Retry-After header asks us to wait.
+    The header is either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        logging.error("Invalid Retry-After header: %s", value)
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def configure_rate_limits(rates: dict[str, float], processes: int = 1) -> None:
+    """Creates a rate limiter for every website with a requests_per_second rate.
+    The rate is shared between processes, since each worker process has its own limiter.
+    Existing limiters are kept across warm invocations unless their rate changes."""
+    if not isinstance(processes, int) or processes <= 0:
+        raise ValueError("processes must be a positive integer.")
+    with RATE_LIMITERS_LOCK:
+        for website_name, rate in rates.items():
+            if rate is None:
+                RATE_LIMITERS.pop(website_name, None)
+                continue
+            process_rate = rate / processes
+            limiter = RATE_LIMITERS.get(website_name)
+            if limiter is None or limiter.max_rate != process_rate:
+                RATE_LIMITERS[website_name] = AdaptiveRateLimiter(process_rate)
+
+
+def get_rate_limiter(website_name: str | None) -> AdaptiveRateLimiter | None:
+    """Returns the rate limiter for a website, or None if it is not rate limited."""
+    with RATE_LIMITERS_LOCK:
+        return RATE_LIMITERS.get(website_name)
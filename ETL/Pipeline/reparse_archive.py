@@ -0,0 +1,163 @@
+"""Re-parse Script: runs the extractors' parsers over the raw response archive on every core,
+without touching the network, to backfill readings after a parser fix or to check that the
+current parsers still understand what was downloaded.
+
+Readings are written as JSON lines, one per archived page or ASOS product, and a summary
+of how many parsed per website is printed at the end. Given a CSV export of the products
+table, each reading also gets its product_id, so Email/backfill_readings.py can load it.
+
+Usage:
+    python reparse_archive.py file:///tmp/archive --output readings.jsonl
+    python reparse_archive.py s3://bucket/archive/ --website patagonia --processes 4
+    python reparse_archive.py s3://bucket/archive/ --products products.csv --output readings.jsonl
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+import csv
+import json
+import logging
+import multiprocessing
+from os import environ as ENV
+import os
+import sys
+
+from extract_asos import get_current_price, get_sale_status
+from extract_patagonia import parse_page_html
+from pipeline_helpers import (clear_failure_reasons, get_failure_reason,
+                              NOT_FOUND_STATUS_CODES, NOT_FOUND, MISSING_PRICE)
+from response_archive import get_archive_backend, read_archived_body
+
+FORK = multiprocessing.get_context("fork")
+RECORDS_PER_CHUNK = 64
+
+UNKNOWN_PRODUCT = "UnknownProduct"
+
+WORKER_ARCHIVE = {"backend": None}
+
+
+def open_archive(location: str) -> None:
+    """Runs when a worker process starts, opening its own connection to the archive."""
+    WORKER_ARCHIVE["backend"] = get_archive_backend(location)
+
+
+def parse_patagonia_body(body: str) -> list[dict]:
+    """Parses an archived Patagonia product page into a single reading."""
+    clear_failure_reasons()
+    try:
+        price_and_sale, colour_prices = parse_page_html(body)
+    except ValueError:
+        price_and_sale, colour_prices = None, {}
+    if price_and_sale is None:
+        return [{"current_price": None, "is_on_sale": None, "error": get_failure_reason(None)}]
+    return [{"current_price": price_and_sale[0], "is_on_sale": price_and_sale[1],
+             "colour_prices": colour_prices}]
+
+
+def parse_asos_body(body: str) -> list[dict]:
+    """Parses an archived ASOS stockprice response into a reading per product."""
+    try:
+        product_infos = json.loads(body)
+    except ValueError:
+        product_infos = None
+    if not isinstance(product_infos, list):
+        return [{"current_price": None, "is_on_sale": None, "error": NOT_FOUND}]
+    readings = []
+    for product_info in product_infos:
+        if not isinstance(product_info, dict):
+            continue
+        reading = {"product_code": product_info.get("productId"),
+                   "current_price": get_current_price(product_info),
+                   "is_on_sale": get_sale_status(product_info)}
+        if reading["current_price"] is None or reading["is_on_sale"] is None:
+            reading["error"] = MISSING_PRICE
+        readings.append(reading)
+    return readings
+
+
+ARCHIVE_PARSERS = {"patagonia": parse_patagonia_body, "asos": parse_asos_body}
+
+
+def reparse_record(record: dict) -> list[dict]:
+    """Runs on a worker process. Reads an archived response and returns the readings its
+    website's parser finds in it, each tagged with the URL, fetch time and body hash."""
+    archived = {"url": record["url"], "website_name": record["website_name"],
+                "reading_at": record["fetched_at"], "sha256": record["sha256"]}
+    if record.get("status_code") in NOT_FOUND_STATUS_CODES:
+        return [{**archived, "current_price": None, "is_on_sale": None, "error": NOT_FOUND}]
+    body = read_archived_body(WORKER_ARCHIVE["backend"], record)
+    return [{**archived, **reading}
+            for reading in ARCHIVE_PARSERS[record["website_name"]](body)]
+
+
+def reparse_archive(location: str, processes: int, website_name: str | None = None):
+    """Yields the readings of every archived response of the parsed websites, re-parsed on
+    processes worker processes."""
+    records = (record for record in get_archive_backend(location).iter_records()
+               if record.get("website_name") in ARCHIVE_PARSERS
+               and website_name in (None, record.get("website_name")))
+    with FORK.Pool(processes, initializer=open_archive, initargs=(location,)) as pool:
+        for readings in pool.imap_unordered(reparse_record, records, RECORDS_PER_CHUNK):
+            yield from readings
+
+
+def read_product_index(path: str) -> dict[tuple[str, str], int]:
+    """Reads a CSV export of the products table, with product_id, url, product_code and
+    website_name columns, into the product ID of every (website, URL) and
+    (website, product code)."""
+    index = {}
+    with open(path, encoding="utf-8", newline="") as products_file:
+        for row in csv.DictReader(products_file):
+            index[(row["website_name"], row["url"])] = int(row["product_id"])
+            index[(row["website_name"], row["product_code"])] = int(row["product_id"])
+    return index
+
+
+def add_product_id(reading: dict, index: dict[tuple[str, str], int]) -> dict:
+    """Adds the product_id of a reading, looked up by its ASOS product code or else by the
+    URL of its page. A reading the index has no product for is marked UNKNOWN_PRODUCT."""
+    key = str(reading["product_code"]) if "product_code" in reading else reading["url"]
+    reading["product_id"] = index.get((reading["website_name"], key))
+    if reading["product_id"] is None:
+        reading.setdefault("error", UNKNOWN_PRODUCT)
+    return reading
+
+
+def summarise_readings(counts: Counter) -> str:
+    """Returns a line per website with how many readings parsed and why the rest did not."""
+    lines = []
+    for website_name in sorted({website_name for website_name, _ in counts}):
+        outcomes = {error: count for (name, error), count in counts.items()
+                    if name == website_name}
+        parsed = outcomes.pop(None, 0)
+        lines.append(f"{website_name}: {parsed} parsed, "
+                     f"{sum(outcomes.values())} not parsed {dict(sorted(outcomes.items()))}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("location", nargs="?", default=ENV.get("RESPONSE_ARCHIVE"),
+                            help="file://<directory> or s3://<bucket>/<prefix>; "
+                                 "defaults to RESPONSE_ARCHIVE.")
+    arg_parser.add_argument("--website", choices=list(ARCHIVE_PARSERS))
+    arg_parser.add_argument("--processes", type=int, default=os.cpu_count())
+    arg_parser.add_argument("--output", help="File to write the readings to, default stdout.")
+    arg_parser.add_argument("--products",
+                            help="CSV export of the products table, to add each reading's "
+                                 "product_id.")
+    args = arg_parser.parse_args()
+    if not args.location:
+        arg_parser.error("no archive location given and RESPONSE_ARCHIVE is not set")
+    product_index = read_product_index(args.products) if args.products else None
+
+    logging.disable(logging.CRITICAL)
+    outcome_counts = Counter()
+    with (open(args.output, "w", encoding="utf-8") if args.output else sys.stdout) as output:
+        for archived_reading in reparse_archive(args.location, args.processes, args.website):
+            if product_index is not None:
+                add_product_id(archived_reading, product_index)
+            outcome_counts[(archived_reading["website_name"],
+                            archived_reading.get("error"))] += 1
+            output.write(json.dumps(archived_reading) + "\n")
+    print(summarise_readings(outcome_counts), file=sys.stderr)
@@ -0,0 +1,168 @@
+"""Raw response archive: stores every product page and API response the pipeline downloads,
+gzip-compressed and keyed by the SHA-256 of its body, with an index record of the URL,
+fetch time and hash, so that readings can be re-derived offline after a parser fix."""
+
+from datetime import datetime
+import gzip
+from hashlib import sha256
+import json
+import logging
+from os import environ as ENV
+import os
+from threading import Lock
+from typing import Iterator
+
+import boto3
+from botocore.exceptions import ClientError
+
+RESPONSE_ARCHIVE = {"pid": None, "location": None, "backend": None}
+RESPONSE_ARCHIVE_LOCK = Lock()
+
+
+def get_object_key(content_hash: str) -> str:
+    """Returns the key of an archived body, fanned out by the first two hex digits."""
+    return f"objects/{content_hash[:2]}/{content_hash}.gz"
+
+
+def get_index_key(fetched_at: str) -> str:
+    """Returns the key of the index holding the records fetched on a day."""
+    return f"index/{fetched_at[:10]}.jsonl"
+
+
+class FileArchiveBackend:
+    """Stores archived bodies as files under a local directory, with one JSON lines index
+    per day. Every record is appended with a single write, so processes can share it."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def put_object(self, content_hash: str, data: bytes) -> None:
+        """Stores a compressed body, unless a body with the same hash is already stored."""
+        path = os.path.join(self.root, get_object_key(content_hash))
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as object_file:
+            object_file.write(data)
+        os.replace(temporary_path, path)
+
+    def get_object(self, content_hash: str) -> bytes:
+        """Returns a compressed body."""
+        with open(os.path.join(self.root, get_object_key(content_hash)), "rb") as object_file:
+            return object_file.read()
+
+    def add_record(self, record: dict) -> None:
+        """Appends an index record."""
+        path = os.path.join(self.root, get_index_key(record["fetched_at"]))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as index_file:
+            index_file.write(json.dumps(record) + "\n")
+
+    def iter_records(self) -> Iterator[dict]:
+        """Yields every index record, oldest day first."""
+        index_dir = os.path.join(self.root, "index")
+        if not os.path.isdir(index_dir):
+            return
+        for name in sorted(os.listdir(index_dir)):
+            with open(os.path.join(index_dir, name), encoding="utf-8") as index_file:
+                for line in index_file:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+class S3ArchiveBackend:
+    """Stores archived bodies and index records as objects in S3, so that every Lambda
+    writes to the same archive. Each index record is its own object."""
+
+    def __init__(self, bucket: str, prefix: str, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client(
+            "s3",
+            aws_access_key_id=ENV.get("ACCESS_KEY"),
+            aws_secret_access_key=ENV.get("SECRET_ACCESS_KEY")
+        )
+
+    def put_object(self, content_hash: str, data: bytes) -> None:
+        """Stores a compressed body. Bodies are content-addressed, so rewriting one is
+        harmless and cheaper than checking for it first."""
+        self.client.put_object(Bucket=self.bucket,
+                               Key=self.prefix + get_object_key(content_hash), Body=data)
+
+    def get_object(self, content_hash: str) -> bytes:
+        """Returns a compressed body."""
+        response = self.client.get_object(Bucket=self.bucket,
+                                          Key=self.prefix + get_object_key(content_hash))
+        return response["Body"].read()
+
+    def add_record(self, record: dict) -> None:
+        """Stores an index record under the day it was fetched."""
+        url_hash = sha256(record["url"].encode()).hexdigest()[:16]
+        key = (f"{self.prefix}index/{record['fetched_at'][:10]}/"
+               f"{record['fetched_at']}-{url_hash}-{record['sha256'][:16]}.json")
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(record).encode())
+
+    def iter_records(self) -> Iterator[dict]:
+        """Yields every index record, oldest day first."""
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}index/"):
+            for item in page.get("Contents", []):
+                response = self.client.get_object(Bucket=self.bucket, Key=item["Key"])
+                yield json.loads(response["Body"].read())
+
+
+def get_archive_backend(location: str):
+    """Returns an archive backend for a location of the form file://<directory> or
+    s3://<bucket>/<prefix>."""
+    if not isinstance(location, str):
+        raise TypeError("Archive location must be of type string.")
+    scheme, _, path = location.partition("://")
+    if not path:
+        raise ValueError(f"Invalid archive location {location}")
+    if scheme == "file":
+        return FileArchiveBackend(path)
+    if scheme == "s3":
+        bucket, _, prefix = path.partition("/")
+        return S3ArchiveBackend(bucket, prefix)
+    raise ValueError(f"Unknown archive backend {scheme}")
+
+
+def get_response_archive():
+    """Returns the archive backend configured by RESPONSE_ARCHIVE, or None if archiving is
+    off. The backend is created once per process, since an S3 client must not be shared
+    with forked workers."""
+    location = ENV.get("RESPONSE_ARCHIVE")
+    if not location:
+        return None
+    with RESPONSE_ARCHIVE_LOCK:
+        if RESPONSE_ARCHIVE["pid"] != os.getpid() or RESPONSE_ARCHIVE["location"] != location:
+            RESPONSE_ARCHIVE["backend"] = get_archive_backend(location)
+            RESPONSE_ARCHIVE["pid"], RESPONSE_ARCHIVE["location"] = os.getpid(), location
+        return RESPONSE_ARCHIVE["backend"]
+
+
+def archive_response(url: str, body: str, website_name: str | None,
+                     status_code: int | None = None) -> None:
+    """Archives a downloaded body if RESPONSE_ARCHIVE is set. A failure to archive is logged
+    rather than raised, so it never costs a reading."""
+    backend = get_response_archive()
+    if backend is None or not isinstance(body, str):
+        return
+    data = body.encode()
+    record = {"url": url,
+              "website_name": website_name,
+              "status_code": status_code,
+              "fetched_at": datetime.now().isoformat(".", "seconds"),
+              "sha256": sha256(data).hexdigest(),
+              "size": len(data)}
+    try:
+        backend.put_object(record["sha256"], gzip.compress(data))
+        backend.add_record(record)
+    except (OSError, ClientError) as e:
+        logging.error("Error archiving the response from %s: %s", url, e)
+
+
+def read_archived_body(backend, record: dict) -> str:
+    """Returns the body of an archived response."""
+    return gzip.decompress(backend.get_object(record["sha256"])).decode()
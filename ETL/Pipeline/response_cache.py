@@ -0,0 +1,163 @@
+"""Response validation cache: stores the validators (ETag / Last-Modified), a hash of the
+price fragment and the last parsed price of each product page, keyed by product URL."""
+
+from hashlib import sha256
+import json
+import logging
+from os import environ as ENV
+import os
+import sqlite3
+from threading import Lock
+
+import boto3
+from botocore.exceptions import ClientError
+
+RESPONSE_CACHE = {"pid": None, "location": None, "backend": None}
+RESPONSE_CACHE_LOCK = Lock()
+
+
+class FileCacheBackend:
+    """Stores every cache entry in a single local JSON file. Intended for tests and
+    local runs. The file is replaced in one step, so a process never reads a half-written
+    file, though concurrent writers from different processes can lose each other's entries."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+
+    def read_all(self) -> dict:
+        """Returns every entry in the file. A corrupt file is treated as empty."""
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding="utf-8") as cache_file:
+            try:
+                return json.load(cache_file)
+            except ValueError as e:
+                logging.error("Ignoring corrupt response cache %s: %s", self.path, e)
+                return {}
+
+    def get(self, url: str) -> dict | None:
+        """Returns the cache entry for a URL, or None if there is none."""
+        with self.lock:
+            return self.read_all().get(url)
+
+    def set(self, url: str, entry: dict) -> None:
+        """Stores the cache entry for a URL."""
+        with self.lock:
+            entries = self.read_all()
+            entries[url] = entry
+            temporary_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(temporary_path, self.path)
+
+
+class SQLiteCacheBackend:
+    """Stores cache entries in a local SQLite database."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS response_cache (
+                            url TEXT PRIMARY KEY,
+                            entry TEXT NOT NULL)""")
+
+    def get(self, url: str) -> dict | None:
+        """Returns the cache entry for a URL, or None if there is none."""
+        with sqlite3.connect(self.path) as conn:
+            row = conn.execute("SELECT entry FROM response_cache WHERE url = ?",
+                               (url,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, url: str, entry: dict) -> None:
+        """Stores the cache entry for a URL."""
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("INSERT OR REPLACE INTO response_cache (url, entry) VALUES (?, ?)",
+                         (url, json.dumps(entry)))
+
+
+class S3CacheBackend:
+    """Stores each cache entry as a small JSON object in S3, so that every Lambda
+    shares the same cache."""
+
+    def __init__(self, bucket: str, prefix: str, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client(
+            "s3",
+            aws_access_key_id=ENV.get("ACCESS_KEY"),
+            aws_secret_access_key=ENV.get("SECRET_ACCESS_KEY")
+        )
+
+    def get_key(self, url: str) -> str:
+        """Returns the object key used for a URL."""
+        return f"{self.prefix}{sha256(url.encode()).hexdigest()}.json"
+
+    def get(self, url: str) -> dict | None:
+        """Returns the cache entry for a URL, or None if there is none."""
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.get_key(url))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            logging.error("Error reading response cache: %s", e)
+            return None
+        return json.loads(response["Body"].read())
+
+    def set(self, url: str, entry: dict) -> None:
+        """Stores the cache entry for a URL."""
+        try:
+            self.client.put_object(Bucket=self.bucket, Key=self.get_key(url),
+                                   Body=json.dumps(entry).encode())
+        except ClientError as e:
+            logging.error("Error writing response cache: %s", e)
+
+
+def get_cache_backend(location: str):
+    """Returns a cache backend for a location of the form file://<path>,
+    sqlite://<path> or s3://<bucket>/<prefix>."""
+    if not isinstance(location, str):
+        raise TypeError("Cache location must be of type string.")
+    scheme, _, path = location.partition("://")
+    if not path:
+        raise ValueError(f"Invalid cache location {location}")
+    if scheme == "file":
+        return FileCacheBackend(path)
+    if scheme == "sqlite":
+        return SQLiteCacheBackend(path)
+    if scheme == "s3":
+        bucket, _, prefix = path.partition("/")
+        return S3CacheBackend(bucket, prefix)
+    raise ValueError(f"Unknown cache backend {scheme}")
+
+
+def get_response_cache():
+    """Returns the cache backend configured by RESPONSE_CACHE, or None if caching is off.
+    The backend is created once per process and reused across warm invocations, since an
+    S3 client must not be shared with forked workers."""
+    location = ENV.get("RESPONSE_CACHE")
+    if not location:
+        return None
+    with RESPONSE_CACHE_LOCK:
+        if RESPONSE_CACHE["pid"] != os.getpid() or RESPONSE_CACHE["location"] != location:
+            RESPONSE_CACHE["backend"] = get_cache_backend(location)
+            RESPONSE_CACHE["pid"], RESPONSE_CACHE["location"] = os.getpid(), location
+        return RESPONSE_CACHE["backend"]
+
+
+def get_conditional_headers(headers: dict, entry: dict | None) -> dict:
+    """Returns the request headers with If-None-Match / If-Modified-Since added
+    from a cache entry."""
+    conditional_headers = dict(headers)
+    if entry and entry.get("etag"):
+        conditional_headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        conditional_headers["If-Modified-Since"] = entry["last_modified"]
+    return conditional_headers
+
+
+def get_fragment_hash(fragment: str | None) -> str | None:
+    """Returns a hash of the price fragment of a page."""
+    if fragment is None:
+        return None
+    return sha256(fragment.encode()).hexdigest()
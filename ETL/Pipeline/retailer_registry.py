@@ -0,0 +1,110 @@
+"""Retailer Registry: every retailer the pipeline extracts from is registered here with an
+execution profile describing how its products should be scheduled."""
+
+import logging
+from typing import Callable
+
+COST_CLASSES = ("api", "html")
+COST_CLASS_ORDER = {"html": 0, "api": 1}
+
+RETAILERS = {}
+
+
+def register_retailer(website_name: str, extract: Callable, cost_class: str,  # pylint: disable=too-many-arguments
+                      max_concurrency: int, *, requests_per_second: float | None = None,
+                      batch_extract: Callable | None = None,
+                      batch_size: int | None = None,
+                      coalesce_key: Callable | None = None,
+                      fetch_page: Callable | None = None,
+                      parse_page: Callable | None = None) -> dict:
+    """Registers a retailer's extractor and execution profile.
+
+    cost_class is "api" for cheap JSON lookups or "html" for expensive page scrapes,
+    max_concurrency caps the retailer's requests in flight, and batch_extract with
+    batch_size enables batched lookups of up to batch_size products. With coalesce_key,
+    only products with the same key share a batch (e.g. colourways of the same page).
+    fetch_page and parse_page split a task into an I/O and a CPU stage for the staged
+    engine: fetch_page(products) returns the raw page and parse_page(products, page) the
+    readings."""
+    if not isinstance(website_name, str) or not website_name:
+        logging.error("website_name must be a non-empty string.")
+        raise TypeError("website_name must be a non-empty string.")
+    if not callable(extract):
+        logging.error("extract must be callable.")
+        raise TypeError("extract must be callable.")
+    if cost_class not in COST_CLASSES:
+        logging.error("Unknown cost class %s", cost_class)
+        raise ValueError(f"Unknown cost class {cost_class}")
+    if (not isinstance(max_concurrency, int) or isinstance(max_concurrency, bool)
+            or max_concurrency <= 0):
+        logging.error("max_concurrency must be a positive integer.")
+        raise ValueError("max_concurrency must be a positive integer.")
+    if (batch_extract is None) != (batch_size is None):
+        logging.error("batch_extract and batch_size must be given together.")
+        raise ValueError("batch_extract and batch_size must be given together.")
+    if batch_size is not None and (not isinstance(batch_size, int) or batch_size <= 0):
+        logging.error("batch_size must be a positive integer.")
+        raise ValueError("batch_size must be a positive integer.")
+    if coalesce_key is not None and batch_extract is None:
+        logging.error("coalesce_key needs a batch_extract.")
+        raise ValueError("coalesce_key needs a batch_extract.")
+    if (fetch_page is None) != (parse_page is None):
+        logging.error("fetch_page and parse_page must be given together.")
+        raise ValueError("fetch_page and parse_page must be given together.")
+
+    RETAILERS[website_name] = {
+        "extract": extract,
+        "cost_class": cost_class,
+        "max_concurrency": max_concurrency,
+        "requests_per_second": requests_per_second,
+        "batch_extract": batch_extract,
+        "batch_size": batch_size,
+        "coalesce_key": coalesce_key,
+        "fetch_page": fetch_page,
+        "parse_page": parse_page
+    }
+    return RETAILERS[website_name]
+
+
+def get_retailer(website_name: str | None) -> dict | None:
+    """Returns the profile of a retailer, or None if it is not registered."""
+    return RETAILERS.get(website_name)
+
+
+def supports_batches(website_name: str | None) -> bool:
+    """Returns True if the retailer can look up several products in one request."""
+    profile = get_retailer(website_name)
+    return profile is not None and profile["batch_extract"] is not None
+
+
+def supports_stages(website_name: str | None) -> bool:
+    """Returns True if the retailer's pages can be fetched and parsed in separate stages."""
+    profile = get_retailer(website_name)
+    return profile is not None and profile["parse_page"] is not None
+
+
+def get_batch_key(website_name: str | None, product_data: dict):
+    """Returns the key of the batch a product belongs to, or None if it must be processed
+    on its own. Products are batched per website, or per coalesce_key if the website has one."""
+    if not supports_batches(website_name):
+        return None
+    coalesce_key = get_retailer(website_name)["coalesce_key"]
+    if coalesce_key is None:
+        return website_name
+    key = coalesce_key(product_data)
+    return None if key is None else (website_name, key)
+
+
+def get_concurrency_limits() -> dict[str, int]:
+    """Returns the maximum number of requests in flight for each retailer."""
+    return {website_name: profile["max_concurrency"]
+            for website_name, profile in RETAILERS.items()}
+
+
+def get_cost_rank(website_name: str | None) -> int:
+    """Returns the scheduling rank of a retailer's cost class. Expensive HTML scrapes rank
+    first so they start early instead of forming a tail behind cheap API calls."""
+    profile = get_retailer(website_name)
+    if profile is None:
+        return len(COST_CLASS_ORDER)
+    return COST_CLASS_ORDER[profile["cost_class"]]
@@ -0,0 +1,113 @@
+"""Staged Extract Engine: runs extraction as two stages joined by a bounded queue. I/O threads
+fetch raw pages while worker processes parse them, so network and CPU work overlap."""
+
+import logging
+from queue import Queue, Empty, Full
+from threading import Event, Thread
+from typing import Callable, Iterator
+
+from deadline import get_remaining_seconds
+from extract_async import UNFINISHED
+
+QUEUE_POLL_SECONDS = 0.05
+
+
+def fetch_into_queue(tasks: list, fetch_function: Callable, work: Queue, pages: Queue,
+                     stop: Event) -> None:
+    """Runs on every I/O thread, fetching tasks until none are left and putting each fetched
+    page on the bounded pages queue. A full queue blocks the thread, so fetching cannot run
+    ahead of parsing. A task whose fetch raises is logged and skipped, so it is reported as
+    unfinished rather than taking the thread down."""
+    while not stop.is_set():
+        try:
+            index = work.get_nowait()
+        except Empty:
+            return
+        try:
+            fetched = fetch_function(tasks[index])
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.exception("Fetching task %s failed", index)
+            continue
+        while not stop.is_set():
+            try:
+                pages.put((index, fetched), timeout=QUEUE_POLL_SECONDS)
+                break
+            except Full:
+                continue
+
+
+def start_fetching(tasks: list, fetch_function: Callable, fetch_threads: int,
+                   queue_size: int) -> tuple[Queue, Event, list[Thread]]:
+    """Starts the I/O threads and returns the bounded queue they put fetched pages on, with
+    the event that stops them and the threads themselves."""
+    work = Queue()
+    for index in range(len(tasks)):
+        work.put(index)
+    pages = Queue(maxsize=queue_size)
+    stop = Event()
+    threads = [Thread(target=fetch_into_queue, args=(tasks, fetch_function, work, pages, stop),
+                      daemon=True)
+               for _ in range(min(fetch_threads, len(tasks)))]
+    for thread in threads:
+        thread.start()
+    return pages, stop, threads
+
+
+def pop_parsed(parsing: dict) -> list[tuple[int, object]]:
+    """Removes the pages that have finished parsing and returns their index and result."""
+    ready = [index for index, async_result in parsing.items() if async_result.ready()]
+    return [(index, parsing.pop(index).get(0)) for index in ready]
+
+
+def should_stop(pages: Queue, parsing: dict, threads: list[Thread]) -> bool:
+    """Returns True once the run's deadline has passed, or once every I/O thread has exited
+    and no page is left queued or being parsed, so no further task can complete."""
+    remaining = get_remaining_seconds()
+    if remaining is not None and remaining <= 0:
+        return True
+    return not parsing and not any(thread.is_alive() for thread in threads) and pages.empty()
+
+
+def run_stages(tasks: list, fetch_function: Callable, submit_parse: Callable,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+               fetch_threads: int, queue_size: int,
+               max_parsing: int) -> Iterator[tuple[int, object]]:
+    """Yields the index and result of each task as soon as it completes.
+
+    fetch_function(task) runs on fetch_threads I/O threads and returns (needs_parse, value).
+    If needs_parse is False, value is already the task's result. Otherwise value is the page,
+    which waits in a queue of up to queue_size pages until submit_parse(task, page) hands it
+    to a worker process; at most max_parsing pages are being parsed at once.
+    Tasks not completed by the run's deadline, or lost because every I/O thread has exited
+    without fetching them, are yielded last as UNFINISHED."""
+    if not tasks:
+        return
+    pages, stop, threads = start_fetching(tasks, fetch_function, fetch_threads, queue_size)
+    parsing = {}
+    completed = set()
+    try:
+        while len(completed) < len(tasks):
+            if should_stop(pages, parsing, threads):
+                break
+            for index, result in pop_parsed(parsing):
+                completed.add(index)
+                yield index, result
+            if parsing and len(parsing) >= max_parsing:
+                min(parsing.items())[1].wait(QUEUE_POLL_SECONDS)
+                continue
+            try:
+                index, (needs_parse, value) = pages.get(timeout=QUEUE_POLL_SECONDS)
+            except Empty:
+                continue
+            if needs_parse:
+                parsing[index] = submit_parse(tasks[index], value)
+            else:
+                completed.add(index)
+                yield index, value
+    finally:
+        stop.set()
+    if len(completed) < len(tasks):
+        logging.warning("%s tasks were not finished",
+                        len(tasks) - len(completed))
+    for index in range(len(tasks)):
+        if index not in completed:
+            yield index, UNFINISHED
@@ -0,0 +1,63 @@
+"""This file tests whether the benchmark_server file works as expected"""
+
+import pytest
+import requests
+
+from benchmark_server import (RetailerStandIn, start_server, get_asos_product_info,
+                              ASOS_PATH, PATAGONIA_PATH)
+
+
+@pytest.fixture(name="server_url")
+def fixture_server_url():
+    """Starts a stand-in without latency and returns its URL."""
+    server = start_server(RetailerStandIn(patagonia_page="<html>page</html>"))
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_get_asos_product_info_shape():
+    """Tests the entry has the fields the ASOS extractor reads"""
+    product_info = get_asos_product_info(100005)
+    assert product_info["productId"] == 100005
+    assert product_info["productPrice"]["current"]["value"] == 10 + 100005 % 90
+    assert product_info["productPrice"]["discountPercentage"] > 0
+
+
+def test_server_asos_batch(server_url):
+    """Tests every requested product ID is answered"""
+    response = requests.get(f"{server_url}{ASOS_PATH}?productIds=1,2,x&store=COM", timeout=5)
+    assert [info["productId"] for info in response.json()] == [1, 2]
+
+
+def test_server_patagonia_page(server_url):
+    """Tests product pages are served as HTML"""
+    response = requests.get(f"{server_url}{PATAGONIA_PATH}1.html", timeout=5)
+    assert response.status_code == 200
+    assert response.text == "<html>page</html>"
+
+
+def test_server_unknown_path(server_url):
+    """Tests unknown paths return a 404"""
+    assert requests.get(f"{server_url}/unknown", timeout=5).status_code == 404
+
+
+def test_server_errors():
+    """Tests an error rate of 1 answers every request with a 503"""
+    server = start_server(RetailerStandIn(error_rate=1))
+    response = requests.get(f"http://127.0.0.1:{server.server_port}{ASOS_PATH}", timeout=5)
+    server.shutdown()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+@pytest.mark.parametrize("error_rate", [-0.1, 1.5])
+def test_stand_in_invalid_error_rate(error_rate):
+    """Tests error rates outside 0 to 1 are rejected"""
+    with pytest.raises(ValueError):
+        RetailerStandIn(error_rate=error_rate)
+
+
+def test_stand_in_delay_never_negative():
+    """Tests jitter larger than the latency never gives a negative delay"""
+    stand_in = RetailerStandIn(latency_ms=1, jitter_ms=50)
+    assert all(stand_in.get_delay() >= 0 for _ in range(100))
@@ -0,0 +1,111 @@
+"""This file tests whether the claim_check file works as expected"""
+
+from datetime import datetime
+from decimal import Decimal
+import gzip
+from io import BytesIO
+import json
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import claim_check
+from claim_check import (FileClaimStore, S3ClaimStore, create_claim_store, get_claim_store,
+                         get_claim_check_location, check_in, check_out, check_in_all,
+                         check_out_all, is_claim_check)
+
+
+def test_check_in_round_trip(tmp_path):
+    """Tests a checked-in payload is stored compressed and checked out unchanged"""
+    payload = [{"product_id": 1, "url": "https://example.com/1", "price": 19.99}]
+    reference = check_in(payload, f"file://{tmp_path}")
+    assert is_claim_check(reference)
+    assert reference["claim_check"] == f"file://{tmp_path}"
+    assert json.loads(gzip.decompress((tmp_path / reference["key"]).read_bytes())) == payload
+    assert check_out(reference) == payload
+
+
+def test_check_in_encodes_database_values(tmp_path):
+    """Tests prices and times read from the database can be checked in"""
+    reference = check_in({"price": Decimal("19.99"), "at": datetime(2024, 6, 1, 12, 0)},
+                         f"file://{tmp_path}")
+    assert check_out(reference) == {"price": 19.99, "at": "2024-06-01T12:00:00"}
+
+
+def test_check_in_unserializable_payload(tmp_path):
+    """Tests a payload JSON cannot encode raises instead of being stored partially"""
+    with pytest.raises(TypeError):
+        check_in({"product": object()}, f"file://{tmp_path}")
+
+
+@pytest.mark.parametrize("value", [[{"product_id": 1}], {"readings": []}, None,
+                                   {"claim_check": "file:///tmp"}])
+def test_check_out_inline_payload(value):
+    """Tests anything other than a reference is returned unchanged"""
+    assert check_out(value) == value
+
+
+def test_check_in_all_keeps_order(tmp_path):
+    """Tests references are returned in the order of their payloads"""
+    payloads = [[{"product_id": index}] for index in range(50)]
+    references = check_in_all(payloads, f"file://{tmp_path}")
+    assert len({reference["key"] for reference in references}) == 50
+    assert check_out_all(references) == payloads
+
+
+def test_check_out_all_mixed(tmp_path):
+    """Tests inline payloads and references can be checked out together"""
+    reference = check_in({"readings": [1]}, f"file://{tmp_path}")
+    assert check_out_all([{"readings": [2]}, reference]) == [{"readings": [2]},
+                                                             {"readings": [1]}]
+
+
+def test_s3_claim_store():
+    """Tests the S3 store writes and reads objects under its prefix"""
+    client = MagicMock()
+    client.get_object.return_value = {"Body": BytesIO(b"data")}
+    store = S3ClaimStore("bucket", "runs/", client=client)
+    store.put_object("claims/a.json.gz", b"data")
+    assert client.put_object.call_args.kwargs == {"Bucket": "bucket",
+                                                  "Key": "runs/claims/a.json.gz",
+                                                  "Body": b"data"}
+    assert store.get_object("claims/a.json.gz") == b"data"
+
+
+@patch("claim_check.boto3.client")
+def test_create_claim_store(mock_client):
+    """Tests stores are created for file and S3 locations"""
+    assert isinstance(create_claim_store("file:///tmp/claims"), FileClaimStore)
+    store = create_claim_store("s3://bucket/runs/")
+    assert isinstance(store, S3ClaimStore)
+    assert (store.bucket, store.prefix) == ("bucket", "runs/")
+    assert mock_client.call_count == 1
+
+
+@pytest.mark.parametrize("location, error", [(None, TypeError), ("bucket", ValueError),
+                                             ("ftp://host/path", ValueError)])
+def test_create_claim_store_invalid(location, error):
+    """Tests invalid locations raise an error"""
+    with pytest.raises(error):
+        create_claim_store(location)
+
+
+def test_get_claim_store_reused(tmp_path):
+    """Tests a store is created once per location"""
+    assert get_claim_store(f"file://{tmp_path}") is get_claim_store(f"file://{tmp_path}")
+
+
+@pytest.mark.parametrize("value, location", [("", None), ("file:///tmp", "file:///tmp")])
+def test_get_claim_check_location(value, location):
+    """Tests claim checks are off unless CLAIM_CHECK is set"""
+    with patch.dict("claim_check.ENV", {"CLAIM_CHECK": value}):
+        assert get_claim_check_location() == location
+
+
+@pytest.mark.parametrize("folder", ["Provision", "Email"])
+def test_copies_are_identical(folder):
+    """Tests the copy of claim_check.py in another lambda's folder matches this one"""
+    source = Path(claim_check.__file__).resolve()
+    copy = source.parent.parent / folder / "claim_check.py"
+    assert copy.read_bytes() == source.read_bytes()
@@ -0,0 +1,62 @@
+"""This file tests whether the deadline file works as expected"""
+
+from time import sleep
+from unittest.mock import MagicMock
+
+import pytest
+
+from deadline import (set_deadline, get_remaining_seconds, fit_timeout, DeadlineExceeded,
+                      get_lambda_remaining_seconds, is_out_of_time)
+
+
+def test_no_deadline():
+    """Tests timeouts are untouched without a deadline"""
+    set_deadline(None)
+    assert get_remaining_seconds() is None
+    assert fit_timeout((5, 30)) == (5, 30)
+
+
+def test_set_deadline_keeps_margin():
+    """Tests the margin is taken off the remaining time"""
+    set_deadline(60, margin_seconds=5)
+    assert 54 < get_remaining_seconds() <= 55
+
+
+def test_set_deadline_invalid_type():
+    """Tests a TypeError is raised for a non-numeric remaining time"""
+    with pytest.raises(TypeError):
+        set_deadline("60")
+
+
+def test_fit_timeout_shortens_to_deadline():
+    """Tests the timeout never runs past the deadline"""
+    set_deadline(3, margin_seconds=0)
+    connect, read = fit_timeout((5, 30))
+    assert 2 < connect <= 3
+    assert 2 < read <= 3
+
+
+def test_fit_timeout_no_time_left():
+    """Tests no request is sent once the deadline is too close"""
+    set_deadline(0.1, margin_seconds=0)
+    sleep(0.1)
+    with pytest.raises(DeadlineExceeded):
+        fit_timeout((5, 30))
+
+
+def test_is_out_of_time():
+    """Tests the run is out of time once there is no time left to send a request"""
+    set_deadline(None)
+    assert not is_out_of_time()
+    set_deadline(60, margin_seconds=0)
+    assert not is_out_of_time()
+    set_deadline(0.1, margin_seconds=0)
+    assert is_out_of_time()
+
+
+def test_get_lambda_remaining_seconds():
+    """Tests the remaining time is read from the Lambda context"""
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 12500
+    assert get_lambda_remaining_seconds(context) == 12.5
+    assert get_lambda_remaining_seconds(None) is None
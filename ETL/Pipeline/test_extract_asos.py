@@ -6,7 +6,9 @@ import requests
 import pytest
 
 from extract_asos import (get_product_info, get_asos_api_url, get_current_price,
-                          get_sale_status, process_product)
+                          get_sale_status, process_product, get_asos_batch_api_url,
+                          get_batch_product_info, process_products)
+from pipeline_helpers import clear_failure_reasons, get_failure_reason
 
 
 def test_get_asos_api_url_product_code(fake_product_data):
@@ -22,7 +24,7 @@ def test_get_asos_api_url_non_integer_product_code(product_code):
     assert get_asos_api_url(product_code) is None
 
 
-@patch("extract_asos.requests.get")
+@patch("requests.Session.get")
 def test_get_product_info_success(mock_get, fake_product_data, fake_headers,
                                   fake_product_response_info):
     """Tests the get_product_info function passes with valid data"""
@@ -32,10 +34,11 @@ def test_get_product_info_success(mock_get, fake_product_data, fake_headers,
     result = get_product_info(fake_product_data, fake_headers)
     assert result == fake_product_response_info
     assert mock_get.call_count == 1
-    assert mock_get.call_args[1] == {"timeout": 40}
+    assert mock_get.call_args[1] == {"headers": fake_headers, "timeout": (5, 40),
+                                    "stream": False}
 
 
-@patch("extract_asos.requests.get")
+@patch("requests.Session.get")
 def test_get_product_info_timeout_exception(mock_get, fake_product_data, fake_headers):
     """Tests the get_product_info function raises a Timeout error"""
 
@@ -45,7 +48,7 @@ def test_get_product_info_timeout_exception(mock_get, fake_product_data, fake_he
     assert product_info is None
 
 
-@patch("extract_asos.requests.get")
+@patch("requests.Session.get")
 def test_get_product_info_request_exception(mock_get, fake_product_data, fake_headers):
     """Tests the get_product_info function raises a RequestsException error"""
 
@@ -116,7 +119,7 @@ def test_get_sale_status_invalid_product_info_type(product_info):
         get_sale_status(product_info)
 
 
-@patch("extract_asos.requests.get")
+@patch("requests.Session.get")
 def test_process_product(mock_get, fake_product_data, fake_product_response_info):
     """Tests the process_product function"""
     mock_get.return_value.json.return_value = [fake_product_response_info]
@@ -124,3 +127,100 @@ def test_process_product(mock_get, fake_product_data, fake_product_response_info
     assert processed_product["current_price"] == 70
     assert "reading_at" in processed_product
     assert processed_product["is_on_sale"]
+
+
+def test_get_asos_batch_api_url_valid():
+    """Tests the batch url joins every product code"""
+    excepted_url = "https://www.asos.com/api/product/catalogue/v4/stockprice?productIds=\
+1,2,3&store=COM&currency=GBP&keyStoreDataversion=ornjx7v-36&country=GB"
+    assert get_asos_batch_api_url([1, 2, 3]) == excepted_url
+
+
+@pytest.mark.parametrize("product_codes", [[], None, 12, ["1", 2], [1.5], [True], "1,2"])
+def test_get_asos_batch_api_url_invalid(product_codes):
+    """Tests the batch url is None for invalid product codes"""
+    assert get_asos_batch_api_url(product_codes) is None
+
+
+def test_get_asos_batch_api_url_too_many():
+    """Tests the batch url is None when too many products are requested"""
+    assert get_asos_batch_api_url(list(range(51))) is None
+
+
+@patch("requests.Session.get")
+def test_get_batch_product_info_success(mock_get, fake_headers, fake_product_response_info):
+    """Tests the batch response is keyed by product id"""
+    mock_get.return_value.json.return_value = [
+        {**fake_product_response_info, "productId": 1},
+        {**fake_product_response_info, "productId": 2}]
+    result = get_batch_product_info([1, 2], fake_headers)
+    assert set(result) == {1, 2}
+    assert mock_get.call_count == 1
+    assert mock_get.call_args[1] == {"headers": fake_headers, "timeout": (5, 40),
+                                    "stream": False}
+
+
+@patch("requests.Session.get")
+def test_get_batch_product_info_request_exception(mock_get, fake_headers):
+    """Tests the batch lookup returns an empty dict on a request error"""
+    mock_get.side_effect = requests.exceptions.RequestException
+    assert get_batch_product_info([1, 2], fake_headers) == {}
+
+
+@patch("requests.Session.get")
+def test_get_batch_product_info_error_response(mock_get, fake_headers):
+    """Tests the batch lookup returns an empty dict on an error response"""
+    mock_get.return_value.json.return_value = {"errorCode": "InvalidProductIds"}
+    assert get_batch_product_info([1, 2], fake_headers) == {}
+
+
+@pytest.mark.parametrize("headers", ["invalid", None, 12.34, [1, 2, 3]])
+def test_get_batch_product_info_invalid_headers_type(headers):
+    """Tests get_batch_product_info with invalid headers data type"""
+    with pytest.raises(TypeError):
+        get_batch_product_info([1], headers)
+
+
+@patch("requests.Session.get")
+def test_process_products_maps_back(mock_get, fake_product_data):
+    """Tests each product gets its own price back from a single request"""
+    mock_get.return_value.json.return_value = [
+        {"productId": 2, "productPrice": {"current": {"value": 20}, "discountPercentage": 0}},
+        {"productId": 1, "productPrice": {"current": {"value": 10}, "discountPercentage": 5}}]
+    products = [{**fake_product_data, "product_code": 1},
+                {**fake_product_data, "product_code": 2},
+                {**fake_product_data, "product_code": 3}]
+    results = process_products(products)
+    assert mock_get.call_count == 1
+    assert results[0]["current_price"] == 10 and results[0]["is_on_sale"]
+    assert results[1]["current_price"] == 20 and not results[1]["is_on_sale"]
+    assert "reading_at" in results[1]
+    assert results[2] is None
+
+
+@patch("requests.Session.get")
+def test_process_products_records_missing_products(mock_get, fake_product_data):
+    """Tests products left out of a successful response are recorded as not found"""
+    clear_failure_reasons()
+    mock_get.return_value.json.return_value = [
+        {"productId": 1, "productPrice": {"current": {"value": 10}, "discountPercentage": 5}},
+        {"productId": 2, "productPrice": {}}]
+    products = [{**fake_product_data, "product_id": i, "product_code": i} for i in (1, 2, 3)]
+    process_products(products)
+    assert [get_failure_reason(i) for i in (1, 2, 3)] == ["NoReading", "MissingPrice",
+                                                          "NotFound"]
+
+
+@patch("requests.Session.get")
+def test_process_products_splits_requests(mock_get, fake_product_data):
+    """Tests no request asks for more than 50 products"""
+    mock_get.return_value.json.return_value = []
+    products = [{**fake_product_data, "product_code": i} for i in range(120)]
+    assert process_products(products) == [None] * 120
+    assert mock_get.call_count == 3
+
+
+def test_get_asos_batch_api_url_override():
+    """Tests ASOS_STOCKPRICE_URL points the batch URL at another endpoint"""
+    with patch.dict("extract_asos.ENV", {"ASOS_STOCKPRICE_URL": "http://127.0.0.1:8080/sp"}):
+        assert get_asos_batch_api_url([1, 2]).startswith("http://127.0.0.1:8080/sp?productIds=1,2&")
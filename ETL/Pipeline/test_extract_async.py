@@ -0,0 +1,132 @@
+"""This file tests whether the extract_async file works as expected"""
+
+import threading
+import time
+
+import pytest
+
+from extract_async import get_website_key, extract_concurrently, UNFINISHED
+
+
+def get_limits(max_concurrency, max_per_website, website_limits=None) -> dict:
+    """Returns the limits argument of extract_concurrently"""
+    return {"max_concurrency": max_concurrency, "max_per_website": max_per_website,
+            "website_limits": website_limits}
+
+
+def test_get_website_key_valid(fake_product_data):
+    """Tests get_website_key returns the website name"""
+    assert get_website_key(fake_product_data) == "asos"
+
+
+@pytest.mark.parametrize("product_data", [None, "asos", 1, [1, 2], {}])
+def test_get_website_key_missing(product_data):
+    """Tests get_website_key returns None for invalid products"""
+    assert get_website_key(product_data) is None
+
+
+def test_extract_concurrently_keeps_order():
+    """Tests the results come back in the same order as the products"""
+    products = [{"product_id": i, "website_name": "asos"} for i in range(20)]
+    results = extract_concurrently(products, lambda p: p["product_id"], get_limits(5, 5))
+    assert results == list(range(20))
+
+
+def test_extract_concurrently_runs_in_parallel():
+    """Tests the batch takes roughly as long as its slowest request"""
+    products = [{"product_id": i, "website_name": "asos"} for i in range(20)]
+
+    def slow_process(product):
+        time.sleep(0.2)
+        return product
+
+    start = time.perf_counter()
+    extract_concurrently(products, slow_process, get_limits(20, 20))
+    assert time.perf_counter() - start < 1
+
+
+def test_extract_concurrently_respects_website_limit():
+    """Tests no more than max_per_website requests run for one website"""
+    products = [{"product_id": i, "website_name": "patagonia"} for i in range(12)]
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def tracked_process(product):
+        with lock:
+            in_flight.append(product)
+            peak.append(len(in_flight))
+        time.sleep(0.05)
+        with lock:
+            in_flight.remove(product)
+        return product
+
+    extract_concurrently(products, tracked_process, get_limits(10, 3))
+    assert max(peak) <= 3
+
+
+def test_extract_concurrently_empty_list():
+    """Tests an empty product list returns an empty list"""
+    assert extract_concurrently([], lambda p: p, get_limits(5, 5)) == []
+
+
+@pytest.mark.parametrize("product_list", [None, "products", 1, {}])
+def test_extract_concurrently_invalid_product_list(product_list):
+    """Tests extract_concurrently raises a TypeError on invalid product lists"""
+    with pytest.raises(TypeError):
+        extract_concurrently(product_list, lambda p: p, get_limits(5, 5))
+
+
+@pytest.mark.parametrize("limits", [(0, 5), (5, 0), (-1, 5)])
+def test_extract_concurrently_invalid_limits(limits):
+    """Tests extract_concurrently raises a ValueError on non positive limits"""
+    with pytest.raises(ValueError):
+        extract_concurrently([{}], lambda p: p, get_limits(*limits))
+
+
+@pytest.mark.parametrize("limits", [("5", 5), (5, 2.5), (True, 5)])
+def test_extract_concurrently_invalid_limit_types(limits):
+    """Tests extract_concurrently raises a TypeError on non integer limits"""
+    with pytest.raises(TypeError):
+        extract_concurrently([{}], lambda p: p, get_limits(*limits))
+
+
+@pytest.mark.parametrize("limits", [None, (5, 5), {"max_concurrency": 5}])
+def test_extract_concurrently_invalid_limits_dict(limits):
+    """Tests extract_concurrently raises a TypeError when the limits are missing"""
+    with pytest.raises(TypeError):
+        extract_concurrently([{}], lambda p: p, limits)
+
+
+def test_extract_concurrently_website_limits():
+    """Tests a website limit lower than max_per_website is enforced"""
+    products = [{"product_id": i, "website_name": "patagonia"} for i in range(6)]
+    in_flight = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def tracked_process(product):
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        time.sleep(0.05)
+        with lock:
+            in_flight["now"] -= 1
+        return product
+
+    extract_concurrently(products, tracked_process, get_limits(10, 10, {"patagonia": 2}))
+    assert in_flight["max"] == 2
+
+
+def test_extract_concurrently_timeout():
+    """Tests extractions still running at the timeout are returned as UNFINISHED"""
+    products = [{"product_id": i, "website_name": "asos"} for i in range(3)]
+
+    def slow_second(product):
+        if product["product_id"] == 1:
+            time.sleep(2)
+        return product["product_id"]
+
+    start = time.perf_counter()
+    results = extract_concurrently(products, slow_second, get_limits(5, 5), timeout=0.3)
+    assert time.perf_counter() - start < 1
+    assert results == [0, UNFINISHED, 2]
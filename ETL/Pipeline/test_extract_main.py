@@ -1,11 +1,29 @@
 """This file tests whether the extract_combined file works as expected"""
 
-from unittest.mock import patch
+from time import sleep
+from unittest.mock import patch, MagicMock
 
 import pytest
 
 from extract_main import (get_website_name, remove_stale_products,
-                          extract_price_and_sales_data, process)
+                          extract_price_and_sales_data, process,
+                          extract_price_and_sales_data_async, get_extraction_engine,
+                          handler, build_tasks, process_task, process_batch,
+                          get_rate_limits, split_results, get_product_ids,
+                          iter_completed, stream_price_and_sales_data,
+                          clean_task_readings, run_isolated, summarise_failures, get_chunks,
+                          run_chunk, fetch_stage, parse_stage,
+                          extract_price_and_sales_data_staged, get_recovered_products,
+                          get_task_outcome, get_task_costs, get_task_priority, TASK_COSTS,
+                          UNFINISHED, UNFINISHED_REASON)
+from lambda_multiprocessing import Pool
+
+from deadline import set_deadline, DeadlineExceeded
+from pipeline_helpers import record_failure_reason, NOT_FOUND
+from retailer_registry import RETAILERS
+from worker_pool import WORKER_POOL, discard_worker_pool
+from benchmark_patagonia_parser import build_synthetic_page
+from claim_check import check_in, check_out
 
 
 def test_get_website_name_with_valid_website_name(fake_product_data):
@@ -66,16 +84,26 @@ def test_remove_stale_products_valid_3():
     ]
 
 
-@patch("extract_main.process")
-@patch("extract_main.Pool")
-def test_extract_price_and_sales_data_success(mock_Pool, mock_process, fake_product_list):
+@patch.dict("worker_pool.ENV", {"POOL_PROCESSES": "2", "POOL_THREADS_PER_PROCESS": "2"})
+@patch("worker_pool.Pool")
+def test_extract_price_and_sales_data_success(mock_Pool, fake_product_list):
     """Tests the populate function"""
+    mock_pool = mock_Pool.return_value
+    mock_pool.apply_async.return_value.get.return_value = [([None], [])] * 2
+    assert extract_price_and_sales_data(fake_product_list) == ([], [], [])
+    assert mock_pool.apply_async.call_count == 2
+    assert mock_pool.apply_async.call_args_list[0][0] == (
+        run_chunk, (run_isolated, fake_product_list[:2], None, get_rate_limits(), 2, 2))
+    assert mock_pool.terminate.call_count == 0
+
+
+@patch("worker_pool.Pool")
+def test_extract_price_and_sales_data_reuses_pool(mock_Pool, fake_product_list):
+    """Tests warm invocations reuse the worker pool"""
+    mock_Pool.return_value.apply_async.return_value.get.return_value = [([None], [])] * 3
     extract_price_and_sales_data(fake_product_list)
-    assert mock_Pool.return_value.__enter__.return_value.map.call_count == 1
-    assert mock_Pool.return_value.__enter__.return_value.map.call_args[
-        0][0] == mock_process
-    assert mock_Pool.return_value.__enter__.return_value.map.call_args[
-        0][1] == fake_product_list
+    extract_price_and_sales_data(fake_product_list)
+    assert mock_Pool.call_count == 1
 
 
 @patch("extract_main.validate_input")
@@ -95,3 +123,483 @@ def test_process_invalid_get_website_name(mock_validate_input,
     mock_get_website_name.return_value = None
     result = process(fake_product_data)
     assert result is None
+
+
+@patch("extract_main.extract_concurrently")
+def test_extract_price_and_sales_data_async_removes_none(mock_extract_concurrently,
+                                                         fake_product_list):
+    """Tests the async engine drops products that failed extraction"""
+    mock_extract_concurrently.return_value = [([fake_product_list[0]], []), ([None], []),
+                                              ([None], [])]
+    assert extract_price_and_sales_data_async(fake_product_list) == (
+        [fake_product_list[0]], [], [])
+    assert mock_extract_concurrently.call_args[0][1] == run_isolated
+
+
+@pytest.mark.parametrize("mode", ["pool", "async"])
+def test_get_extraction_engine_valid(mode):
+    """Tests get_extraction_engine returns a function for known modes"""
+    assert callable(get_extraction_engine(mode))
+
+
+def test_get_extraction_engine_invalid():
+    """Tests get_extraction_engine raises a ValueError for unknown modes"""
+    with pytest.raises(ValueError):
+        get_extraction_engine("threads")
+
+
+@patch.dict("extract_main.ENV", {"EXTRACTION_MODE": "async"})
+def test_handler_async_mode(fake_product_list):
+    """Tests the handler uses the asyncio engine when selected"""
+    mock_pool_extract = MagicMock(return_value=([], [], []))
+    mock_async_extract = MagicMock(return_value=([], [], []))
+    with patch.dict("extract_main.EXTRACTION_ENGINES",
+                    {"pool": mock_pool_extract, "async": mock_async_extract}):
+        assert handler(fake_product_list) == {"readings": [], "unfinished": [], "failures": [],
+                                                 "recovered": [], "costs": []}
+    assert mock_async_extract.call_count == 1
+    assert mock_pool_extract.call_count == 0
+
+
+def test_build_tasks_groups_batched_websites(fake_product_data):
+    """Tests ASOS products are grouped while other products stay single"""
+    patagonia_product = {**fake_product_data, "website_name": "patagonia"}
+    asos_products = [{**fake_product_data, "product_id": i} for i in range(3)]
+    tasks = build_tasks([patagonia_product, *asos_products])
+    assert tasks == [patagonia_product, asos_products]
+
+
+def test_build_tasks_splits_on_batch_size(fake_product_data):
+    """Tests batches are never larger than the website's batch size"""
+    asos_products = [{**fake_product_data, "product_id": i} for i in range(5)]
+    with patch.dict("retailer_registry.RETAILERS",
+                    {"asos": {**RETAILERS["asos"], "batch_size": 2}}):
+        tasks = build_tasks(asos_products)
+    assert [len(task) for task in tasks] == [2, 2, 1]
+
+
+def test_build_tasks_orders_html_retailers_first(fake_product_data):
+    """Tests expensive HTML scrapes are scheduled before cheap API lookups"""
+    asos_product = {**fake_product_data, "product_id": 1}
+    patagonia_products = [{**fake_product_data, "product_id": i, "website_name": "patagonia",
+                           "url": f"https://eu.patagonia.com/gb/en/product/{i}.html"}
+                          for i in range(2, 4)]
+    tasks = build_tasks([asos_product, *patagonia_products, None])
+    assert tasks == [*patagonia_products, [asos_product], None]
+
+
+def test_build_tasks_orders_by_priority_first(fake_product_data):
+    """Tests a near-threshold API lookup is scheduled before lower priority HTML scrapes"""
+    asos_products = [{**fake_product_data, "product_id": 1, "priority": 2.0},
+                     {**fake_product_data, "product_id": 2, "priority": 0.0}]
+    patagonia_products = [{**fake_product_data, "product_id": i, "website_name": "patagonia",
+                           "url": f"https://eu.patagonia.com/gb/en/product/{i}.html",
+                           "priority": priority}
+                          for i, priority in [(3, 0.5), (4, 0.0), (5, 2.0)]]
+    tasks = build_tasks([*asos_products, *patagonia_products])
+    assert tasks == [patagonia_products[2], asos_products, patagonia_products[0],
+                     patagonia_products[1]]
+
+
+def test_get_task_priority(fake_product_data):
+    """Tests a batch takes the priority of its most urgent product"""
+    assert get_task_priority({**fake_product_data, "priority": 1.5}) == 1.5
+    assert get_task_priority([{**fake_product_data, "priority": 0.2},
+                              {**fake_product_data, "priority": 0.9}]) == 0.9
+    assert get_task_priority(fake_product_data) == 0.0
+    assert get_task_priority(None) == 0.0
+
+
+def test_build_tasks_keeps_invalid_products(fake_product_list):
+    """Tests products without a batched website are left as single tasks"""
+    assert build_tasks(fake_product_list + [None]) == fake_product_list + [None]
+
+
+@patch("extract_main.process")
+def test_process_task_single_product(mock_process, fake_product_data):
+    """Tests a single product task is processed on its own"""
+    mock_process.return_value = fake_product_data
+    assert process_task(fake_product_data) == [fake_product_data]
+
+
+@patch("extract_main.process_batch")
+def test_process_task_batch(mock_process_batch, fake_product_data):
+    """Tests a list task is processed as a batch"""
+    mock_process_batch.return_value = [fake_product_data]
+    assert process_task([fake_product_data]) == [fake_product_data]
+    assert mock_process_batch.call_count == 1
+
+
+def test_process_batch_drops_invalid_products(fake_product_data):
+    """Tests invalid products are not sent to the batch extractor"""
+    mock_extract = MagicMock(return_value=[fake_product_data])
+    with patch.dict("retailer_registry.RETAILERS",
+                    {"asos": {**RETAILERS["asos"], "batch_extract": mock_extract}}):
+        assert process_batch([fake_product_data, {"hi": "hello"}]) == [fake_product_data]
+    assert mock_extract.call_args[0][0] == [fake_product_data]
+
+
+def test_process_batch_all_invalid():
+    """Tests an empty list is returned when no product is valid"""
+    assert process_batch([{"hi": "hello"}]) == []
+
+
+def test_get_rate_limits():
+    """Tests every registered website has a rate"""
+    rate_limits = get_rate_limits()
+    assert set(rate_limits) == {"asos", "patagonia"}
+    assert all(rate > 0 for rate in rate_limits.values())
+
+
+def test_process_unregistered_website(fake_product_data):
+    """Tests products of websites without a registered retailer are skipped"""
+    assert process({**fake_product_data, "website_name": "zara"}) is None
+
+
+@patch("extract_main.extract_concurrently")
+def test_extract_price_and_sales_data_async_uses_retailer_limits(mock_extract_concurrently,
+                                                                  fake_product_list):
+    """Tests the async engine passes each retailer's max concurrency"""
+    mock_extract_concurrently.return_value = []
+    extract_price_and_sales_data_async(fake_product_list)
+    assert mock_extract_concurrently.call_args[0][2]["website_limits"] == {
+        "asos": 25, "patagonia": 8}
+
+
+def test_build_tasks_coalesces_colourways(fake_product_data):
+    """Tests colourways of the same Patagonia page are grouped into one task"""
+    url = "https://eu.patagonia.com/gb/en/product/socks/50151.html"
+    colourways = [{**fake_product_data, "product_id": i, "website_name": "patagonia",
+                   "url": f"{url}?dwvar_50151_color={colour}&cgid=socks"}
+                  for i, colour in enumerate(["FEA", "BLK"])]
+    other_page = {**fake_product_data, "product_id": 3, "website_name": "patagonia",
+                  "url": "https://eu.patagonia.com/gb/en/product/dress/59085.html"}
+    assert build_tasks([colourways[0], other_page, colourways[1]]) == [colourways, other_page]
+
+
+def sleep_for(seconds: float) -> float:
+    """Sleeps for the given seconds; a pool task for the deadline tests."""
+    sleep(seconds)
+    return seconds
+
+
+def test_get_product_ids(fake_product_data):
+    """Tests the product IDs of single and batched tasks"""
+    assert get_product_ids(fake_product_data) == [1]
+    assert get_product_ids([fake_product_data, {**fake_product_data, "product_id": 2}]) == [1, 2]
+    assert get_product_ids(None) == []
+
+
+def test_split_results(fake_product_data):
+    """Tests readings are kept and unfinished tasks are reported by product ID"""
+    batch = [{**fake_product_data, "product_id": 2}, {**fake_product_data, "product_id": 3}]
+    failure = {"product_id": 4, "error": "KeyError", "elapsed_seconds": 0.1}
+    readings, unfinished, failures = split_results(
+        [fake_product_data, batch, {"product_id": 4}],
+        [([fake_product_data], []), UNFINISHED, ([], [failure])])
+    assert readings == [fake_product_data]
+    assert unfinished == [2, 3]
+    assert failures == [failure]
+
+
+def test_iter_completed_in_finishing_order():
+    """Tests results are yielded as they finish rather than in submission order"""
+    with Pool(processes=3) as pool:
+        completed = list(iter_completed(
+            [pool.apply_async(sleep_for, (seconds,)) for seconds in (0.4, 0.05, 0.2)]))
+    assert completed == [(1, 0.05), (2, 0.2), (0, 0.4)]
+
+
+def test_iter_completed_until_deadline():
+    """Tests results not ready at the deadline are yielded last as unfinished"""
+    set_deadline(0.5, margin_seconds=0)
+    with Pool(processes=3) as pool:
+        completed = list(iter_completed(
+            [pool.apply_async(sleep_for, (seconds,)) for seconds in (5, 0.05, 0.1)]))
+        pool.terminate()
+    assert completed == [(1, 0.05), (2, 0.1), (0, UNFINISHED)]
+
+
+def test_clean_task_readings(fake_product_data):
+    """Tests failed extractions and readings whose price rose are dropped"""
+    risen = {**fake_product_data, "current_price": 100, "previous_price": 50}
+    assert clean_task_readings([fake_product_data, None, risen]) == [fake_product_data]
+
+
+@patch("worker_pool.Pool")
+def test_stream_price_and_sales_data_yields_each_task(mock_Pool, fake_product_list):
+    """Tests a (readings, unfinished, failures) triple is yielded per finished task"""
+    mock_pool = mock_Pool.return_value
+    mock_pool.apply_async.return_value.get.return_value = [([fake_product_list[0]], [])] * 3
+    assert list(stream_price_and_sales_data(fake_product_list)) == [
+        ([fake_product_list[0]], [], [])] * len(fake_product_list)
+    assert mock_pool.terminate.call_count == 0
+
+
+@patch.dict("worker_pool.ENV", {"POOL_THREADS_PER_PROCESS": "2"})
+@patch("worker_pool.Pool")
+def test_stream_price_and_sales_data_keeps_finished_tasks(mock_Pool, fake_product_list):
+    """Tests the finished tasks of a chunk cut off by the deadline keep their readings, and
+    the pool is terminated"""
+    mock_pool = mock_Pool.return_value
+    mock_pool.apply_async.return_value.get.return_value = [([fake_product_list[0]], []), None]
+    assert list(stream_price_and_sales_data(fake_product_list[:2])) == [
+        ([fake_product_list[0]], [], []), ([], [fake_product_list[1]["product_id"]], [])]
+    assert mock_pool.terminate.call_count == 1
+
+
+@patch.dict("worker_pool.ENV", {"POOL_THREADS_PER_PROCESS": "1"})
+@patch("worker_pool.Pool")
+def test_stream_price_and_sales_data_stopped_early(mock_Pool, fake_product_list):
+    """Tests the pool is terminated when the consumer stops reading the stream"""
+    mock_pool = mock_Pool.return_value
+    mock_pool.apply_async.return_value.get.return_value = [([None], [])]
+    stream = stream_price_and_sales_data(fake_product_list)
+    assert next(stream) == ([], [], [])
+    stream.close()
+    assert mock_pool.terminate.call_count == 1
+    assert WORKER_POOL["pool"] is None
+
+
+@patch.dict("extract_main.ENV", {"EXTRACTION_MODE": "async"})
+def test_handler_reads_deadline_from_context(fake_product_list):
+    """Tests the deadline is taken from the Lambda context"""
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 60000
+    with patch.dict("extract_main.EXTRACTION_ENGINES",
+                    {"async": MagicMock(return_value=([], [7], []))}), \
+            patch("extract_main.set_deadline") as mock_set_deadline:
+        assert handler(fake_product_list, context)["unfinished"] == [7]
+    mock_set_deadline.assert_called_once_with(60.0)
+
+
+@patch("extract_main.process_task")
+def test_run_isolated_success(mock_process_task, fake_product_data):
+    """Tests the readings of a task are returned without failures"""
+    mock_process_task.return_value = [fake_product_data]
+    assert run_isolated(fake_product_data) == ([fake_product_data], [])
+
+
+@patch("extract_main.process_task")
+def test_run_isolated_stamps_elapsed_seconds(mock_process_task, fake_product_data):
+    """Tests each reading carries the time its task took"""
+    mock_process_task.return_value = [fake_product_data, None]
+    readings, _ = run_isolated(fake_product_data)
+    assert readings[0]["elapsed_seconds"] >= 0
+    assert readings[1] is None
+
+
+def test_get_task_outcome_records_costs(fake_product_data):
+    """Tests a batch's time is split between its products and removed from the readings"""
+    TASK_COSTS.clear()
+    batch = [{**fake_product_data, "product_id": 2}, {**fake_product_data, "product_id": 3}]
+    reading = {**batch[0], "current_price": 10, "previous_price": 20, "elapsed_seconds": 1.0}
+    failure = {"product_id": 3, "error": "NotFound", "elapsed_seconds": 1.0}
+    readings, _, _ = get_task_outcome(batch, ([reading], [failure]))
+    get_task_outcome({"product_id": 4}, UNFINISHED)
+    assert "elapsed_seconds" not in readings[0]
+    assert get_task_costs() == [{"product_id": 2, "seconds": 0.5},
+                                {"product_id": 3, "seconds": 0.5}]
+    TASK_COSTS.clear()
+
+
+@pytest.mark.parametrize("error", [KeyError("price"), TypeError("bad"), ValueError("json")])
+@patch("extract_main.process_task")
+def test_run_isolated_failure(mock_process_task, error, fake_product_data):
+    """Tests any exception becomes a failure record with its error class"""
+    mock_process_task.side_effect = error
+    readings, failures = run_isolated(fake_product_data)
+    assert readings == []
+    assert len(failures) == 1
+    assert failures[0]["product_id"] == 1
+    assert failures[0]["error"] == type(error).__name__
+    assert failures[0]["elapsed_seconds"] >= 0
+
+
+def test_run_isolated_failed_batch_falls_back_to_products(fake_product_data):
+    """Tests a failed batch is processed product by product, keeping the good readings"""
+    good = {**fake_product_data, "product_id": 2}
+    bad = {**fake_product_data, "product_id": 3}
+
+    def fake_process_task(task):
+        if isinstance(task, list) or task["product_id"] == 3:
+            raise KeyError("productPrice")
+        return [task]
+
+    with patch("extract_main.process_task", side_effect=fake_process_task):
+        readings, failures = run_isolated([good, bad])
+    assert readings == [good]
+    assert [failure["product_id"] for failure in failures] == [3]
+
+
+def test_summarise_failures():
+    """Tests failures are counted per error class"""
+    failures = [{"error": "KeyError"}, {"error": "TypeError"}, {"error": "KeyError"}]
+    assert summarise_failures(failures) == {"KeyError": 2, "TypeError": 1}
+
+
+@patch.dict("extract_main.ENV", {"EXTRACTION_MODE": "async"})
+def test_handler_returns_failures(fake_product_list):
+    """Tests failure records are returned alongside the readings"""
+    failure = {"product_id": 1, "error": "KeyError", "elapsed_seconds": 0.1}
+    with patch.dict("extract_main.EXTRACTION_ENGINES",
+                    {"async": MagicMock(return_value=([fake_product_list[1]], [], [failure]))}):
+        assert handler(fake_product_list) == {"readings": [fake_product_list[1]],
+                                              "unfinished": [], "failures": [failure],
+                                              "recovered": [], "costs": []}
+
+
+@patch.dict("extract_main.ENV", {"EXTRACTION_MODE": "async"})
+def test_handler_claim_check(fake_product_list, tmp_path):
+    """Tests a referenced product list is checked out and the output is checked in"""
+    location = f"file://{tmp_path}"
+    mock_extract = MagicMock(return_value=([fake_product_list[1]], [], []))
+    with patch.dict("extract_main.EXTRACTION_ENGINES", {"async": mock_extract}), \
+            patch.dict("extract_main.ENV", {"CLAIM_CHECK": location}):
+        reference = handler(check_in(fake_product_list, location))
+    assert mock_extract.call_args[0][0] == fake_product_list
+    assert check_out(reference) == {"readings": [fake_product_list[1]], "unfinished": [],
+                                    "failures": [], "recovered": [], "costs": []}
+
+
+@patch("extract_main.process_task")
+def test_run_isolated_records_missing_readings(mock_process_task, fake_product_data):
+    """Tests products without a reading get a record with the reason their extractor gave"""
+    def process_task_with_reason(_task):
+        record_failure_reason(NOT_FOUND)
+        return [None]
+    mock_process_task.side_effect = process_task_with_reason
+    readings, failures = run_isolated(fake_product_data)
+    assert readings == [None]
+    assert [(failure["product_id"], failure["error"]) for failure in failures] == [
+        (1, "NotFound")]
+
+
+@patch("extract_main.process_task", return_value=[None])
+def test_run_isolated_forgets_previous_reasons(_mock_process_task, fake_product_data):
+    """Tests a reason recorded by an earlier task is not reused"""
+    record_failure_reason(NOT_FOUND)
+    assert run_isolated(fake_product_data)[1][0]["error"] == "NoReading"
+
+
+def test_run_isolated_refused_at_deadline(fake_product_data):
+    """Tests a batch refused for the deadline is unfinished, not failed or retried alone"""
+    batch = [fake_product_data, {**fake_product_data, "product_id": 2}]
+    with patch("extract_main.process_task",
+               side_effect=DeadlineExceeded("no time left")) as mock_process_task:
+        result = run_isolated(batch)
+    assert mock_process_task.call_count == 1
+    assert get_task_outcome(batch, result) == ([], [1, 2], [])
+
+
+@patch("extract_main.process_task", return_value=[None])
+def test_run_isolated_no_reading_at_deadline(_mock_process_task, fake_product_data):
+    """Tests a product left without a reading once the run is out of time is unfinished"""
+    set_deadline(0, margin_seconds=0)
+    _, failures = run_isolated(fake_product_data)
+    assert failures[0]["error"] == UNFINISHED_REASON
+    assert get_task_outcome(fake_product_data, ([None], failures)) == ([], [1], [])
+
+
+@patch("extract_main.process_task")
+def test_run_isolated_reason_kept_at_deadline(mock_process_task, fake_product_data):
+    """Tests a reason the extractor recorded is kept even once the run is out of time"""
+    def process_task_with_reason(_task):
+        record_failure_reason(NOT_FOUND)
+        return [None]
+    mock_process_task.side_effect = process_task_with_reason
+    set_deadline(0, margin_seconds=0)
+    assert run_isolated(fake_product_data)[1][0]["error"] == NOT_FOUND
+
+
+def test_get_recovered_products(fake_product_list):
+    """Tests only previously failing products that gave a reading are recovered"""
+    for product_id, product in enumerate(fake_product_list, start=1):
+        product["product_id"] = product_id
+        product["failure_count"] = 2
+    fake_product_list[2]["failure_count"] = 0
+    failures = [{"product_id": 2, "error": "NotFound", "elapsed_seconds": 0.1}]
+    assert get_recovered_products(fake_product_list, [], failures) == [1]
+    assert get_recovered_products(fake_product_list, [1], failures) == []
+
+
+def test_get_chunks():
+    """Tests tasks are split into consecutive chunks"""
+    assert get_chunks([1, 2, 3, 4, 5], 2) == [[1, 2], [3, 4], [5]]
+    assert get_chunks([], 2) == []
+
+
+PATAGONIA_PRODUCT = {"product_id": 7, "product_code": 24197, "product_name": "Jacket",
+                     "url": "https://eu.patagonia.com/gb/en/product/jacket/24197.html",
+                     "website_name": "patagonia"}
+
+
+@patch("extract_main.run_isolated", return_value=(["reading"], []))
+def test_fetch_stage_runs_unstaged_tasks(mock_run_isolated, fake_product_data):
+    """Tests tasks of retailers without a parse stage are processed completely"""
+    assert fetch_stage(fake_product_data) == (False, (["reading"], []))
+    mock_run_isolated.assert_called_once_with(fake_product_data)
+
+
+@patch("extract_patagonia.fetch_page_html", return_value="<html></html>")
+def test_fetch_stage_fetches_staged_tasks(_mock_fetch_page_html):
+    """Tests the page of a staged task is returned for parsing"""
+    needs_parse, (page, fetch_seconds) = fetch_stage(dict(PATAGONIA_PRODUCT))
+    assert (needs_parse, page) == (True, "<html></html>")
+    assert fetch_seconds >= 0
+
+
+@pytest.mark.parametrize("error, outcome", [
+    (ValueError("failed"), ([None], [{"product_id": 7, "error": "NoReading"}])),
+    (KeyError("broken"), ([], [{"product_id": 7, "error": "KeyError"}]))])
+def test_fetch_stage_failure(error, outcome):
+    """Tests failed fetches are isolated like run_isolated"""
+    with patch("extract_patagonia.fetch_page_html", side_effect=error):
+        needs_parse, (readings, failures) = fetch_stage(dict(PATAGONIA_PRODUCT))
+    assert not needs_parse
+    assert readings == outcome[0]
+    assert [{key: failure[key] for key in ("product_id", "error")}
+            for failure in failures] == outcome[1]
+
+
+def test_parse_stage():
+    """Tests a fetched page is parsed into the task's readings"""
+    readings, failures = parse_stage(dict(PATAGONIA_PRODUCT), build_synthetic_page(5, 120))
+    assert readings[0]["current_price"] == 120
+    assert not failures
+
+
+def test_parse_stage_includes_fetch_seconds():
+    """Tests the time spent fetching the page counts towards the task's elapsed time"""
+    readings, _ = parse_stage(dict(PATAGONIA_PRODUCT), build_synthetic_page(5, 120), 2.5)
+    assert readings[0]["elapsed_seconds"] >= 2.5
+
+
+def test_parse_stage_failure():
+    """Tests a page that cannot be parsed gives no reading and records why"""
+    readings, failures = parse_stage(dict(PATAGONIA_PRODUCT), "<html></html>")
+    assert readings == [None]
+    assert [(failure["product_id"], failure["error"]) for failure in failures] == [
+        (7, "WrongPage")]
+
+
+@patch("extract_patagonia.fetch_page_html")
+def test_extract_price_and_sales_data_staged(mock_fetch_page_html, monkeypatch):
+    """Tests pages fetched on the I/O threads are parsed by the worker pool"""
+    monkeypatch.setenv("POOL_PROCESSES", "2")
+    mock_fetch_page_html.return_value = build_synthetic_page(5, 80)
+    products = [dict(PATAGONIA_PRODUCT, product_id=i,
+                     url=f"https://eu.patagonia.com/gb/en/product/item/{i}.html")
+                for i in range(1, 5)]
+    try:
+        readings, unfinished, failures = extract_price_and_sales_data_staged(products)
+    finally:
+        discard_worker_pool()
+    assert sorted(reading["product_id"] for reading in readings) == [1, 2, 3, 4]
+    assert {reading["current_price"] for reading in readings} == {80}
+    assert not unfinished and not failures
+
+
+def test_get_extraction_engine_staged():
+    """Tests the staged engine can be selected"""
+    assert get_extraction_engine("staged") is extract_price_and_sales_data_staged
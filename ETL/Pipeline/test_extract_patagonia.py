@@ -6,7 +6,25 @@ from bs4 import BeautifulSoup
 import pytest
 
 from extract_patagonia import (get_product_info, get_current_price,
-                               get_sale_status, process_product, is_correct_page)
+                               get_sale_status, process_product, is_correct_page,
+                               get_price_fragment, process_product_with_cache,
+                               get_price_and_sale_fast, parse_price_and_sale,
+                               PriceBlockScanner, get_canonical_url, get_colour_code,
+                               get_page_key, get_colour_prices, get_colour_price_and_sale,
+                               process_products, fetch_products_page, parse_products_page)
+from response_cache import FileCacheBackend
+from pipeline_helpers import clear_failure_reasons, get_failure_reason
+
+
+FAKE_PAGE = """
+<html><body><div class="product-detail">
+<span class="js-buy-config-price">
+    <span class="sales"><span class="value" content="100"></span></span>
+    <span class="discount-percentage">10%</span>
+</span>
+<span class="other">Other</span>
+</div></body></html>
+"""
 
 
 def test_get_product_info_valid():
@@ -188,11 +206,11 @@ def test_is_correct_page_nested_product_detail():
     assert result is True
 
 
-@patch("extract_patagonia.get_soup")
+@patch("extract_patagonia.get_product_page")
 @patch("extract_patagonia.is_correct_page")
-def test_process_product_invalid_page(mock_is_correct_page, mock_get_soup):
+def test_process_product_invalid_page(mock_is_correct_page, mock_get_product_page):
     """Tests the process product works with invalid page"""
-    mock_get_soup.return_value = MagicMock()
+    mock_get_product_page.return_value = "<div>Not a product</div>"
     mock_is_correct_page.return_value = False
 
     product = {
@@ -200,17 +218,29 @@ def test_process_product_invalid_page(mock_is_correct_page, mock_get_soup):
         "product_code": "12345"
     }
 
+    clear_failure_reasons()
     with pytest.raises(ValueError):
         process_product(product)
+    assert get_failure_reason(1) == "WrongPage"
 
 
-@patch("extract_patagonia.get_soup")
+@patch("extract_patagonia.get_response_cache", return_value=None)
+@patch("extract_patagonia.get_product_page")
+def test_process_product_missing_price(mock_get_product_page, _mock_cache):
+    """Tests a product page without a price is recorded as missing its price"""
+    mock_get_product_page.return_value = '<div class="product-detail"></div>'
+    clear_failure_reasons()
+    assert process_product({"url": PAGE_URL, "product_code": 24197}) is None
+    assert get_failure_reason(1) == "MissingPrice"
+
+
+@patch("extract_patagonia.get_product_page")
 @patch("extract_patagonia.is_correct_page")
 @patch("extract_patagonia.get_product_info")
 def test_process_product_no_product_info(mock_get_product_info, mock_is_correct_page,
-                                         mock_get_soup):
+                                         mock_get_product_page):
     """Tests the process product with no product infor"""
-    mock_get_soup.return_value = MagicMock()
+    mock_get_product_page.return_value = "<div>Not a product</div>"
     mock_is_correct_page.return_value = True
     mock_get_product_info.return_value = None
 
@@ -220,3 +250,327 @@ def test_process_product_no_product_info(mock_get_product_info, mock_is_correct_
     }
     result = process_product(product)
     assert result is None
+
+
+def test_get_price_fragment_nested_spans():
+    """Tests the whole price span is returned including nested spans"""
+    fragment = get_price_fragment(FAKE_PAGE)
+    assert fragment.startswith('<span class="js-buy-config-price">')
+    assert fragment.endswith("</span>")
+    assert 'content="100"' in fragment
+    assert "Other" not in fragment
+
+
+def test_get_price_fragment_missing():
+    """Tests None is returned when there is no price span"""
+    assert get_price_fragment("<div>No product info here</div>") is None
+
+
+def test_get_price_fragment_unclosed():
+    """Tests None is returned when the price span is cut off"""
+    assert get_price_fragment('<span class="buy-config-price"><span>') is None
+
+
+def test_get_price_fragment_invalid_type():
+    """Tests a TypeError is raised when the html is not a string"""
+    with pytest.raises(TypeError):
+        get_price_fragment(None)
+
+
+@patch("extract_patagonia.get_product_response")
+def test_process_product_with_cache_parses_new_page(mock_get_product_response, tmp_path):
+    """Tests a page is parsed and cached on a cache miss"""
+    mock_get_product_response.return_value = MagicMock(
+        status_code=200, text=FAKE_PAGE, headers={"ETag": "\"abc\""})
+    cache = FileCacheBackend(str(tmp_path / "cache.json"))
+    product = {"url": "https://www.example.com/product-page", "product_code": 12345}
+    result = process_product_with_cache(product, cache)
+    assert result["current_price"] == 100
+    assert result["is_on_sale"] is True
+    assert cache.get(product["url"])["etag"] == "\"abc\""
+
+
+@patch("extract_patagonia.BeautifulSoup")
+@patch("extract_patagonia.get_product_response")
+def test_process_product_with_cache_not_modified(mock_get_product_response, mock_soup,
+                                                 tmp_path):
+    """Tests a 304 response reuses the cached price without parsing and is closed"""
+    mock_get_product_response.return_value = MagicMock(status_code=304, text="")
+    cache = FileCacheBackend(str(tmp_path / "cache.json"))
+    product = {"url": "https://www.example.com/product-page", "product_code": 12345}
+    cache.set(product["url"], {"etag": "\"abc\"", "last_modified": None,
+                               "fragment_hash": None, "current_price": 90,
+                               "is_on_sale": True})
+    result = process_product_with_cache(product, cache)
+    assert result["current_price"] == 90
+    assert mock_soup.call_count == 0
+    assert mock_get_product_response.call_args[1]["headers"]["If-None-Match"] == "\"abc\""
+    mock_get_product_response.return_value.close.assert_called_once()
+
+
+@patch("extract_patagonia.get_product_response")
+def test_process_product_with_cache_unchanged_fragment(mock_get_product_response, tmp_path):
+    """Tests an unchanged price fragment reuses the cached price without parsing"""
+    mock_get_product_response.return_value = MagicMock(
+        status_code=200, text=FAKE_PAGE, headers={})
+    cache = FileCacheBackend(str(tmp_path / "cache.json"))
+    product = {"url": "https://www.example.com/product-page", "product_code": 12345}
+    process_product_with_cache(dict(product), cache)
+    with patch("extract_patagonia.BeautifulSoup") as mock_soup:
+        result = process_product_with_cache(dict(product), cache)
+    assert mock_soup.call_count == 0
+    assert result["current_price"] == 100
+
+
+@patch("extract_patagonia.get_product_response")
+def test_process_product_with_cache_no_response(mock_get_product_response, tmp_path):
+    """Tests a ValueError is raised when the page cannot be fetched"""
+    mock_get_product_response.return_value = None
+    cache = FileCacheBackend(str(tmp_path / "cache.json"))
+    with pytest.raises(ValueError):
+        process_product_with_cache({"url": "https://www.example.com"}, cache)
+
+
+@patch("extract_patagonia.process_product_with_cache")
+@patch("extract_patagonia.get_response_cache")
+def test_process_product_uses_cache(mock_get_response_cache, mock_process_with_cache):
+    """Tests process_product uses the cache when one is configured"""
+    mock_get_response_cache.return_value = MagicMock()
+    process_product({"url": "https://www.example.com", "product_code": 12345})
+    assert mock_process_with_cache.call_count == 1
+
+
+def test_get_price_and_sale_fast_valid():
+    """Tests the fast path reads the price and sale status"""
+    assert get_price_and_sale_fast(FAKE_PAGE) == (100, True)
+
+
+def test_get_price_and_sale_fast_not_product_page():
+    """Tests the fast path gives up without the product-detail marker"""
+    assert get_price_and_sale_fast(
+        FAKE_PAGE.replace("product-detail", "product-details")) is None
+
+
+def test_get_price_and_sale_fast_invalid_price():
+    """Tests the fast path gives up on an invalid price"""
+    assert get_price_and_sale_fast(FAKE_PAGE.replace('content="100"', 'content="x"')) is None
+
+
+@patch("extract_patagonia.get_price_and_sale")
+def test_parse_price_and_sale_skips_full_parse(mock_get_price_and_sale):
+    """Tests the full parse is skipped when the fast path succeeds"""
+    assert parse_price_and_sale(FAKE_PAGE) == (100, True)
+    assert mock_get_price_and_sale.call_count == 0
+
+
+def test_parse_price_and_sale_falls_back():
+    """Tests the full parse is used when the fast path fails"""
+    page = FAKE_PAGE.replace("<div class=\"product-detail\">",
+                             "<div data-x='1' class=\"product-detail\">")
+    with patch("extract_patagonia.get_price_and_sale_fast", return_value=None):
+        assert parse_price_and_sale(page) == (100, True)
+
+
+def test_parse_price_and_sale_invalid_page():
+    """Tests a non product page still raises a ValueError"""
+    with pytest.raises(ValueError):
+        parse_price_and_sale("<div>Not a product</div>")
+
+
+def test_price_block_scanner_completes_mid_page():
+    """Tests the scanner reports completion once the price span closes"""
+    scanner = PriceBlockScanner()
+    split = FAKE_PAGE.index("</span>\n<span class=\"other\">")
+    assert not scanner.feed(FAKE_PAGE[:split])
+    assert scanner.feed(FAKE_PAGE[split:split + 20])
+    assert 'content="100"' in scanner.fragment
+
+
+def test_price_block_scanner_small_chunks():
+    """Tests markers split across many small chunks are still found"""
+    scanner = PriceBlockScanner()
+    results = [scanner.feed(FAKE_PAGE[i:i + 7]) for i in range(0, len(FAKE_PAGE), 7)]
+    assert any(results)
+    assert scanner.fragment == get_price_fragment(FAKE_PAGE)
+
+
+def test_price_block_scanner_keeps_only_price_block():
+    """Tests the scanner keeps a bounded window rather than the whole page"""
+    scanner = PriceBlockScanner()
+    padding = "<p>filler</p>" * 10000
+    for i in range(0, len(padding), 16384):
+        assert not scanner.feed(padding[i:i + 16384])
+    assert len(scanner.tail) <= 1024
+    assert scanner.price_text is None
+
+
+def test_price_block_scanner_not_product_page():
+    """Tests the scanner never completes without the product-detail marker"""
+    scanner = PriceBlockScanner()
+    assert not scanner.feed(FAKE_PAGE.replace("product-detail", "listing"))
+
+
+@patch.dict("extract_patagonia.ENV", {"STREAM_PAGES": "true"})
+@patch("extract_patagonia.get_response_cache", return_value=None)
+@patch("extract_patagonia.get_product_page_streamed")
+def test_process_product_streamed(mock_get_product_page_streamed, _mock_cache):
+    """Tests process_product streams the page when STREAM_PAGES is set"""
+    mock_get_product_page_streamed.return_value = FAKE_PAGE
+    result = process_product({"url": "https://www.example.com", "product_code": 12345})
+    assert result["current_price"] == 100
+    assert isinstance(mock_get_product_page_streamed.call_args[0][2], PriceBlockScanner)
+
+
+PAGE_URL = "https://eu.patagonia.com/gb/en/product/womens-airshed-pro-wind-pullover/24197.html"
+SWATCHES = ('<button class="swatch" data-attr-value="COHC" data-price="95"></button>'
+            '<button class="swatch" data-price="120" data-attr-value="BLK"></button>'
+            '<button class="swatch" data-attr-value="TIDB"></button>')
+
+
+@pytest.mark.parametrize("url, canonical_url", [
+    (f"{PAGE_URL}?dwvar_24197_color=COHC&cgid=sport-trail-running-womens", PAGE_URL),
+    (f"{PAGE_URL}?cgid=x&dwvar_24197_color=BLK#reviews", PAGE_URL),
+    ("https://EU.patagonia.com/gb/en/product/a.html?b=2&a=1",
+     "https://eu.patagonia.com/gb/en/product/a.html?a=1&b=2"),
+    (PAGE_URL, PAGE_URL)])
+def test_get_canonical_url(url, canonical_url):
+    """Tests colourway and category parameters are removed"""
+    assert get_canonical_url(url) == canonical_url
+
+
+def test_get_canonical_url_invalid_type():
+    """Tests a TypeError is raised for a non-string URL"""
+    with pytest.raises(TypeError):
+        get_canonical_url(None)
+
+
+def test_get_colour_code():
+    """Tests the colourway is read from the URL"""
+    assert get_colour_code(f"{PAGE_URL}?dwvar_24197_color=COHC&cgid=x") == "COHC"
+    assert get_colour_code(PAGE_URL) is None
+
+
+def test_get_page_key():
+    """Tests products without a URL have no page key"""
+    assert get_page_key({"url": f"{PAGE_URL}?dwvar_24197_color=COHC"}) == PAGE_URL
+    assert get_page_key({"url": None}) is None
+    assert get_page_key(None) is None
+
+
+def test_get_colour_prices():
+    """Tests every swatch with a price is returned"""
+    assert get_colour_prices(SWATCHES) == {"COHC": 95.0, "BLK": 120.0}
+
+
+def test_get_colour_prices_keeps_pence():
+    """Tests swatch prices are not truncated to whole pounds"""
+    assert get_colour_prices('<a data-attr-value="COHC" data-price="119.99"></a>') == {
+        "COHC": 119.99}
+
+
+@pytest.mark.parametrize("colour, price_and_sale", [
+    ("BLK", (120, False)), ("TIDB", (120, False)), ("COHC", None), ("NAVY", None),
+    ("FGE", None), (None, None)])
+def test_get_colour_price_and_sale(colour, price_and_sale):
+    """Tests the page's reading is shared only with colourways it can price"""
+    assert get_colour_price_and_sale((120, False), {"COHC": 95.0, "TIDB": 120.0, "FGE": 120.5},
+                                     "BLK", colour) == price_and_sale
+
+
+def test_get_colour_price_and_sale_no_page_price():
+    """Tests nothing is returned when the page could not be parsed"""
+    assert get_colour_price_and_sale(None, {"COHC": 95.0}, "BLK", "BLK") is None
+
+
+def get_colour_page(price: int, on_sale: bool) -> str:
+    """Returns a product page with the given price followed by the colour swatches"""
+    discount = '<span class="discount-percentage">20%</span>' if on_sale else ""
+    return ('<div class="product-detail"><span class="js-buy-config-price"><span class="sales">'
+            f'<span class="value" content="{price}"></span></span>{discount}</span></div>'
+            + SWATCHES + '<button class="swatch" data-attr-value="NAVY" data-price="120">'
+            '</button>')
+
+
+COLOUR_PAGES = {f"{PAGE_URL}?dwvar_24197_color=BLK": get_colour_page(120, False),
+                f"{PAGE_URL}?dwvar_24197_color=COHC": get_colour_page(95, True),
+                f"{PAGE_URL}?dwvar_24197_color=TIDB": get_colour_page(110, False)}
+
+
+@patch("extract_patagonia.get_response_cache", return_value=None)
+@patch("extract_patagonia.get_product_page")
+def test_process_products_fetches_each_page_once(mock_get_product_page, _mock_cache):
+    """Tests the first colourway's own page is fetched and shared with the colourways it can
+    price, and the others are fetched on their own"""
+    mock_get_product_page.side_effect = lambda url, **_: COLOUR_PAGES.get(url)
+    products = [{"product_code": 24197, "url": f"{PAGE_URL}?dwvar_24197_color={colour}"}
+                for colour in ("BLK", "NAVY", "COHC", "TIDB")]
+    results = process_products(products)
+    assert [call[0][0] for call in mock_get_product_page.call_args_list] == [
+        products[0]["url"], products[2]["url"], products[3]["url"]]
+    assert [(r["current_price"], r["is_on_sale"]) for r in results] == [
+        (120, False), (120, False), (95, True), (110, False)]
+
+
+@patch("extract_patagonia.get_response_cache", return_value=None)
+@patch("extract_patagonia.get_product_page")
+def test_process_products_failed_first_page(mock_get_product_page, _mock_cache):
+    """Tests the next colourway's page is fetched when the first one fails"""
+    mock_get_product_page.side_effect = lambda url, **_: COLOUR_PAGES.get(url)
+    products = [{"product_code": 24197, "url": f"{PAGE_URL}?dwvar_24197_color={colour}"}
+                for colour in ("GONE", "BLK", "NAVY")]
+    results = process_products(products)
+    assert mock_get_product_page.call_count == 2
+    assert results[0] is None
+    assert [r["current_price"] for r in results[1:]] == [120, 120]
+
+
+@patch("extract_patagonia.get_response_cache", return_value=None)
+@patch("extract_patagonia.get_product_page", return_value=None)
+def test_process_products_failed_page(mock_get_product_page, _mock_cache):
+    """Tests every product is None when none of the pages could be fetched"""
+    products = [{"product_code": 24197, "url": f"{PAGE_URL}?dwvar_24197_color={colour}"}
+                for colour in ("COHC", "BLK")]
+    assert process_products(products) == [None, None]
+    assert mock_get_product_page.call_count == 2
+
+
+@patch("extract_patagonia.get_product_page")
+def test_fetch_products_page(mock_get_product_page):
+    """Tests the staged fetch requests the first colourway's page"""
+    mock_get_product_page.return_value = FAKE_PAGE
+    products = [{"url": f"{PAGE_URL}?dwvar_24197_color={colour}"} for colour in ("COHC", "BLK")]
+    assert fetch_products_page(products) == FAKE_PAGE
+    assert mock_get_product_page.call_args[0][0] == products[0]["url"]
+
+
+@patch("extract_patagonia.get_product_page", return_value=None)
+def test_fetch_products_page_failed(_mock_get_product_page):
+    """Tests a failed fetch raises a ValueError"""
+    with pytest.raises(ValueError):
+        fetch_products_page([{"url": PAGE_URL}])
+
+
+@patch("extract_patagonia.get_response_cache", return_value=None)
+@patch("extract_patagonia.get_product_page")
+def test_parse_products_page(mock_get_product_page, _mock_cache):
+    """Tests colourways are populated from a fetched page, and the ones it cannot price are
+    fetched on their own"""
+    mock_get_product_page.side_effect = lambda url, **_: COLOUR_PAGES.get(url)
+    products = [{"product_code": 24197, "url": f"{PAGE_URL}?dwvar_24197_color={colour}"}
+                for colour in ("BLK", "NAVY", "COHC")]
+    assert parse_products_page(products, COLOUR_PAGES[products[0]["url"]]) == products
+    assert [(p["current_price"], p["is_on_sale"]) for p in products] == [
+        (120, False), (120, False), (95, True)]
+    assert [call[0][0] for call in mock_get_product_page.call_args_list] == [products[2]["url"]]
+
+
+@patch("extract_patagonia.get_response_cache", return_value=None)
+@patch("extract_patagonia.get_product_page")
+def test_parse_products_page_wrong_page(mock_get_product_page, _mock_cache):
+    """Tests the other colourways are fetched on their own when the fetched page is invalid"""
+    mock_get_product_page.side_effect = lambda url, **_: COLOUR_PAGES.get(url)
+    products = [{"product_code": 24197, "url": f"{PAGE_URL}?dwvar_24197_color={colour}"}
+                for colour in ("GONE", "BLK")]
+    results = parse_products_page(products, "<html></html>")
+    assert results[0] is None
+    assert results[1]["current_price"] == 120
@@ -0,0 +1,219 @@
+"""This file tests whether the fetch_policy file works as expected"""
+
+from time import sleep, perf_counter
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from deadline import DeadlineExceeded, set_deadline
+from fetch_policy import (CircuitBreaker, CircuitOpenError, LatencyTracker, get_backoff,
+                          call_with_hedge, call_with_policy, get_host_policy,
+                          configure_hedge_workers, get_hedge_executor)
+
+
+def test_circuit_breaker_opens_after_threshold():
+    """Tests the breaker opens after consecutive failures"""
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=60)
+    for _ in range(3):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert not breaker.allow_request()
+
+
+def test_circuit_breaker_success_resets():
+    """Tests a success resets the failure count"""
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow_request()
+
+
+def test_circuit_breaker_half_open_trial():
+    """Tests a single trial request is let through after the reset time"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.allow_request()
+
+
+def test_latency_tracker_needs_samples():
+    """Tests no percentile is given until there are enough samples"""
+    tracker = LatencyTracker()
+    tracker.record(1.0)
+    assert tracker.percentile(0.95) is None
+
+
+def test_latency_tracker_percentile():
+    """Tests the percentile of the recorded latencies"""
+    tracker = LatencyTracker()
+    for i in range(100):
+        tracker.record(i / 100)
+    assert tracker.percentile(0.95) == 0.95
+
+
+@pytest.mark.parametrize("attempt", [0, 1, 2, 10])
+def test_get_backoff_bounds(attempt):
+    """Tests the backoff is jittered between zero and the cap"""
+    assert 0 <= get_backoff(attempt) <= 4
+
+
+def test_call_with_hedge_without_threshold():
+    """Tests no hedge is sent without a latency threshold"""
+    send = MagicMock(return_value="response")
+    assert call_with_hedge(send, None) == "response"
+    assert send.call_count == 1
+
+
+def test_call_with_hedge_sends_second_request():
+    """Tests a slow request is hedged and the faster response wins"""
+    calls = []
+
+    def send():
+        calls.append(1)
+        if len(calls) == 1:
+            sleep(1)
+            return "slow"
+        return "fast"
+
+    start = perf_counter()
+    assert call_with_hedge(send, 0.05) == "fast"
+    assert perf_counter() - start < 0.5
+
+
+def test_call_with_hedge_raises_when_all_fail():
+    """Tests the error is raised when every request fails"""
+    send = MagicMock(side_effect=requests.exceptions.ConnectionError)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        call_with_hedge(send, 0.01)
+
+
+def test_call_with_hedge_closes_losing_response():
+    """Tests the response that loses the race is closed, releasing its connection"""
+    slow, fast = MagicMock(spec=requests.Response), MagicMock(spec=requests.Response)
+    calls = []
+
+    def send():
+        calls.append(1)
+        if len(calls) == 1:
+            sleep(0.2)
+            return slow
+        return fast
+
+    assert call_with_hedge(send, 0.05) is fast
+    sleep(0.4)
+    slow.close.assert_called_once()
+    fast.close.assert_not_called()
+
+
+def test_call_with_policy_hedge_clock_starts_after_limiter():
+    """Tests time spent waiting for the rate limiter does not trigger a hedge"""
+    _, tracker = get_host_policy("limited.example.com")
+    for _ in range(20):
+        tracker.record(0.1)
+    acquire = MagicMock(side_effect=lambda: sleep(0.3))
+    send = MagicMock(side_effect=lambda: sleep(0.02) or "response")
+    assert call_with_policy(send, "limited.example.com", acquire=acquire) == "response"
+    assert send.call_count == 1
+    assert acquire.call_count == 1
+
+
+def test_call_with_policy_hedge_acquires():
+    """Tests a hedged request waits for the rate limiter like the first attempt"""
+    _, tracker = get_host_policy("hedged.example.com")
+    for _ in range(20):
+        tracker.record(0.01)
+    calls = []
+
+    def send():
+        calls.append(1)
+        if len(calls) == 1:
+            sleep(0.3)
+            return "slow"
+        return "fast"
+
+    acquire = MagicMock()
+    assert call_with_policy(send, "hedged.example.com", acquire=acquire) == "fast"
+    assert acquire.call_count == 2
+
+
+def test_configure_hedge_workers():
+    """Tests the hedge pool gets two threads per request in flight"""
+    with patch.dict("fetch_policy.HEDGE_EXECUTOR", {"executor": None}):
+        configure_hedge_workers(100)
+        assert get_hedge_executor()._max_workers == 200  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize("concurrency", [0, -1, "8", None])
+def test_configure_hedge_workers_invalid(concurrency):
+    """Tests an error is raised for a concurrency that is not a positive integer"""
+    with pytest.raises(ValueError):
+        configure_hedge_workers(concurrency)
+
+
+def test_call_with_policy_retries():
+    """Tests timeouts are retried"""
+    send = MagicMock(side_effect=[requests.exceptions.Timeout, "response"])
+    assert call_with_policy(send, "retry.example.com") == "response"
+    assert send.call_count == 2
+
+
+def test_call_with_policy_gives_up():
+    """Tests the last error is raised once retries run out"""
+    send = MagicMock(side_effect=requests.exceptions.ConnectionError)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        call_with_policy(send, "down.example.com", max_retries=2)
+    assert send.call_count == 3
+
+
+def test_call_with_policy_does_not_retry_other_errors():
+    """Tests errors other than timeouts and connection errors are not retried"""
+    send = MagicMock(side_effect=requests.exceptions.HTTPError)
+    with pytest.raises(requests.exceptions.HTTPError):
+        call_with_policy(send, "error.example.com")
+    assert send.call_count == 1
+
+
+def test_call_with_policy_fails_fast_when_open():
+    """Tests no request is sent while the host's breaker is open"""
+    breaker, _ = get_host_policy("open.example.com")
+    for _ in range(5):
+        breaker.record_failure()
+    send = MagicMock()
+    with pytest.raises(CircuitOpenError):
+        call_with_policy(send, "open.example.com")
+    assert send.call_count == 0
+
+
+def test_call_with_policy_deadline_not_retried():
+    """Tests a request refused for the deadline is not retried or counted as a failure"""
+    send = MagicMock(side_effect=DeadlineExceeded("no time left"))
+    with pytest.raises(DeadlineExceeded):
+        call_with_policy(send, "deadline.example.com")
+    assert send.call_count == 1
+    assert get_host_policy("deadline.example.com")[0].failures == 0
+
+
+def test_call_with_policy_trial_hits_deadline():
+    """Tests a half-open trial refused for the deadline lets the next request through"""
+    breaker, _ = get_host_policy("trial.example.com")
+    breaker.reset_seconds = 0
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    send = MagicMock(side_effect=DeadlineExceeded("no time left"))
+    with pytest.raises(DeadlineExceeded):
+        call_with_policy(send, "trial.example.com")
+    assert breaker.allow_request()
+
+
+def test_call_with_policy_no_retry_past_deadline(monkeypatch):
+    """Tests a failed request is not retried if the backoff would run past the deadline"""
+    monkeypatch.setattr("fetch_policy.get_backoff", lambda attempt: 5)
+    set_deadline(1, margin_seconds=0)
+    send = MagicMock(side_effect=requests.exceptions.ConnectionError())
+    with pytest.raises(requests.exceptions.ConnectionError):
+        call_with_policy(send, "late.example.com")
+    assert send.call_count == 1
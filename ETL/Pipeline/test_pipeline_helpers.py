@@ -1,12 +1,18 @@
 """This file tests whether the helpers file works as expected"""
 
-from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from unittest.mock import patch, MagicMock
 
 import pytest
 import requests
 
 from pipeline_helpers import (has_required_keys, has_correct_types,
-                              validate_input, get_soup, get_product_page)
+                              validate_input, get_soup, get_product_page,
+                              get_session, configure_session_pool, get_connection_stats,
+                              fetch, ThrottledError, get_timeout, read_body,
+                              get_stream_stats, record_failure_reason, get_failure_reason,
+                              clear_failure_reasons)
 
 
 def test_has_required_keys_all_keys_present(required_keys, fake_product_data):
@@ -87,7 +93,7 @@ def test_get_soup_invalid_headers(headers, fake_url):
         get_soup(fake_url, headers=headers)
 
 
-@patch("pipeline_helpers.requests.get")
+@patch("requests.Session.get")
 def test_get_product_page_success(mock_get, fake_headers, fake_url):
     """Tests the get_product_page function passes with a valid URL"""
     mock_response = "<html><body><h1>Mock Product Page</h1></body></html>"
@@ -97,7 +103,7 @@ def test_get_product_page_success(mock_get, fake_headers, fake_url):
     assert mock_get.call_count == 1
 
 
-@patch("pipeline_helpers.requests.get")
+@patch("requests.Session.get")
 def test_get_product_page_timeout_exception(mock_get, fake_headers, fake_url):
     """Tests the get_product_page function raises a Timeout error"""
     mock_get.side_effect = requests.exceptions.Timeout
@@ -105,7 +111,7 @@ def test_get_product_page_timeout_exception(mock_get, fake_headers, fake_url):
     assert product_page is None
 
 
-@patch("pipeline_helpers.requests.get")
+@patch("requests.Session.get")
 def test_get_product_page_request_exception(mock_get, fake_headers, fake_url):
     """Tests the get_product_page function raises a RequestsException error"""
     mock_get.side_effect = requests.exceptions.RequestException
@@ -113,6 +119,28 @@ def test_get_product_page_request_exception(mock_get, fake_headers, fake_url):
     assert not product_page
 
 
+@patch("requests.Session.get")
+def test_get_product_page_not_found(mock_get, fake_headers, fake_url):
+    """Tests a 404 is recorded as the reason the task gave no reading"""
+    clear_failure_reasons()
+    mock_get.return_value.status_code = 404
+    get_product_page(fake_url, fake_headers)
+    assert get_failure_reason(1) == "NotFound"
+
+
+def test_record_failure_reason_keeps_first():
+    """Tests the first reason is kept and product reasons override the task's"""
+    clear_failure_reasons()
+    assert get_failure_reason(1) == "NoReading"
+    record_failure_reason("NotFound")
+    record_failure_reason("WrongPage")
+    record_failure_reason("MissingPrice", 2)
+    assert get_failure_reason(1) == "NotFound"
+    assert get_failure_reason(2) == "MissingPrice"
+    clear_failure_reasons()
+    assert get_failure_reason(2) == "NoReading"
+
+
 @pytest.mark.parametrize("headers", ["invalid", None, 12.34, [1, 2, 3], 1, (), ["h", "b", "c"]])
 def test_get_product_page_invalid_headers_type(fake_url, headers):
     """Tests get_product_page with invalid headers data type"""
@@ -131,3 +159,176 @@ def test_get_product_page_empty_url(fake_headers):
     """Tests the get_product_page function returns none on an empty url"""
     product_page = get_product_page("", fake_headers)
     assert not product_page
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Minimal keep-alive handler used to test connection reuse."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Responds with a small page."""
+        body = b"<html></html>"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Silences request logging."""
+
+
+@pytest.fixture(name="local_url")
+def fixture_local_url():
+    """Starts a local keep-alive HTTP server for the duration of a test."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/product"
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_session_reused_per_host():
+    """Tests the same session is returned for the same host"""
+    assert get_session("https://www.asos.com/a") is get_session("https://www.asos.com/b")
+
+
+def test_get_session_separate_hosts():
+    """Tests different hosts get different sessions"""
+    assert get_session("https://www.asos.com/a") is not get_session(
+        "https://eu.patagonia.com/a")
+
+
+@patch("pipeline_helpers.os.getpid")
+def test_get_session_new_process(mock_getpid):
+    """Tests a forked worker process does not reuse its parent's session"""
+    mock_getpid.return_value = 1
+    parent_session = get_session("https://www.asos.com/a")
+    mock_getpid.return_value = 2
+    assert get_session("https://www.asos.com/a") is not parent_session
+
+
+def test_configure_session_pool_resets_sessions():
+    """Tests changing the pool size creates new sessions"""
+    configure_session_pool(3)
+    session = get_session("https://www.asos.com/a")
+    configure_session_pool(4)
+    assert get_session("https://www.asos.com/a") is not session
+
+
+@pytest.mark.parametrize("pool_size", [0, -1])
+def test_configure_session_pool_value_error(pool_size):
+    """Tests non positive pool sizes raise a ValueError"""
+    with pytest.raises(ValueError):
+        configure_session_pool(pool_size)
+
+
+@pytest.mark.parametrize("pool_size", ["1", 1.5, None, True])
+def test_configure_session_pool_type_error(pool_size):
+    """Tests non integer pool sizes raise a TypeError"""
+    with pytest.raises(TypeError):
+        configure_session_pool(pool_size)
+
+
+def test_get_product_page_reuses_connection(local_url, fake_headers):
+    """Tests repeated requests to one host only open a single connection"""
+    before = get_connection_stats()
+    for _ in range(3):
+        assert get_product_page(local_url, fake_headers) == "<html></html>"
+    after = get_connection_stats()
+    assert after["connections"] - before["connections"] == 1
+    assert after["connect_seconds"] >= before["connect_seconds"]
+
+
+@patch("pipeline_helpers.get_rate_limiter")
+@patch("requests.Session.get")
+def test_fetch_throttled(mock_get, mock_get_rate_limiter, fake_headers, fake_url):
+    """Tests a 429 raises a ThrottledError and slows the limiter down"""
+    mock_get.return_value = MagicMock(status_code=429, headers={"Retry-After": "5"})
+    with pytest.raises(ThrottledError):
+        fetch(fake_url, fake_headers, "asos")
+    mock_get_rate_limiter.return_value.on_throttle.assert_called_once_with(5)
+    mock_get.return_value.close.assert_called_once()
+
+
+@patch("pipeline_helpers.get_rate_limiter")
+@patch("requests.Session.get")
+def test_fetch_success(mock_get, mock_get_rate_limiter, fake_headers, fake_url):
+    """Tests a successful response waits for and speeds up the limiter"""
+    mock_get.return_value = MagicMock(status_code=200)
+    assert fetch(fake_url, fake_headers, "asos") == mock_get.return_value
+    assert mock_get_rate_limiter.return_value.acquire.call_count == 1
+    assert mock_get_rate_limiter.return_value.on_success.call_count == 1
+
+
+@patch("requests.Session.get")
+def test_get_product_page_throttled(mock_get, fake_headers, fake_url):
+    """Tests get_product_page returns None when throttled"""
+    mock_get.return_value = MagicMock(status_code=503, headers={})
+    assert get_product_page(fake_url, fake_headers, "patagonia") is None
+
+
+@pytest.mark.parametrize("timeout, expected", [(30, (5, 30)), (2, (2, 2)), ((1, 9), (1, 9))])
+def test_get_timeout(timeout, expected):
+    """Tests separate connect and read timeouts are used"""
+    assert get_timeout(timeout) == expected
+
+
+@patch("requests.Session.get")
+def test_get_product_page_retries_timeout(mock_get, fake_headers, fake_url):
+    """Tests a timed out request is retried before giving up"""
+    mock_get.side_effect = [requests.exceptions.Timeout, MagicMock(status_code=200, text="ok")]
+    assert get_product_page(fake_url, fake_headers) == "ok"
+    assert mock_get.call_count == 2
+
+
+class StopAfter:
+    """Scanner which reports completion once it has seen a marker."""
+
+    def __init__(self, marker):
+        self.marker = marker
+        self.text = ""
+
+    def feed(self, text):
+        """Adds text and returns True once the marker has been seen."""
+        self.text += text
+        return self.marker in self.text
+
+
+def make_streamed_response(chunks):
+    """Returns a mock streamed response yielding the given byte chunks."""
+    response = MagicMock(encoding="utf-8", url="https://example.com")
+    response.iter_content.return_value = iter(chunks)
+    response.raw.tell.return_value = 10
+    response.elapsed.total_seconds.return_value = 0.1
+    return response
+
+
+def test_read_body_stops_early():
+    """Tests the body stops being read once the scanner is satisfied"""
+    response = make_streamed_response([b"<div>", b"price</div>", b"rest"])
+    before = get_stream_stats()
+    assert read_body(response, StopAfter("price")) == "<div>price</div>"
+    assert response.close.call_count == 1
+    after = get_stream_stats()
+    assert after["closed_early"] - before["closed_early"] == 1
+    assert after["bytes_transferred"] - before["bytes_transferred"] == 10
+
+
+def test_read_body_reads_everything_without_scanner():
+    """Tests the whole body is read without a scanner"""
+    response = make_streamed_response([b"<div>", b"price</div>", b"rest"])
+    assert read_body(response) == "<div>price</div>rest"
+
+
+def test_read_body_multibyte_split():
+    """Tests characters split across chunks are decoded correctly"""
+    encoded = "£100".encode()
+    response = make_streamed_response([encoded[:1], encoded[1:]])
+    assert read_body(response) == "£100"
+
+
+def test_read_body_too_large():
+    """Tests None is returned once the body is over the maximum size"""
+    response = make_streamed_response([b"a" * 10, b"b" * 10])
+    assert read_body(response, max_bytes=15) is None
+    assert response.close.call_count == 1
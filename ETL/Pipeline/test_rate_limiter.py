@@ -0,0 +1,125 @@
+"""This file tests whether the rate_limiter file works as expected"""
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from time import monotonic
+
+import pytest
+
+from deadline import set_deadline, DeadlineExceeded
+from rate_limiter import (AdaptiveRateLimiter, parse_retry_after,
+                          configure_rate_limits, get_rate_limiter)
+
+
+def test_acquire_allows_burst():
+    """Tests a fresh limiter lets one second's worth of requests through at once"""
+    limiter = AdaptiveRateLimiter(5)
+    assert sum(limiter.acquire() for _ in range(5)) == 0
+
+
+def test_acquire_waits_when_empty():
+    """Tests requests beyond the burst wait for tokens"""
+    limiter = AdaptiveRateLimiter(20)
+    for _ in range(20):
+        limiter.acquire()
+    start = monotonic()
+    limiter.acquire()
+    assert monotonic() - start > 0.02
+
+
+def test_on_throttle_halves_rate():
+    """Tests a throttled response halves the rate"""
+    limiter = AdaptiveRateLimiter(10)
+    limiter.on_throttle()
+    assert limiter.rate == 5
+
+
+def test_on_throttle_respects_min_rate():
+    """Tests the rate never drops below the minimum"""
+    limiter = AdaptiveRateLimiter(1, min_rate=0.5)
+    for _ in range(10):
+        limiter.on_throttle()
+    assert limiter.rate == 0.5
+
+
+def test_on_success_grows_rate_back():
+    """Tests successful responses grow the rate back to the maximum"""
+    limiter = AdaptiveRateLimiter(10)
+    limiter.on_throttle()
+    limiter.on_success()
+    assert 5 < limiter.rate < 10
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.rate == 10
+
+
+def test_on_throttle_retry_after_blocks():
+    """Tests Retry-After pauses every request"""
+    limiter = AdaptiveRateLimiter(100)
+    limiter.on_throttle(0.1)
+    start = monotonic()
+    limiter.acquire()
+    assert monotonic() - start >= 0.09
+
+
+def test_acquire_retry_after_past_deadline():
+    """Tests a Retry-After pause that would pass the deadline is refused without waiting"""
+    limiter = AdaptiveRateLimiter(100)
+    limiter.on_throttle(30)
+    set_deadline(2, margin_seconds=0)
+    start = monotonic()
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire()
+    assert monotonic() - start < 0.1
+
+
+@pytest.mark.parametrize("max_rate", [0, -1])
+def test_limiter_invalid_rate(max_rate):
+    """Tests non positive rates raise a ValueError"""
+    with pytest.raises(ValueError):
+        AdaptiveRateLimiter(max_rate)
+
+
+@pytest.mark.parametrize("max_rate", ["1", None, True])
+def test_limiter_invalid_rate_type(max_rate):
+    """Tests non numeric rates raise a TypeError"""
+    with pytest.raises(TypeError):
+        AdaptiveRateLimiter(max_rate)
+
+
+def test_parse_retry_after_seconds():
+    """Tests a Retry-After number of seconds"""
+    assert parse_retry_after("120") == 120
+
+
+def test_parse_retry_after_date():
+    """Tests a Retry-After HTTP date"""
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30
+
+
+@pytest.mark.parametrize("value", [None, "", "soon"])
+def test_parse_retry_after_invalid(value):
+    """Tests missing or invalid Retry-After headers return None"""
+    assert parse_retry_after(value) is None
+
+
+def test_configure_rate_limits_shares_rate():
+    """Tests the rate is split between worker processes"""
+    configure_rate_limits({"test-shop": 8.0}, processes=4)
+    assert get_rate_limiter("test-shop").max_rate == 2
+
+
+def test_configure_rate_limits_keeps_limiter():
+    """Tests an unchanged rate keeps the existing limiter across invocations"""
+    configure_rate_limits({"test-shop": 3.0})
+    limiter = get_rate_limiter("test-shop")
+    configure_rate_limits({"test-shop": 3.0})
+    assert get_rate_limiter("test-shop") is limiter
+
+
+def test_configure_rate_limits_none_removes():
+    """Tests a rate of None turns rate limiting off"""
+    configure_rate_limits({"test-shop": 3.0})
+    configure_rate_limits({"test-shop": None})
+    assert get_rate_limiter("test-shop") is None
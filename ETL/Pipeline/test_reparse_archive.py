@@ -0,0 +1,80 @@
+"""This file tests whether the reparse_archive file works as expected"""
+
+import json
+from collections import Counter
+from unittest.mock import patch
+
+from benchmark_patagonia_parser import build_synthetic_page
+from reparse_archive import (parse_patagonia_body, parse_asos_body, reparse_archive,
+                             summarise_readings, read_product_index, add_product_id)
+from response_archive import archive_response
+
+ASOS_BODY = json.dumps([
+    {"productId": 1, "productPrice": {"current": {"value": 10}, "discountPercentage": 5}},
+    {"productId": 2, "productPrice": {}}])
+
+
+def test_parse_patagonia_body():
+    """Tests an archived product page gives its price"""
+    assert parse_patagonia_body(build_synthetic_page(5, 70)) == [
+        {"current_price": 70, "is_on_sale": True, "colour_prices": {}}]
+
+
+def test_parse_patagonia_body_wrong_page():
+    """Tests a page that is not a product page gives the reason"""
+    assert parse_patagonia_body("<html></html>")[0]["error"] == "WrongPage"
+
+
+def test_parse_asos_body():
+    """Tests each product of an archived stockprice response gets a reading"""
+    readings = parse_asos_body(ASOS_BODY)
+    assert readings[0] == {"product_code": 1, "current_price": 10, "is_on_sale": True}
+    assert readings[1]["error"] == "MissingPrice"
+    assert parse_asos_body('{"errorCode": "x"}')[0]["error"] == "NotFound"
+
+
+def test_reparse_archive(tmp_path):
+    """Tests every archived response is re-parsed on the worker processes"""
+    location = f"file://{tmp_path}"
+    with patch.dict("response_archive.ENV", {"RESPONSE_ARCHIVE": location}):
+        archive_response("https://eu.patagonia.com/1.html", build_synthetic_page(5, 70),
+                         "patagonia", 200)
+        archive_response("https://eu.patagonia.com/2.html", "gone", "patagonia", 404)
+        archive_response("https://www.asos.com/api/stockprice", ASOS_BODY, "asos", 200)
+        archive_response("https://example.com", "other", "example", 200)
+    readings = list(reparse_archive(location, 2))
+    patagonia_readings = list(reparse_archive(location, 2, "patagonia"))
+    assert len(readings) == 4
+    assert len(patagonia_readings) == 2
+    by_url = {(reading["url"], reading.get("product_code")): reading for reading in readings}
+    assert by_url[("https://eu.patagonia.com/1.html", None)]["current_price"] == 70
+    assert by_url[("https://eu.patagonia.com/2.html", None)]["error"] == "NotFound"
+    assert by_url[("https://www.asos.com/api/stockprice", 1)]["current_price"] == 10
+    assert all("reading_at" in reading and "sha256" in reading for reading in readings)
+
+
+def test_add_product_id(tmp_path):
+    """Tests readings get their product ID from the page URL or the ASOS product code"""
+    products = tmp_path / "products.csv"
+    products.write_text("product_id,url,product_code,website_name\n"
+                        "7,https://eu.patagonia.com/1.html,P1,patagonia\n"
+                        "8,https://www.asos.com/prd/1,1,asos\n", encoding="utf-8")
+    index = read_product_index(str(products))
+    patagonia = {"url": "https://eu.patagonia.com/1.html", "website_name": "patagonia",
+                 "current_price": 70}
+    asos = {"url": "https://www.asos.com/api/stockprice", "website_name": "asos",
+            "product_code": 1, "current_price": 10}
+    unknown = {"url": "https://www.asos.com/api/stockprice", "website_name": "asos",
+               "product_code": 2, "current_price": 10}
+    assert add_product_id(patagonia, index)["product_id"] == 7
+    assert add_product_id(asos, index)["product_id"] == 8
+    assert "error" not in asos
+    add_product_id(unknown, index)
+    assert (unknown["product_id"], unknown["error"]) == (None, "UnknownProduct")
+
+
+def test_summarise_readings():
+    """Tests the summary counts parsed and failed readings per website"""
+    counts = Counter({("asos", None): 3, ("asos", "MissingPrice"): 1, ("patagonia", None): 2})
+    assert summarise_readings(counts) == ("asos: 3 parsed, 1 not parsed {'MissingPrice': 1}\n"
+                                          "patagonia: 2 parsed, 0 not parsed {}")
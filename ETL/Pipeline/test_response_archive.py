@@ -0,0 +1,89 @@
+"""This file tests whether the response_archive file works as expected"""
+
+import gzip
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from response_archive import (FileArchiveBackend, S3ArchiveBackend, get_archive_backend,
+                              get_response_archive, archive_response, read_archived_body,
+                              get_object_key)
+
+
+def test_archive_response_round_trip(tmp_path):
+    """Tests an archived body is stored compressed under its hash and indexed"""
+    with patch.dict("response_archive.ENV", {"RESPONSE_ARCHIVE": f"file://{tmp_path}"}):
+        archive_response("https://example.com/1", "<html>1</html>", "patagonia", 200)
+        backend = get_response_archive()
+    records = list(backend.iter_records())
+    assert len(records) == 1
+    assert records[0]["url"] == "https://example.com/1"
+    assert records[0]["website_name"] == "patagonia"
+    assert records[0]["status_code"] == 200
+    assert read_archived_body(backend, records[0]) == "<html>1</html>"
+    assert gzip.decompress((tmp_path / get_object_key(records[0]["sha256"])).read_bytes())
+
+
+def test_archive_response_deduplicates_bodies(tmp_path):
+    """Tests identical bodies are stored once but every fetch is indexed"""
+    with patch.dict("response_archive.ENV", {"RESPONSE_ARCHIVE": f"file://{tmp_path}"}):
+        archive_response("https://example.com/1", "same", "asos")
+        archive_response("https://example.com/2", "same", "asos")
+    assert len(list((tmp_path / "objects").rglob("*.gz"))) == 1
+    assert len(list(FileArchiveBackend(str(tmp_path)).iter_records())) == 2
+
+
+@patch.dict("response_archive.ENV", {}, clear=True)
+def test_archive_response_disabled():
+    """Tests nothing is archived when RESPONSE_ARCHIVE is not set"""
+    assert get_response_archive() is None
+    archive_response("https://example.com", "<html></html>", "patagonia")
+
+
+def test_archive_response_error_is_logged(tmp_path):
+    """Tests a failing archive does not raise"""
+    (tmp_path / "objects").write_text("not a directory")
+    with patch.dict("response_archive.ENV", {"RESPONSE_ARCHIVE": f"file://{tmp_path}"}):
+        archive_response("https://example.com", "<html></html>", "patagonia")
+
+
+def test_file_backend_empty(tmp_path):
+    """Tests an empty archive has no records"""
+    assert not list(FileArchiveBackend(str(tmp_path)).iter_records())
+
+
+def test_s3_backend_round_trip():
+    """Tests the S3 backend writes bodies and records under its prefix"""
+    mock_client = MagicMock()
+    backend = S3ArchiveBackend("bucket", "archive/", mock_client)
+    backend.put_object("ab12", b"data")
+    backend.add_record({"url": "https://example.com", "fetched_at": "2024-06-01 12:00:00",
+                        "sha256": "ab12"})
+    keys = [call[1]["Key"] for call in mock_client.put_object.call_args_list]
+    assert keys[0] == "archive/objects/ab/ab12.gz"
+    assert keys[1].startswith("archive/index/2024-06-01/")
+    mock_client.get_object.return_value = {"Body": BytesIO(b"data")}
+    assert backend.get_object("ab12") == b"data"
+
+
+def test_s3_backend_iter_records():
+    """Tests the S3 backend reads every index record"""
+    mock_client = MagicMock()
+    mock_client.get_paginator.return_value.paginate.return_value = [
+        {"Contents": [{"Key": "index/2024-06-01/a.json"}]}, {}]
+    mock_client.get_object.return_value = {"Body": BytesIO(b'{"url": "u"}')}
+    assert list(S3ArchiveBackend("bucket", "", mock_client).iter_records()) == [{"url": "u"}]
+
+
+@pytest.mark.parametrize("location", ["sqlite://archive.db", "file://", "archive"])
+def test_get_archive_backend_invalid(location):
+    """Tests get_archive_backend raises a ValueError for unknown locations"""
+    with pytest.raises(ValueError):
+        get_archive_backend(location)
+
+
+def test_get_archive_backend_type_error():
+    """Tests get_archive_backend raises a TypeError for non string locations"""
+    with pytest.raises(TypeError):
+        get_archive_backend(None)
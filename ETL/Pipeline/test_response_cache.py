@@ -0,0 +1,127 @@
+"""This file tests whether the response_cache file works as expected"""
+
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from response_cache import (FileCacheBackend, SQLiteCacheBackend, S3CacheBackend,
+                            get_cache_backend, get_response_cache,
+                            get_conditional_headers, get_fragment_hash)
+
+
+@pytest.fixture(name="fake_cache_entry")
+def fixture_fake_cache_entry() -> dict:
+    """Example cache entry"""
+    return {"etag": "\"abc\"", "last_modified": "Wed, 21 Oct 2015 07:28:00 GMT",
+            "fragment_hash": "123", "current_price": 100, "is_on_sale": False}
+
+
+@pytest.mark.parametrize("backend_class", [FileCacheBackend, SQLiteCacheBackend])
+def test_local_backend_round_trip(backend_class, tmp_path, fake_cache_entry):
+    """Tests local backends return what was stored"""
+    backend = backend_class(str(tmp_path / "cache"))
+    assert backend.get("https://example.com") is None
+    backend.set("https://example.com", fake_cache_entry)
+    assert backend.get("https://example.com") == fake_cache_entry
+
+
+@pytest.mark.parametrize("backend_class", [FileCacheBackend, SQLiteCacheBackend])
+def test_local_backend_overwrites(backend_class, tmp_path, fake_cache_entry):
+    """Tests local backends replace an existing entry"""
+    backend = backend_class(str(tmp_path / "cache"))
+    backend.set("https://example.com", fake_cache_entry)
+    backend.set("https://example.com", {**fake_cache_entry, "current_price": 50})
+    assert backend.get("https://example.com")["current_price"] == 50
+
+
+def test_file_backend_corrupt_file(tmp_path, fake_cache_entry):
+    """Tests a corrupt cache file is treated as empty and replaced on the next write"""
+    path = tmp_path / "cache.json"
+    path.write_text("{\"https://example.com\": {", encoding="utf-8")
+    backend = FileCacheBackend(str(path))
+    assert backend.get("https://example.com") is None
+    backend.set("https://example.com", fake_cache_entry)
+    assert backend.get("https://example.com") == fake_cache_entry
+    assert [item.name for item in tmp_path.iterdir()] == ["cache.json"]
+
+
+def test_s3_backend_get(fake_cache_entry):
+    """Tests the S3 backend reads a stored entry"""
+    mock_client = MagicMock()
+    mock_client.get_object.return_value = {
+        "Body": BytesIO(b'{"current_price": 100}')}
+    backend = S3CacheBackend("bucket", "cache/", mock_client)
+    assert backend.get("https://example.com") == {"current_price": 100}
+    assert mock_client.get_object.call_args[1]["Key"].startswith("cache/")
+    backend.set("https://example.com", fake_cache_entry)
+    assert mock_client.put_object.call_count == 1
+
+
+def test_s3_backend_missing_key():
+    """Tests the S3 backend returns None for a missing entry"""
+    mock_client = MagicMock()
+    mock_client.get_object.side_effect = ClientError(
+        {"Error": {"Code": "NoSuchKey"}}, "GetObject")
+    assert S3CacheBackend("bucket", "", mock_client).get("https://example.com") is None
+
+
+@pytest.mark.parametrize("location, backend_class", [("file:///tmp/cache.json", FileCacheBackend),
+                                                     ("sqlite://:memory:", SQLiteCacheBackend)])
+def test_get_cache_backend_valid(location, backend_class):
+    """Tests get_cache_backend picks the backend from the scheme"""
+    assert isinstance(get_cache_backend(location), backend_class)
+
+
+@pytest.mark.parametrize("location", ["redis://host", "file://", "cache.json"])
+def test_get_cache_backend_invalid(location):
+    """Tests get_cache_backend raises a ValueError for unknown locations"""
+    with pytest.raises(ValueError):
+        get_cache_backend(location)
+
+
+def test_get_cache_backend_type_error():
+    """Tests get_cache_backend raises a TypeError for non string locations"""
+    with pytest.raises(TypeError):
+        get_cache_backend(None)
+
+
+@patch.dict("response_cache.ENV", {}, clear=True)
+def test_get_response_cache_disabled():
+    """Tests the cache is off when RESPONSE_CACHE is not set"""
+    assert get_response_cache() is None
+
+
+def test_get_response_cache_reused(tmp_path):
+    """Tests the same backend is returned on warm invocations"""
+    with patch.dict("response_cache.ENV", {"RESPONSE_CACHE": f"file://{tmp_path}/c.json"}):
+        assert get_response_cache() is get_response_cache()
+
+
+def test_get_response_cache_per_process(tmp_path):
+    """Tests a forked worker creates its own backend instead of reusing its parent's"""
+    with patch.dict("response_cache.ENV", {"RESPONSE_CACHE": f"file://{tmp_path}/c.json"}):
+        parent_backend = get_response_cache()
+        with patch("response_cache.os.getpid", return_value=-1):
+            assert get_response_cache() is not parent_backend
+
+
+def test_get_conditional_headers(fake_headers, fake_cache_entry):
+    """Tests the validators are added to the request headers"""
+    headers = get_conditional_headers(fake_headers, fake_cache_entry)
+    assert headers["If-None-Match"] == "\"abc\""
+    assert headers["If-Modified-Since"] == "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert "If-None-Match" not in fake_headers
+
+
+def test_get_conditional_headers_no_entry(fake_headers):
+    """Tests no validators are sent without a cache entry"""
+    assert get_conditional_headers(fake_headers, None) == fake_headers
+
+
+def test_get_fragment_hash():
+    """Tests equal fragments hash the same and missing fragments are None"""
+    assert get_fragment_hash("<span>1</span>") == get_fragment_hash("<span>1</span>")
+    assert get_fragment_hash("<span>1</span>") != get_fragment_hash("<span>2</span>")
+    assert get_fragment_hash(None) is None
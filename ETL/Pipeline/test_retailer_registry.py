@@ -0,0 +1,117 @@
+"""This file tests whether the retailer_registry file works as expected"""
+
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from retailer_registry import (register_retailer, get_retailer, supports_batches, get_batch_key,
+                               get_concurrency_limits, get_cost_rank, supports_stages)
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    """Runs every test against an empty registry."""
+    with patch.dict("retailer_registry.RETAILERS", clear=True):
+        yield
+
+
+def test_register_retailer_valid():
+    """Tests a registered retailer can be looked up"""
+    extract = MagicMock()
+    register_retailer("asos", extract, "api", 10, requests_per_second=2.0)
+    assert get_retailer("asos") == {
+        "extract": extract,
+        "cost_class": "api",
+        "max_concurrency": 10,
+        "requests_per_second": 2.0,
+        "batch_extract": None,
+        "batch_size": None,
+        "coalesce_key": None,
+        "fetch_page": None,
+        "parse_page": None
+    }
+
+
+def test_get_retailer_missing():
+    """Tests None is returned for an unregistered retailer"""
+    assert get_retailer("zara") is None
+    assert get_retailer(None) is None
+
+
+@pytest.mark.parametrize("website_name, extract", [(None, MagicMock()), ("", MagicMock()),
+                                                   ("asos", "not callable")])
+def test_register_retailer_type_errors(website_name, extract):
+    """Tests invalid names and extractors raise a TypeError"""
+    with pytest.raises(TypeError):
+        register_retailer(website_name, extract, "api", 1)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"cost_class": "ftp", "max_concurrency": 1},
+    {"cost_class": "api", "max_concurrency": 0},
+    {"cost_class": "api", "max_concurrency": True},
+    {"cost_class": "api", "max_concurrency": 1, "batch_size": 5},
+    {"cost_class": "api", "max_concurrency": 1, "batch_extract": MagicMock()},
+    {"cost_class": "api", "max_concurrency": 1, "batch_extract": MagicMock(), "batch_size": 0}
+])
+def test_register_retailer_value_errors(kwargs):
+    """Tests invalid profiles raise a ValueError"""
+    with pytest.raises(ValueError):
+        register_retailer("asos", MagicMock(), **kwargs)
+
+
+def test_register_retailer_coalesce_key_needs_batch_extract():
+    """Tests a coalesce_key without a batch extractor raises a ValueError"""
+    with pytest.raises(ValueError):
+        register_retailer("patagonia", MagicMock(), "html", 2, coalesce_key=MagicMock())
+
+
+@pytest.mark.parametrize("coalesce_key, product_data, batch_key", [
+    (None, {"url": "a"}, "asos"),
+    (lambda product: product["url"], {"url": "a"}, ("asos", "a")),
+    (lambda product: None, {"url": "a"}, None)])
+def test_get_batch_key(coalesce_key, product_data, batch_key):
+    """Tests products are batched per website, or per coalesce key if there is one"""
+    register_retailer("asos", MagicMock(), "api", 10, batch_extract=MagicMock(), batch_size=5,
+                      coalesce_key=coalesce_key)
+    assert get_batch_key("asos", product_data) == batch_key
+    assert get_batch_key("zara", product_data) is None
+
+
+def test_supports_batches():
+    """Tests only retailers with a batch extractor support batches"""
+    register_retailer("asos", MagicMock(), "api", 10, batch_extract=MagicMock(), batch_size=5)
+    register_retailer("patagonia", MagicMock(), "html", 2)
+    assert supports_batches("asos")
+    assert not supports_batches("patagonia")
+    assert not supports_batches("zara")
+
+
+def test_supports_stages():
+    """Tests only retailers with fetch and parse stages can be staged"""
+    register_retailer("patagonia", MagicMock(), "html", 2, fetch_page=MagicMock(),
+                      parse_page=MagicMock())
+    register_retailer("asos", MagicMock(), "api", 10)
+    assert supports_stages("patagonia")
+    assert not supports_stages("asos")
+    assert not supports_stages(None)
+
+
+def test_register_retailer_stages_given_together():
+    """Tests fetch_page without parse_page raises a ValueError"""
+    with pytest.raises(ValueError):
+        register_retailer("patagonia", MagicMock(), "html", 2, fetch_page=MagicMock())
+
+
+def test_get_concurrency_limits():
+    """Tests every retailer's max concurrency is returned"""
+    register_retailer("asos", MagicMock(), "api", 10)
+    register_retailer("patagonia", MagicMock(), "html", 2)
+    assert get_concurrency_limits() == {"asos": 10, "patagonia": 2}
+
+
+def test_get_cost_rank():
+    """Tests HTML retailers rank before API retailers, and unknown retailers rank last"""
+    register_retailer("asos", MagicMock(), "api", 10)
+    register_retailer("patagonia", MagicMock(), "html", 2)
+    assert get_cost_rank("patagonia") < get_cost_rank("asos") < get_cost_rank("zara")
@@ -0,0 +1,99 @@
+"""Tests for the staged fetch and parse engine"""
+
+from threading import Event, Thread, Lock
+from time import sleep
+
+from deadline import set_deadline
+from staged_extract import run_stages
+from extract_async import UNFINISHED
+
+
+class FakeAsyncResult:
+    """Stands in for a pool result that is ready once its event is set."""
+
+    def __init__(self, value, released: Event):
+        self.value = value
+        self.released = released
+
+    def ready(self) -> bool:
+        """Returns True once released"""
+        return self.released.is_set()
+
+    def wait(self, timeout: float) -> None:
+        """Waits until released or timeout"""
+        self.released.wait(timeout)
+
+    def get(self, _timeout: float):
+        """Returns the parsed value"""
+        return self.value
+
+
+def test_run_stages_parses_fetched_pages():
+    """Tests fetched pages are parsed and finished tasks are passed straight through"""
+    released = Event()
+    released.set()
+
+    def fetch(task):
+        return (True, f"page {task}") if task % 2 else (False, f"done {task}")
+
+    completed = dict(run_stages([1, 2, 3], fetch,
+                                lambda task, page: FakeAsyncResult(page.upper(), released),
+                                fetch_threads=2, queue_size=2, max_parsing=2))
+    assert completed == {0: "PAGE 1", 1: "done 2", 2: "PAGE 3"}
+
+
+def test_run_stages_empty():
+    """Tests no tasks complete immediately"""
+    assert not list(run_stages([], None, None, 1, 1, 1))
+
+
+def test_run_stages_bounded_queue():
+    """Tests fetching stops once the queue is full while parsing is stalled"""
+    released = Event()
+    fetched = []
+    lock = Lock()
+
+    def fetch(task):
+        with lock:
+            fetched.append(task)
+        return True, task
+
+    results = []
+    consumer = Thread(target=lambda: results.extend(run_stages(
+        list(range(20)), fetch, lambda task, page: FakeAsyncResult(page, released),
+        fetch_threads=2, queue_size=3, max_parsing=1)))
+    consumer.start()
+    sleep(0.3)
+    # one page being parsed, three queued and one held by each blocked fetch thread
+    assert len(fetched) <= 1 + 3 + 2
+    released.set()
+    consumer.join(5)
+    assert sorted(index for index, _ in results) == list(range(20))
+
+
+def test_run_stages_deadline():
+    """Tests tasks still being parsed at the deadline are unfinished"""
+    set_deadline(0.3, margin_seconds=0)
+    never = Event()
+    completed = list(run_stages([1, 2], lambda task: (task == 1, task),
+                                lambda task, page: FakeAsyncResult(page, never),
+                                fetch_threads=2, queue_size=2, max_parsing=2))
+    assert completed == [(1, 2), (0, UNFINISHED)]
+
+
+def test_run_stages_fetch_raises():
+    """Tests a fetch that raises is unfinished and does not hang the run without a deadline"""
+    set_deadline(None)
+
+    def fetch(task):
+        if task == 2:
+            raise RuntimeError("bug")
+        return False, task
+
+    completed = []
+    consumer = Thread(target=lambda: completed.extend(run_stages(
+        [1, 2, 3], fetch, None, fetch_threads=1, queue_size=2, max_parsing=1)), daemon=True)
+    consumer.start()
+    consumer.join(5)
+    assert not consumer.is_alive()
+    assert sorted(completed, key=lambda item: item[0]) == [(0, 1), (1, UNFINISHED), (2, 3)]
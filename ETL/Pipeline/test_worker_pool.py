@@ -0,0 +1,98 @@
+"""Tests for the persistent worker pool"""
+
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+
+import deadline
+import rate_limiter
+from worker_pool import (get_pool_size, get_worker_pool, discard_worker_pool, get_pool_stats,
+                         get_thread_executor, run_chunk, WORKER_POOL,
+                         CHUNK_RETURN_SECONDS)
+
+
+@patch.dict("worker_pool.ENV", {"AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "3008"}, clear=True)
+@patch("worker_pool.os.cpu_count", return_value=2)
+def test_get_pool_size_one_process_per_vcpu(_mock_cpu_count):
+    """Tests a process is started per vCPU"""
+    assert get_pool_size() == (2, 8)
+
+
+@patch.dict("worker_pool.ENV", {"AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "512"}, clear=True)
+@patch("worker_pool.os.cpu_count", return_value=6)
+def test_get_pool_size_capped_by_memory(_mock_cpu_count):
+    """Tests small functions start fewer processes than they have vCPUs"""
+    assert get_pool_size() == (2, 8)
+
+
+@patch.dict("worker_pool.ENV", {"POOL_PROCESSES": "3", "POOL_THREADS_PER_PROCESS": "4"})
+def test_get_pool_size_overridden():
+    """Tests the pool size can be set from the environment"""
+    assert get_pool_size() == (3, 4)
+
+
+@patch.dict("worker_pool.ENV", {"POOL_THREADS_PER_PROCESS": "0"})
+def test_get_pool_size_invalid():
+    """Tests a pool without threads is rejected"""
+    with pytest.raises(ValueError):
+        get_pool_size()
+
+
+@patch("worker_pool.Pool")
+def test_get_worker_pool_reused(mock_pool_class):
+    """Tests the pool is started once and its start time is only reported when started"""
+    starts = get_pool_stats()["starts"]
+    assert get_worker_pool() is get_worker_pool()
+    assert mock_pool_class.call_count == 1
+    assert get_pool_stats()["starts"] == starts + 1
+    assert get_pool_stats()["start_seconds"] == 0.0
+
+
+@patch("worker_pool.Pool")
+def test_discard_worker_pool(mock_pool_class):
+    """Tests a discarded pool is terminated and replaced on next use"""
+    get_worker_pool()
+    discard_worker_pool()
+    assert mock_pool_class.return_value.terminate.call_count == 1
+    assert WORKER_POOL["pool"] is None
+    get_worker_pool()
+    assert mock_pool_class.call_count == 2
+
+
+def test_get_thread_executor_per_process():
+    """Tests the executor is reused within a process and rebuilt when resized"""
+    executor = get_thread_executor(2)
+    assert get_thread_executor(2) is executor
+    assert get_thread_executor(3) is not executor
+
+
+def test_run_chunk(monkeypatch):
+    """Tests a chunk runs in order with the invocation's deadline and rate limits"""
+    monkeypatch.setitem(deadline.DEADLINE, "at", None)
+    deadline_at = time.monotonic() + 60
+    results = run_chunk(os.path.basename, ["a/b", "c/d"], deadline_at, {"asos": 20.0}, 2, 2)
+    assert results == ["b", "d"]
+    assert deadline.DEADLINE["at"] == deadline_at
+    assert rate_limiter.RATE_LIMITERS["asos"].max_rate == 10.0
+
+
+def test_run_chunk_without_deadline(monkeypatch):
+    """Tests a chunk without a deadline waits for every task"""
+    monkeypatch.setitem(deadline.DEADLINE, "at", None)
+    assert run_chunk(os.path.basename, ["a/b", "c/d"], None, {}, 1, 2) == ["b", "d"]
+
+
+def test_run_chunk_returns_finished_tasks_before_deadline():
+    """Tests a chunk returns the tasks that finished before the deadline, with None for the
+    ones still running"""
+    def slow_second(task):
+        if task == 1:
+            time.sleep(2)
+        return task
+
+    start = time.monotonic()
+    results = run_chunk(slow_second, [0, 1, 2], start + CHUNK_RETURN_SECONDS + 0.3, {}, 1, 3)
+    assert time.monotonic() - start < 1.5
+    assert results == [0, None, 2]
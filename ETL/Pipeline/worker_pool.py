@@ -0,0 +1,112 @@
+"""Worker Pool: a persistent pool of worker processes, each running extractions on several
+I/O threads, created once per Lambda container and reused across warm invocations."""
+
+import atexit
+from concurrent.futures import ThreadPoolExecutor, wait
+from os import environ as ENV
+import logging
+import os
+from threading import Lock
+from time import perf_counter
+from typing import Callable
+
+from lambda_multiprocessing import Pool
+
+import deadline
+from fetch_policy import configure_hedge_workers
+from rate_limiter import configure_rate_limits
+
+DEFAULT_MEMORY_MB = 3008
+MEMORY_PER_PROCESS_MB = 256
+DEFAULT_THREADS_PER_PROCESS = 8
+CHUNK_RETURN_SECONDS = 0.5
+
+WORKER_POOL = {"pool": None, "processes": 0, "threads": 0, "starts": 0, "start_seconds": 0.0}
+WORKER_POOL_LOCK = Lock()
+THREAD_EXECUTOR = {"pid": None, "threads": 0, "executor": None}
+THREAD_EXECUTOR_LOCK = Lock()
+
+
+def get_pool_size() -> tuple[int, int]:
+    """Returns the number of worker processes and of I/O threads per process. Processes
+    default to one per vCPU, capped so each gets MEMORY_PER_PROCESS_MB of the Lambda's
+    memory; POOL_PROCESSES and POOL_THREADS_PER_PROCESS override the defaults."""
+    memory_mb = int(ENV.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", DEFAULT_MEMORY_MB))
+    processes = int(ENV.get("POOL_PROCESSES") or
+                    max(1, min(os.cpu_count() or 1, memory_mb // MEMORY_PER_PROCESS_MB)))
+    threads = int(ENV.get("POOL_THREADS_PER_PROCESS", DEFAULT_THREADS_PER_PROCESS))
+    if processes <= 0 or threads <= 0:
+        logging.error("The pool must have at least one process and one thread.")
+        raise ValueError("The pool must have at least one process and one thread.")
+    return processes, threads
+
+
+def get_worker_pool() -> Pool:
+    """Returns the worker pool, starting it if this container does not have one yet.
+    The time spent starting it is recorded separately from the extraction. The pool is
+    terminated at exit, since the interpreter would otherwise wait for its idle workers."""
+    with WORKER_POOL_LOCK:
+        if WORKER_POOL["pool"] is None:
+            processes, threads = get_pool_size()
+            start = perf_counter()
+            WORKER_POOL["pool"] = Pool(processes=processes)
+            WORKER_POOL["start_seconds"] = perf_counter() - start
+            WORKER_POOL["processes"], WORKER_POOL["threads"] = processes, threads
+            WORKER_POOL["starts"] += 1
+            atexit.register(discard_worker_pool)
+            logging.info("Started %s worker processes x %s threads in %.3fs",
+                         processes, threads, WORKER_POOL["start_seconds"])
+        else:
+            WORKER_POOL["start_seconds"] = 0.0
+        return WORKER_POOL["pool"]
+
+
+def discard_worker_pool() -> None:
+    """Terminates the worker pool, e.g. when workers are still busy at the deadline.
+    The next invocation starts a new one."""
+    with WORKER_POOL_LOCK:
+        if WORKER_POOL["pool"] is not None:
+            WORKER_POOL["pool"].terminate()
+            WORKER_POOL["pool"] = None
+
+
+def get_pool_stats() -> dict:
+    """Returns the size of the worker pool, how many times it has been started and how long
+    the last invocation spent starting it (0 when a warm pool was reused)."""
+    with WORKER_POOL_LOCK:
+        return {key: value for key, value in WORKER_POOL.items() if key != "pool"}
+
+
+def get_thread_executor(threads: int) -> ThreadPoolExecutor:
+    """Returns the I/O thread pool of this worker process, creating one per process. It has
+    its own lock because the workers are forked while WORKER_POOL_LOCK is held."""
+    with THREAD_EXECUTOR_LOCK:
+        if THREAD_EXECUTOR["pid"] != os.getpid() or THREAD_EXECUTOR["threads"] != threads:
+            THREAD_EXECUTOR["executor"] = ThreadPoolExecutor(max_workers=threads)
+            THREAD_EXECUTOR["pid"], THREAD_EXECUTOR["threads"] = os.getpid(), threads
+        return THREAD_EXECUTOR["executor"]
+
+
+def run_chunk(process_function: Callable, tasks: list, deadline_at: float | None,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+              rates: dict[str, float | None], processes: int, threads: int) -> list:
+    """Runs a chunk of tasks on a worker's I/O threads and returns their results in order.
+    Workers outlive the invocation that started them, so the deadline and rate limits of
+    the current invocation are passed in with every chunk. The chunk returns
+    CHUNK_RETURN_SECONDS before the deadline with None for every task still running, so the
+    results of the tasks that did finish reach the parent in time."""
+    deadline.DEADLINE["at"] = deadline_at
+    configure_rate_limits(rates, processes)
+    configure_hedge_workers(threads)
+    executor = get_thread_executor(threads)
+    futures = [executor.submit(process_function, task) for task in tasks]
+    remaining = deadline.get_remaining_seconds()
+    wait(futures, timeout=None if remaining is None
+         else max(0.0, remaining - CHUNK_RETURN_SECONDS))
+    results = []
+    for future in futures:
+        if future.done() and not future.cancelled():
+            results.append(future.result())
+        else:
+            future.cancel()
+            results.append(None)
+    return results
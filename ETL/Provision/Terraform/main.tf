@@ -50,6 +50,13 @@ resource "aws_lambda_function" "provision_lambda" {
       DB_NAME             = var.DB_NAME
       DB_SCHEMA           = var.DB_SCHEMA
       PROCESSING_BATCH_SIZE = var.PROCESSING_BATCH_SIZE
+      ADAPTIVE_POLLING    = var.ADAPTIVE_POLLING
+      STREAM_PRODUCTS     = var.STREAM_PRODUCTS
+      COST_PACKING        = var.COST_PACKING
+      CACHE_PRODUCTS      = var.CACHE_PRODUCTS
+      CLAIM_CHECK         = var.CLAIM_CHECK
+      ACCESS_KEY          = var.ACCESS_KEY
+      SECRET_ACCESS_KEY   = var.SECRET_ACCESS_KEY
     }
   }
 }
\ No newline at end of file
@@ -43,3 +43,27 @@ variable "PROCESSING_BATCH_SIZE" {
     type = number
 }
 
+variable "ADAPTIVE_POLLING" {
+    type = string
+    default = "true"
+}
+
+variable "STREAM_PRODUCTS" {
+    type = string
+    default = "true"
+}
+
+variable "COST_PACKING" {
+    type = string
+    default = "true"
+}
+
+variable "CACHE_PRODUCTS" {
+    type = string
+    default = "true"
+}
+
+variable "CLAIM_CHECK" {
+    type = string
+    default = ""
+}
@@ -0,0 +1,70 @@
+"""Batch packer: sizes the batches Provision emits by the expected extraction time of their
+products rather than by product count, so that every Map iteration takes about as long."""
+
+from os import environ as ENV
+import logging
+
+DEFAULT_FETCH_SECONDS = 1.0
+MAX_BATCH_SIZE_FACTOR = 4
+
+
+def get_website_costs(products: list[tuple[str | None, float | None]]) -> dict[str, float]:
+    """Returns the average fetch cost of each website's products that have one, from
+    (website_name, fetch_seconds) pairs."""
+    totals = {}
+    for website_name, fetch_seconds in products:
+        if fetch_seconds is not None:
+            total = totals.setdefault(website_name, [0.0, 0])
+            total[0] += fetch_seconds
+            total[1] += 1
+    return {website_name: seconds / count for website_name, (seconds, count) in totals.items()}
+
+
+def estimate_costs(products: list[tuple[str | None, float | None]]) -> list[float]:
+    """Returns the expected fetch cost of each product: its own average fetch time, or the
+    average of its website's products if it has none yet, or DEFAULT_FETCH_SECONDS if no
+    product of its website has been timed."""
+    website_costs = get_website_costs(products)
+    return [float(fetch_seconds) if fetch_seconds is not None
+            else website_costs.get(website_name, DEFAULT_FETCH_SECONDS)
+            for website_name, fetch_seconds in products]
+
+
+def get_batch_sizes(products: list[tuple[str | None, float | None]],
+                    processing_batch_size: int) -> list[int]:
+    """Returns the number of products in each batch, for products given in emission order as
+    (website_name, fetch_seconds) pairs.
+
+    There are as many batches as fixed-size batches of processing_batch_size would give, but
+    each holds an equal share of the total expected cost: a product goes into the batch whose
+    share its cost's midpoint falls in. Batches of cheap API lookups therefore hold more
+    products than batches of expensive page scrapes. Batches never exceed
+    MAX_BATCH_SIZE_FACTOR times processing_batch_size products, and products keep their
+    order so the highest priority products are still in the first batches."""
+    if not isinstance(processing_batch_size, int) or processing_batch_size <= 0:
+        logging.error("processing_batch_size must be a positive integer.")
+        raise ValueError("processing_batch_size must be a positive integer.")
+    costs = estimate_costs(products)
+    if not costs:
+        return []
+    batch_count = -(-len(costs) // processing_batch_size)
+    target = sum(costs) / batch_count
+    max_batch_size = processing_batch_size * MAX_BATCH_SIZE_FACTOR
+    sizes = []
+    size, packed_cost = 0, 0.0
+    for product_cost in costs:
+        boundary = (len(sizes) + 1) * target
+        if size and (packed_cost + product_cost / 2 > boundary or size >= max_batch_size):
+            sizes.append(size)
+            size = 0
+        size += 1
+        packed_cost += product_cost
+    sizes.append(size)
+    logging.info("Packed %s products into %s batches of about %.1fs each",
+                 len(costs), len(sizes), target)
+    return sizes
+
+
+def is_cost_packing_enabled() -> bool:
+    "Returns True unless COST_PACKING is set to false"
+    return ENV.get("COST_PACKING", "true").lower() != "false"
@@ -0,0 +1,232 @@
+"""Benchmark Script: Times Provision's product read against the DISTINCT ON scan it replaced,
+as the price history grows, compares the time and peak memory of planning the whole
+catalogue from a list against streaming it from a server-side cursor, and times loading the
+product cache against refreshing it after a few products have changed.
+
+The tables are built in a scratch schema, so the benchmark can run against the real database
+without touching its data. Every product gets the same number of readings, and latest_prices
+is filled from them the way the email lambda keeps it up to date.
+
+Usage:
+    python benchmark_provision.py --products 2000 --readings 1000000 10000000 30000000
+    python benchmark_provision.py --schema provision_bench --keep
+    python benchmark_provision.py --products 1000000 --readings 1000000 --memory
+    python benchmark_provision.py --products 100000 --readings 10000000 --cache --changes 100
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime
+import multiprocessing
+from os import environ as ENV
+import resource
+from time import perf_counter
+
+from dotenv import load_dotenv
+from psycopg2 import sql
+
+from product_cache import clear_product_cache
+from provision_lambda import (get_connection, read_database, group_data, plan_products,
+                              stream_planned_products, read_cached_products)
+
+SPAWN = multiprocessing.get_context("spawn")
+PLANNERS = {"list": plan_products, "stream": stream_planned_products}
+
+DISTINCT_ON_QUERY = """SELECT DISTINCT ON (product_id) product_id, product_code,
+                    url, price, website_name, product_name
+                    FROM products
+                    LEFT JOIN price_readings USING (product_id)
+                    LEFT JOIN websites USING (website_id)
+                    ORDER BY product_id, reading_at DESC"""
+
+SCRATCH_TABLES = """
+CREATE TABLE websites (
+    website_id SMALLINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    website_name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE products(
+    product_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    url TEXT UNIQUE NOT NULL,
+    product_code TEXT NOT NULL,
+    product_name TEXT NOT NULL,
+    website_id SMALLINT NOT NULL REFERENCES websites (website_id),
+    next_due_at TIMESTAMP(0),
+    fetch_seconds REAL,
+    row_version BIGINT NOT NULL DEFAULT pg_current_xact_id()::TEXT::BIGINT
+);
+CREATE INDEX products_row_version_idx ON products (row_version);
+CREATE TABLE subscriptions (
+    subscription_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL REFERENCES products (product_id),
+    price_threshold DECIMAL(12, 2)
+);
+CREATE TABLE price_readings (
+    reading_id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    product_id INTEGER NOT NULL REFERENCES products (product_id),
+    reading_at TIMESTAMP(0) NOT NULL,
+    price DECIMAL(12, 2) NOT NULL
+);
+CREATE INDEX price_readings_product_idx ON price_readings (product_id, reading_at);
+CREATE TABLE latest_prices (
+    product_id INTEGER PRIMARY KEY REFERENCES products (product_id),
+    reading_at TIMESTAMP(0) NOT NULL,
+    price DECIMAL(12, 2) NOT NULL,
+    first_reading_at TIMESTAMP(0) NOT NULL,
+    price_changes INTEGER NOT NULL DEFAULT 0,
+    last_change_at TIMESTAMP(0)
+);
+CREATE TABLE product_deletions (
+    product_id INTEGER NOT NULL,
+    row_version BIGINT NOT NULL,
+    deleted_at TIMESTAMP(0) NOT NULL DEFAULT NOW()
+);
+INSERT INTO websites (website_name) VALUES ('patagonia'), ('asos');
+"""
+
+
+def create_scratch_schema(conn, schema: str, products: int) -> None:
+    """Creates the scratch schema with its tables and products, and makes it the first
+    schema on the connection's search path."""
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema};"
+                            "SET search_path TO {schema};").format(schema=sql.Identifier(schema)))
+        cur.execute(SCRATCH_TABLES)
+        cur.execute("""INSERT INTO products (url, product_code, product_name, website_id)
+                    SELECT 'https://example.com/product/' || i, i::TEXT, 'Product ' || i,
+                    1 + i %% 2
+                    FROM generate_series(1, %s) AS i""", (products,))
+    conn.commit()
+
+
+def grow_history(conn, products: int, readings: int) -> None:
+    """Adds readings to price_readings, spread evenly across the products, until it holds
+    the given number of readings, then refreshes latest_prices."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM price_readings")
+        existing = cur.fetchone()[0]
+        if readings > existing:
+            cur.execute("""INSERT INTO price_readings (product_id, reading_at, price)
+                        SELECT 1 + i %% %s, TIMESTAMP '2020-01-01' + i * INTERVAL '1 second',
+                        10 + i %% 90
+                        FROM generate_series(%s, %s) AS i""",
+                        (products, existing, readings - 1))
+        cur.execute("TRUNCATE latest_prices")
+        cur.execute("""WITH readings AS (
+                        SELECT product_id, reading_at, price,
+                        price <> LAG(price) OVER (PARTITION BY product_id
+                                                  ORDER BY reading_at) AS changed
+                        FROM price_readings)
+                    INSERT INTO latest_prices
+                    SELECT DISTINCT ON (product_id) product_id, reading_at, price,
+                    MIN(reading_at) OVER (PARTITION BY product_id),
+                    COUNT(*) FILTER (WHERE changed) OVER (PARTITION BY product_id),
+                    MAX(reading_at) FILTER (WHERE changed) OVER (PARTITION BY product_id)
+                    FROM readings ORDER BY product_id, reading_at DESC""")
+        cur.execute("ANALYZE")
+    conn.commit()
+
+
+def time_query(run, repeats: int) -> float:
+    """Returns the fastest of repeats runs, in seconds."""
+    timings = []
+    for _ in range(repeats):
+        start = perf_counter()
+        run()
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def time_distinct_on(conn) -> None:
+    """Runs the DISTINCT ON query Provision used to read products with."""
+    with conn.cursor() as cur:
+        cur.execute(DISTINCT_ON_QUERY)
+        cur.fetchall()
+
+
+def time_cache_refresh(conn, changes: int) -> tuple[float, float]:
+    """Returns the seconds taken to load the product cache from cold and to refresh it once
+    changes products have changed. The scratch schema has no triggers, so the changed
+    products are given new versions here."""
+    clear_product_cache()
+    now = datetime.now()
+    start = perf_counter()
+    read_cached_products(conn, now)
+    cold = perf_counter() - start
+    with conn.cursor() as cur:
+        cur.execute("""UPDATE products SET fetch_seconds = random(),
+                    row_version = pg_current_xact_id()::TEXT::BIGINT
+                    WHERE product_id <= %s""", (changes,))
+    conn.commit()
+    start = perf_counter()
+    read_cached_products(conn, now)
+    return cold, perf_counter() - start
+
+
+def run_planner(mode: str, schema: str, batch_size: int) -> tuple[float, float]:
+    """Runs in a fresh process, so its peak RSS belongs to this planner alone. Plans and
+    batches every product in the scratch schema, with adaptive polling off so the whole
+    catalogue is emitted, and returns the seconds taken and the peak RSS in MB."""
+    load_dotenv()
+    ENV["ADAPTIVE_POLLING"] = "false"
+    conn = get_connection(ENV)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("SET search_path TO {}").format(sql.Identifier(schema)))
+    start = perf_counter()
+    group_data(PLANNERS[mode](conn, {}, datetime.now()), batch_size)
+    seconds = perf_counter() - start
+    conn.close()
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--products", type=int, default=2000)
+    arg_parser.add_argument("--readings", type=int, nargs="+",
+                            default=[1_000_000, 10_000_000, 30_000_000])
+    arg_parser.add_argument("--repeats", type=int, default=3)
+    arg_parser.add_argument("--schema", default="provision_benchmark")
+    arg_parser.add_argument("--keep", action="store_true",
+                            help="Keep the scratch schema after the run.")
+    arg_parser.add_argument("--memory", action="store_true",
+                            help="Compare the list and stream planners at the smallest "
+                                 "history size instead of timing the product read.")
+    arg_parser.add_argument("--batch-size", type=int, default=100)
+    arg_parser.add_argument("--cache", action="store_true",
+                            help="Time a cold product cache load against a warm refresh "
+                                 "instead of timing the product read.")
+    arg_parser.add_argument("--changes", type=int, default=100,
+                            help="Number of products changed before the warm refresh.")
+    args = arg_parser.parse_args()
+
+    load_dotenv()
+    db_conn = get_connection(ENV)
+    try:
+        create_scratch_schema(db_conn, args.schema, args.products)
+        if args.memory:
+            grow_history(db_conn, args.products, min(args.readings))
+            print(f"{'planner':>8} {'seconds':>10} {'peak RSS (MB)':>14}")
+            for planner in PLANNERS:
+                with SPAWN.Pool(1) as pool:
+                    planner_seconds, peak_mb = pool.apply(
+                        run_planner, (planner, args.schema, args.batch_size))
+                print(f"{planner:>8} {planner_seconds:>10.3f} {peak_mb:>14.1f}")
+        elif args.cache:
+            print(f"{'readings':>12} {'cold load (s)':>14} {'warm refresh (s)':>17}")
+            for reading_count in sorted(args.readings):
+                grow_history(db_conn, args.products, reading_count)
+                cold_load, warm_refresh = time_cache_refresh(db_conn, args.changes)
+                print(f"{reading_count:>12} {cold_load:>14.3f} {warm_refresh:>17.3f}")
+        else:
+            print(f"{'readings':>12} {'distinct on (s)':>16} {'latest_prices (s)':>18}")
+            for reading_count in sorted(args.readings):
+                grow_history(db_conn, args.products, reading_count)
+                distinct_on = time_query(lambda: time_distinct_on(db_conn), args.repeats)
+                latest = time_query(lambda: read_database(db_conn), args.repeats)
+                print(f"{reading_count:>12} {distinct_on:>16.3f} {latest:>18.3f}")
+    finally:
+        if not args.keep:
+            with db_conn.cursor() as cursor:
+                cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(
+                    sql.Identifier(args.schema)))
+            db_conn.commit()
+        db_conn.close()
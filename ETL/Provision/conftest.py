@@ -2,6 +2,8 @@
 
 import pytest
 
+from product_cache import clear_product_cache
+
 
 @pytest.fixture(name="fake_readings")
 def fixture_fake_readings() -> list[dict]:
@@ -10,3 +12,11 @@ def fixture_fake_readings() -> list[dict]:
             {"product_id": 2, "url": "http://example.com/product2", "price": 24.99},
             {"product_id": 3, "url": "http://example.com/product3", "price": 12.34},
             {"product_id": 4, "url": "http://example.com/product4", "price": 228.99}]
+
+
+@pytest.fixture(autouse=True)
+def empty_product_cache():
+    "Starts every test with a cold product cache"
+    clear_product_cache()
+    yield
+    clear_product_cache()
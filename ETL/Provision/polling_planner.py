@@ -0,0 +1,170 @@
+"""Polling planner: works out when each product is next due to be scraped from its price
+history, so that stable products are polled far less often than volatile ones."""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from os import environ as ENV
+import logging
+
+SCHEDULE_INTERVAL = timedelta(minutes=3)
+MIN_POLL_INTERVAL = SCHEDULE_INTERVAL
+MAX_POLL_INTERVAL = timedelta(hours=24)
+POLLS_PER_CHANGE = 50
+STABILITY_FACTOR = 50
+NEAR_THRESHOLD_FRACTION = 0.1
+NEW_PRODUCT_PROXIMITY = 1.0
+FAILURE_COOLDOWN = timedelta(hours=1)
+MAX_FAILURE_COOLDOWN = timedelta(days=7)
+BROKEN_FAILURE_COUNT = 8
+
+
+def get_threshold_gap(price: Decimal | float | None,
+                      thresholds: list[Decimal | float]) -> float | None:
+    "Returns how far the price must fall, as a fraction, to reach the nearest threshold below it"
+    if price is None or not thresholds or price <= 0:
+        return None
+    price = float(price)
+    below = [float(threshold) for threshold in thresholds if float(threshold) < price]
+    if not below:
+        return None
+    return (price - max(below)) / price
+
+
+def has_readings(history: dict | None) -> bool:
+    "Returns True if a product has ever been read"
+    return bool(history and history.get("last_reading_at"))
+
+
+def get_poll_interval(history: dict, price: Decimal | float | None,
+                      now: datetime) -> timedelta:
+    """Returns how long to wait between polls of a product.
+
+    A product is polled POLLS_PER_CHANGE times per average gap between its price changes,
+    and STABILITY_FACTOR times per period it has been stable, whichever is more often.
+    Products within NEAR_THRESHOLD_FRACTION of a subscriber's threshold are always polled
+    at the minimum interval. The statistics cover the product's whole history, as kept in
+    latest_prices, so a product stable for a long time is polled at the maximum interval."""
+    gap = get_threshold_gap(price, history.get("thresholds") or [])
+    if gap is not None and gap <= NEAR_THRESHOLD_FRACTION:
+        return MIN_POLL_INTERVAL
+
+    first_reading_at = history["first_reading_at"]
+    stable_since = history.get("last_change_at") or first_reading_at
+    interval = (now - stable_since) / STABILITY_FACTOR
+    if history.get("price_changes"):
+        mean_change_gap = ((history["last_reading_at"] - first_reading_at)
+                           / history["price_changes"])
+        interval = min(interval, mean_change_gap / POLLS_PER_CHANGE)
+    return max(MIN_POLL_INTERVAL, min(MAX_POLL_INTERVAL, interval))
+
+
+def get_next_due_at(history: dict | None, price: Decimal | float | None,
+                    now: datetime) -> datetime:
+    """Returns when a product polled now is next due to be polled. Products never read are
+    polled again at the minimum interval."""
+    if not has_readings(history):
+        return now + MIN_POLL_INTERVAL
+    return now + get_poll_interval(history, price, now)
+
+
+def is_due(history: dict | None, now: datetime) -> bool:
+    """Returns True if a product falls due before the next scheduled run, so it is polled now
+    rather than a whole schedule interval late. Products never scheduled are always due."""
+    next_due_at = history.get("next_due_at") if history else None
+    return next_due_at is None or next_due_at < now + SCHEDULE_INTERVAL
+
+
+def get_due_products(products: list[dict], polling_history: dict[int, dict],
+                     now: datetime) -> list[dict]:
+    "Returns the products that are due to be polled"
+    if not isinstance(products, list):
+        raise TypeError("Input data must be a list.")
+    if not isinstance(now, datetime):
+        raise TypeError("now must be a datetime.")
+    due = [product for product in products
+           if is_due(polling_history.get(product["product_id"]), now)]
+    logging.info("%s of %s products are due to be polled", len(due), len(products))
+    return due
+
+
+def get_schedule(products: list[dict], polling_history: dict[int, dict],
+                 now: datetime) -> dict[int, datetime]:
+    "Returns when each of the products polled now is next due, keyed by product id"
+    return {product["product_id"]: get_next_due_at(polling_history.get(product["product_id"]),
+                                                   product.get("price"), now)
+            for product in products}
+
+
+def get_failure_cooldown(failure_count: int) -> timedelta:
+    """Returns how long a product is skipped after failing failure_count runs in a row.
+    The cool-down starts at FAILURE_COOLDOWN and doubles with every failure."""
+    return min(MAX_FAILURE_COOLDOWN, FAILURE_COOLDOWN * 2 ** min(failure_count - 1, 16))
+
+
+def is_cooling_down(failure: dict | None, now: datetime) -> bool:
+    "Returns True if a product's last persistent failure is still within its cool-down"
+    if not failure:
+        return False
+    return now < failure["last_failed_at"] + get_failure_cooldown(failure["failure_count"])
+
+
+def remove_cooling_down(products: list[dict], failure_ledger: dict[int, dict],
+                        now: datetime) -> list[dict]:
+    """Returns the products that are not cooling down after a persistent failure. Failing
+    products that are emitted get their failure_count, so the pipeline can report them as
+    recovered when they give a reading."""
+    if not isinstance(products, list):
+        raise TypeError("Input data must be a list.")
+    if not isinstance(now, datetime):
+        raise TypeError("now must be a datetime.")
+    emitted = []
+    for product in products:
+        failure = failure_ledger.get(product["product_id"])
+        if is_cooling_down(failure, now):
+            continue
+        if failure:
+            product["failure_count"] = failure["failure_count"]
+        emitted.append(product)
+    if len(emitted) < len(products):
+        logging.info("Skipped %s products cooling down after failing",
+                     len(products) - len(emitted))
+    return emitted
+
+
+def get_broken_products(failure_ledger: dict[int, dict]) -> list[dict]:
+    """Returns the products that have failed BROKEN_FAILURE_COUNT runs in a row, whose URLs
+    most likely no longer point at the product and should be cleaned up."""
+    return [{"product_id": product_id, "url": failure["url"], "reason": failure["reason"],
+             "failure_count": failure["failure_count"]}
+            for product_id, failure in failure_ledger.items()
+            if failure["failure_count"] >= BROKEN_FAILURE_COUNT]
+
+
+def get_priority(history: dict | None, price: Decimal | float | None) -> float:
+    """Returns a product's scrape priority. Proximity to the nearest threshold below the price
+    is 1 at the threshold, 0.5 at NEAR_THRESHOLD_FRACTION away and falls towards 0 beyond it,
+    and is multiplied by one plus the number of subscribers. Products never read yet get the
+    proximity of a product at its threshold, so their first reading is not delayed."""
+    if not has_readings(history):
+        proximity = NEW_PRODUCT_PROXIMITY
+    else:
+        gap = get_threshold_gap(price, history.get("thresholds") or [])
+        proximity = 0.0 if gap is None else 1 / (1 + gap / NEAR_THRESHOLD_FRACTION)
+    subscribers = history.get("subscribers", 0) if history else 0
+    return round(proximity * (1 + subscribers), 4)
+
+
+def sort_by_priority(products: list[dict], polling_history: dict[int, dict]) -> list[dict]:
+    """Adds a priority to every product and returns the products highest priority first.
+    Ties keep their original order."""
+    if not isinstance(products, list):
+        raise TypeError("Input data must be a list.")
+    for product in products:
+        product["priority"] = get_priority(polling_history.get(product["product_id"]),
+                                           product.get("price"))
+    return sorted(products, key=lambda product: -product["priority"])
+
+
+def is_adaptive_polling_enabled() -> bool:
+    "Returns True unless ADAPTIVE_POLLING is set to false"
+    return ENV.get("ADAPTIVE_POLLING", "true").lower() != "false"
@@ -0,0 +1,90 @@
+"""Product cache: keeps the product rows Provision streams from the database in memory across
+warm invocations, so that each run only reads the products that changed since the last one.
+
+Every write that changes what Provision reads about a product sets its products.row_version
+to the ID of the writing transaction, through triggers on products, latest_prices and
+subscriptions, and deleting a product records it in product_deletions. Transaction IDs are
+not committed in order, so the cache keeps the oldest transaction still in progress when it
+last read, its snapshot version, and reads the rows and deletions from that version on."""
+
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from os import environ as ENV
+import logging
+import os
+from threading import Lock
+
+CACHE_MAX_AGE = timedelta(hours=6)
+
+PRODUCT_CACHE = {"pid": None, "version": None, "loaded_at": None, "rows": {}}
+PRODUCT_CACHE_LOCK = Lock()
+
+
+def get_cache_version(now: datetime) -> int | None:
+    """Returns the snapshot version the cache is up to date with, or None if it has to be
+    loaded in full: on a cold start, in a new process, or once it is CACHE_MAX_AGE old. The
+    periodic full load also picks up the changes that give a product no new version, such as
+    its fetch_seconds."""
+    with PRODUCT_CACHE_LOCK:
+        if (PRODUCT_CACHE["pid"] != os.getpid() or PRODUCT_CACHE["loaded_at"] is None
+                or now - PRODUCT_CACHE["loaded_at"] >= CACHE_MAX_AGE):
+            return None
+        return PRODUCT_CACHE["version"]
+
+
+def load_products(rows: Iterable[tuple], now: datetime, version: int) -> None:
+    """Replaces the cache with every product's row, each starting with its product_id, read
+    from a snapshot taken at or after the given snapshot version."""
+    cached = {row[0]: row for row in rows}
+    with PRODUCT_CACHE_LOCK:
+        PRODUCT_CACHE.update(pid=os.getpid(), version=version, loaded_at=now, rows=cached)
+    logging.info("Product cache loaded with %s products up to version %s",
+                 len(cached), version)
+
+
+def apply_changes(rows: Iterable[tuple], deletions: list[tuple[int, int]],
+                  version: int) -> None:
+    """Updates the cache with the rows of the products changed since its version and the
+    (product_id, row_version) of the products deleted since, read from a snapshot taken at
+    or after the given snapshot version. A changed row replaces the cached one in place and
+    new products get higher IDs, so the rows stay in product_id order."""
+    changed = 0
+    with PRODUCT_CACHE_LOCK:
+        cached = PRODUCT_CACHE["rows"]
+        for row in rows:
+            cached[row[0]] = row
+            changed += 1
+        for product_id, _ in deletions:
+            cached.pop(product_id, None)
+        PRODUCT_CACHE["version"] = version
+    logging.info("Product cache refreshed with %s changed and %s deleted products",
+                 changed, len(deletions))
+
+
+def set_cached_values(index: int, values: dict[int, object]) -> None:
+    """Sets the field at index of the cached rows of the products in values, keyed by
+    product_id, for writes Provision makes itself without giving the products a new
+    version."""
+    with PRODUCT_CACHE_LOCK:
+        cached = PRODUCT_CACHE["rows"]
+        for product_id, value in values.items():
+            row = cached.get(product_id)
+            if row is not None:
+                cached[product_id] = row[:index] + (value,) + row[index + 1:]
+
+
+def get_cached_rows() -> list[tuple]:
+    "Returns the cached row of every product, in product_id order"
+    with PRODUCT_CACHE_LOCK:
+        return list(PRODUCT_CACHE["rows"].values())
+
+
+def clear_product_cache() -> None:
+    "Empties the cache, so the next invocation loads every product"
+    with PRODUCT_CACHE_LOCK:
+        PRODUCT_CACHE.update(pid=None, version=None, loaded_at=None, rows={})
+
+
+def is_product_cache_enabled() -> bool:
+    "Returns True unless CACHE_PRODUCTS is set to false"
+    return ENV.get("CACHE_PRODUCTS", "true").lower() != "false"
@@ -1,5 +1,8 @@
 "A script to read the url, and product data from the database"
 
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+from operator import itemgetter
 from os import _Environ, environ as ENV
 import logging
 
@@ -8,6 +11,45 @@ import psycopg2
 import psycopg2.extras
 from psycopg2.extensions import connection, cursor
 
+from batch_packer import get_batch_sizes, is_cost_packing_enabled
+from claim_check import check_in_all, get_claim_check_location
+from product_cache import (get_cache_version, load_products, apply_changes, get_cached_rows,
+                           set_cached_values, is_product_cache_enabled)
+from polling_planner import (get_due_products, get_schedule, is_adaptive_polling_enabled,
+                             sort_by_priority, remove_cooling_down, get_broken_products,
+                             is_cooling_down, is_due, get_next_due_at, get_priority)
+
+STREAM_CHUNK_SIZE = 5000
+PRODUCT_COLUMNS = ("product_id", "product_code", "url", "price", "website_name", "product_name",
+                   "fetch_seconds")
+HISTORY_COLUMNS = ("next_due_at", "first_reading_at", "last_reading_at", "price_changes",
+                   "last_change_at", "thresholds", "subscribers")
+
+HISTORY_QUERY = """WITH thresholds AS (
+                       SELECT product_id,
+                       ARRAY_AGG(price_threshold) FILTER (
+                           WHERE price_threshold IS NOT NULL) AS thresholds,
+                       COUNT(*) AS subscribers
+                       FROM subscriptions{subscriptions_filter}
+                       GROUP BY product_id)
+                """
+HISTORY_SELECT = """next_due_at, first_reading_at, reading_at AS last_reading_at,
+                COALESCE(price_changes, 0) AS price_changes, last_change_at,
+                COALESCE(thresholds, '{}') AS thresholds,
+                COALESCE(subscribers, 0) AS subscribers"""
+CHANGED_PRODUCTS = "product_id IN (SELECT product_id FROM products WHERE row_version >= %s)"
+NEXT_DUE_AT = len(PRODUCT_COLUMNS) + HISTORY_COLUMNS.index("next_due_at")
+
+
+def get_history_query(since_version: int | None = None) -> tuple[str, tuple]:
+    """Returns HISTORY_QUERY and its parameters, limited to the products whose row_version is
+    at least since_version unless it is None. The price change statistics are kept in
+    latest_prices by the email lambda, so only the subscriptions are aggregated here."""
+    if since_version is None:
+        return HISTORY_QUERY.format(subscriptions_filter=""), ()
+    return (HISTORY_QUERY.format(subscriptions_filter=f" WHERE {CHANGED_PRODUCTS}"),
+            (since_version,))
+
 
 def get_connection(config: _Environ) -> connection:
     "Establishes a connection with the database"
@@ -29,53 +71,285 @@ def get_cursor(conn: connection) -> cursor:
 
 
 def read_database(conn: connection):
-    "Gets the required data from the database"
+    """Gets the required data from the database. Each product's last price comes from
+    latest_prices, so the query does not grow with the price history"""
     if not isinstance(conn, connection):
         raise TypeError(
             "A cursor can only be constructed from a Psycopg2 connection object")
     with get_cursor(conn) as cur:
-        cur.execute("""SELECT DISTINCT ON (product_id) product_id, product_code,
-                    url, price, website_name, product_name
+        cur.execute("""SELECT product_id, product_code,
+                    url, price, website_name, product_name, fetch_seconds
                     FROM products
-                    LEFT JOIN price_readings USING (product_id)
+                    LEFT JOIN latest_prices USING (product_id)
                     LEFT JOIN websites USING (website_id)
-                    ORDER BY product_id, reading_at DESC""")
+                    ORDER BY product_id""")
         data = cur.fetchall()
-    logging.info("Product details taken from database")
-    logging.info(data)
+    logging.info("Product details taken from database for %s products", len(data))
     return data
 
 
-def group_data(data: list[dict], processing_batch_size: int) -> list[list[dict]]:
-    "Groups product data into lists up to a length of processing_batch_size"
+def stream_products(conn: connection, chunk_size: int = STREAM_CHUNK_SIZE,
+                    since_version: int | None = None) -> Iterator[tuple]:
+    """Yields every product with its last price and polling history as a plain tuple of
+    PRODUCT_COLUMNS followed by HISTORY_COLUMNS and its row_version, or only the products
+    whose row_version is at least since_version when it is given. A named cursor keeps the
+    result on the server and fetches it chunk_size rows at a time, so the catalogue is never
+    held at once.
+    The cursor lives in the connection's transaction, so nothing may commit until the
+    stream is exhausted."""
+    if not isinstance(conn, connection):
+        raise TypeError(
+            "A cursor can only be constructed from a Psycopg2 connection object")
+    with conn.cursor(name="provision_products") as cur:
+        cur.itersize = chunk_size
+        history_query, params = get_history_query(since_version)
+        changed = ""
+        if since_version is not None:
+            changed = "WHERE row_version >= %s"
+            params += (since_version,)
+        cur.execute(history_query + f"""SELECT product_id, product_code,
+                    url, price, website_name, product_name, fetch_seconds, {HISTORY_SELECT},
+                    row_version
+                    FROM products
+                    LEFT JOIN latest_prices USING (product_id)
+                    LEFT JOIN websites USING (website_id)
+                    LEFT JOIN thresholds USING (product_id)
+                    {changed}
+                    ORDER BY product_id""", params)
+        yield from cur
+
+
+def read_polling_history(conn: connection) -> dict[int, dict]:
+    "Gets the price change statistics and subscriber thresholds of every product"
+    if not isinstance(conn, connection):
+        raise TypeError(
+            "A cursor can only be constructed from a Psycopg2 connection object")
+    history_query, params = get_history_query()
+    with get_cursor(conn) as cur:
+        cur.execute(history_query + f"""SELECT product_id, {HISTORY_SELECT}
+                    FROM products
+                    LEFT JOIN latest_prices USING (product_id)
+                    LEFT JOIN thresholds USING (product_id)""", params)
+        history = {row["product_id"]: dict(row) for row in cur.fetchall()}
+    logging.info("Polling history read for %s products", len(history))
+    return history
+
+
+def read_failure_ledger(conn: connection) -> dict[int, dict]:
+    "Gets the products that have failed persistently, with their URL and failure count"
+    if not isinstance(conn, connection):
+        raise TypeError(
+            "A cursor can only be constructed from a Psycopg2 connection object")
+    with get_cursor(conn) as cur:
+        cur.execute("""SELECT product_id, url, reason, failure_count, last_failed_at
+                    FROM product_failures
+                    JOIN products USING (product_id)""")
+        failure_ledger = {row["product_id"]: dict(row) for row in cur.fetchall()}
+    logging.info("Failure ledger read for %s products", len(failure_ledger))
+    return failure_ledger
+
+
+def read_product_deletions(conn: connection, since_version: int) -> list[tuple[int, int]]:
+    "Gets the product_id and row_version of every product deleted from since_version on"
+    if not isinstance(conn, connection):
+        raise TypeError(
+            "A cursor can only be constructed from a Psycopg2 connection object")
+    with conn.cursor() as cur:
+        cur.execute("""SELECT product_id, row_version
+                    FROM product_deletions
+                    WHERE row_version >= %s""", (since_version,))
+        return cur.fetchall()
+
+
+def read_snapshot_version(conn: connection) -> int:
+    """Gets the ID of the oldest transaction still in progress. Every transaction with a
+    lower ID has finished, so a read that starts after this one sees all of their changes,
+    and anything committed later has a row_version of at least this version."""
+    if not isinstance(conn, connection):
+        raise TypeError(
+            "A cursor can only be constructed from a Psycopg2 connection object")
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::TEXT::BIGINT")
+        return cur.fetchone()[0]
+
+
+def read_cached_products(conn: connection, now: datetime) -> list[tuple]:
+    """Returns the streamed row of every product from the warm product cache. Only the
+    products changed or deleted since the last invocation's snapshot version are read, unless
+    the cache has to be loaded in full. The snapshot version is read first, so a change
+    still in progress during this read is read again on the next invocation."""
+    version = get_cache_version(now)
+    snapshot_version = read_snapshot_version(conn)
+    if version is None:
+        load_products(stream_products(conn), now, snapshot_version)
+    else:
+        apply_changes(stream_products(conn, since_version=version),
+                      read_product_deletions(conn, version), snapshot_version)
+    return get_cached_rows()
+
+
+def write_schedule(conn: connection, schedule: dict[int, datetime]) -> None:
+    "Stores when each product is next due to be polled"
+    if not isinstance(conn, connection):
+        raise TypeError(
+            "A cursor can only be constructed from a Psycopg2 connection object")
+    if not schedule:
+        return
+    with get_cursor(conn) as cur:
+        psycopg2.extras.execute_values(
+            cur, """UPDATE products SET next_due_at = schedule.next_due_at
+                    FROM (VALUES %s) AS schedule (product_id, next_due_at)
+                    WHERE products.product_id = schedule.product_id""",
+            list(schedule.items()))
+    conn.commit()
+    logging.info("Next poll scheduled for %s products", len(schedule))
+
+
+def plan_streamed_products(rows: Iterable[tuple], failure_ledger: dict[int, dict],
+                           now: datetime, adaptive: bool) -> tuple[list[tuple], dict]:
+    """Applies the failure cool-down, the polling schedule and the priority to each streamed
+    row as it arrives, keeping only the emitted products' rows. Returns those as
+    (priority, row, failure_count) tuples, highest priority first with ties in their
+    original order, and the schedule of the emitted products when adaptive is True."""
+    emitted = []
+    schedule = {}
+    counts = {"read": 0, "cooling_down": 0}
+    for row in rows:
+        counts["read"] += 1
+        failure = failure_ledger.get(row[0])
+        if is_cooling_down(failure, now):
+            counts["cooling_down"] += 1
+            continue
+        history = dict(zip(HISTORY_COLUMNS, row[len(PRODUCT_COLUMNS):]))
+        if adaptive:
+            if not is_due(history, now):
+                continue
+            schedule[row[0]] = get_next_due_at(history, row[3], now)
+        emitted.append((get_priority(history, row[3]), row[:len(PRODUCT_COLUMNS)],
+                        failure["failure_count"] if failure else None))
+    if counts["cooling_down"]:
+        logging.info("Skipped %s products cooling down after failing", counts["cooling_down"])
+    logging.info("Emitting %s of %s products", len(emitted), counts["read"])
+    emitted.sort(key=itemgetter(0), reverse=True)
+    return emitted, schedule
+
+
+def iter_product_outputs(emitted: list[tuple]) -> Iterator[dict]:
+    """Converts the emitted rows to output dicts one at a time, in order. Each row is
+    released as it is converted, so the rows and their dicts are never all held at once."""
+    emitted.reverse()
+    while emitted:
+        priority, row, failure_count = emitted.pop()
+        product = dict(zip(PRODUCT_COLUMNS, row))
+        if failure_count is not None:
+            product["failure_count"] = failure_count
+        product["priority"] = priority
+        yield product
+
+
+def group_data(data: Iterable[dict], processing_batch_size: int,
+               batch_sizes: list[int] | None = None) -> list[list[dict]]:
+    """Groups product data into lists up to a length of processing_batch_size, or of each of
+    batch_sizes in turn when they are given. The data can be a list or a stream of products,
+    which is consumed as the batches fill."""
     if not isinstance(processing_batch_size, int):
         raise TypeError("processing_batch_size must be an integer.")
-    if not isinstance(data, list):
-        raise TypeError("Input data must be a list.")
-    if not all(isinstance(product, dict) for product in data):
-        raise TypeError("All items in the list must be dictionaries.")
+    if isinstance(data, (dict, str)) or not isinstance(data, Iterable):
+        raise TypeError("Input data must be a list or a stream of products.")
 
+    sizes = iter(batch_sizes or [])
+    size = next(sizes, processing_batch_size)
     product_outputs = []
     temp = []
     for product in data:
+        if not isinstance(product, dict):
+            raise TypeError("All items in the list must be dictionaries.")
         temp.append(product)
-        if len(temp) >= processing_batch_size:
+        if len(temp) >= size:
             product_outputs.append(temp)
             temp = []
+            size = next(sizes, processing_batch_size)
     if temp:
         product_outputs.append(temp)
 
     return product_outputs
 
 
-def handler(_event, _context) -> dict[str, list[list[dict]]]:
-    "Lambda handler function"
+def plan_products(conn: connection, failure_ledger: dict[int, dict],
+                  now: datetime) -> list[dict]:
+    """Reads every product with its polling history and returns the ones to poll now,
+    highest priority first, storing when they are next due if adaptive polling is on."""
+    product_data = [dict(row) for row in read_database(conn)]
+    polling_history = read_polling_history(conn)
+    product_data = remove_cooling_down(product_data, failure_ledger, now)
+    if is_adaptive_polling_enabled():
+        product_data = get_due_products(product_data, polling_history, now)
+        write_schedule(conn, get_schedule(product_data, polling_history, now))
+    return sort_by_priority(product_data, polling_history)
+
+
+def stream_planned_products(conn: connection, failure_ledger: dict[int, dict],
+                            now: datetime) -> list[tuple]:
+    """Streams every product with its polling history and returns the rows of the ones to
+    poll now, highest priority first, for iter_product_outputs. The rows come from the warm
+    product cache unless CACHE_PRODUCTS is false. The schedule is stored once the
+    server-side cursor is exhausted, since committing earlier would close it. Storing it
+    gives no product a new version, so the cached rows are updated with it directly."""
+    cached = is_product_cache_enabled()
+    rows = read_cached_products(conn, now) if cached else stream_products(conn)
+    emitted, schedule = plan_streamed_products(rows, failure_ledger, now,
+                                               is_adaptive_polling_enabled())
+    write_schedule(conn, schedule)
+    if cached:
+        set_cached_values(NEXT_DUE_AT, schedule)
+    return emitted
+
+
+def get_packing_inputs(emitted: list[tuple]) -> list[tuple[str | None, float | None]]:
+    """Returns the (website_name, fetch_seconds) pair of each emitted row, in order."""
+    website_name = PRODUCT_COLUMNS.index("website_name")
+    fetch_seconds = PRODUCT_COLUMNS.index("fetch_seconds")
+    return [(row[website_name], row[fetch_seconds]) for _, row, _ in emitted]
+
+
+def is_streaming_enabled() -> bool:
+    "Returns True unless STREAM_PRODUCTS is set to false"
+    return ENV.get("STREAM_PRODUCTS", "true").lower() != "false"
+
+
+def handler(_event, _context) -> dict[str, list]:
+    """Lambda handler function. Products cooling down after persistent failures are skipped,
+    and products that have failed too often are reported under broken. Products are streamed
+    from a server-side cursor unless STREAM_PRODUCTS is false, and kept in memory across warm
+    invocations unless CACHE_PRODUCTS is false. Batches are packed by expected fetch cost
+    unless COST_PACKING is false. With CLAIM_CHECK set, each batch is
+    checked in and the output holds only their references."""
     db_conn = get_connection(ENV)
-    product_data = [dict(row) for row in read_database(db_conn)]
+    failure_ledger = read_failure_ledger(db_conn)
+    broken = get_broken_products(failure_ledger)
+    if broken:
+        logging.warning("%s products keep failing and should be cleaned up: %s",
+                        len(broken), [product["url"] for product in broken])
+    now = datetime.now()
+    if is_streaming_enabled():
+        emitted = stream_planned_products(db_conn, failure_ledger, now)
+        packing_inputs = get_packing_inputs(emitted)
+        product_data = iter_product_outputs(emitted)
+    else:
+        product_data = plan_products(db_conn, failure_ledger, now)
+        packing_inputs = [(product.get("website_name"), product.get("fetch_seconds"))
+                          for product in product_data]
+    processing_batch_size = int(ENV["PROCESSING_BATCH_SIZE"])
+    batch_sizes = (get_batch_sizes(packing_inputs, processing_batch_size)
+                   if is_cost_packing_enabled() else None)
 
-    return {"output": group_data(
-        product_data, int(ENV["PROCESSING_BATCH_SIZE"]))}
+    batches = group_data(product_data, processing_batch_size, batch_sizes)
+    location = get_claim_check_location()
+    if location:
+        batches = check_in_all(batches, location)
+        logging.info("Checked in %s batches at %s", len(batches), location)
 
+    return {"output": batches, "broken": broken}
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
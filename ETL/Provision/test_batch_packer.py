@@ -0,0 +1,59 @@
+"Tests for the batch packer"
+
+import pytest
+
+from batch_packer import (get_website_costs, estimate_costs, get_batch_sizes,
+                          is_cost_packing_enabled, DEFAULT_FETCH_SECONDS)
+
+
+def test_get_website_costs() -> None:
+    "Testing each website's cost is the average of its timed products"
+    costs = get_website_costs([("asos", 0.2), ("asos", 0.4), ("asos", None),
+                               ("patagonia", 3.0), ("other", None)])
+    assert costs == pytest.approx({"asos": 0.3, "patagonia": 3.0})
+
+
+def test_estimate_costs() -> None:
+    "Testing untimed products fall back to their website's average, then to the default"
+    assert estimate_costs([("asos", 0.2), ("asos", None), ("patagonia", None)]) == [
+        0.2, 0.2, DEFAULT_FETCH_SECONDS]
+
+
+def test_get_batch_sizes_without_costs_matches_fixed_batches() -> None:
+    "Testing products of equal cost are packed like fixed-size batches"
+    assert get_batch_sizes([("asos", None)] * 6, 2) == [2, 2, 2]
+
+
+def test_get_batch_sizes_spreads_expensive_products() -> None:
+    "Testing expensive scrapes get batches of their own while cheap lookups are grouped"
+    products = [("patagonia", 4.0), ("patagonia", 4.0)] + [("asos", 0.5)] * 4
+    assert get_batch_sizes(products, 2) == [1, 1, 4]
+
+
+def test_get_batch_sizes_capped() -> None:
+    "Testing no batch holds more than MAX_BATCH_SIZE_FACTOR times the batch size"
+    products = [("patagonia", 100.0)] + [("asos", 0.1)] * 99
+    assert max(get_batch_sizes(products, 10)) == 40
+    assert sum(get_batch_sizes(products, 10)) == 100
+
+
+def test_get_batch_sizes_empty() -> None:
+    "Testing no products give no batches"
+    assert get_batch_sizes([], 10) == []
+
+
+@pytest.mark.parametrize("processing_batch_size", [0, -1, "10", None])
+def test_get_batch_sizes_invalid_batch_size(processing_batch_size) -> None:
+    "Testing an error is raised for a batch size that is not a positive integer"
+    with pytest.raises(ValueError):
+        get_batch_sizes([("asos", 0.1)], processing_batch_size)
+
+
+@pytest.mark.parametrize("value, enabled", [(None, True), ("true", True), ("FALSE", False)])
+def test_is_cost_packing_enabled(value, enabled, monkeypatch) -> None:
+    "Testing cost packing is on unless COST_PACKING is false"
+    if value is None:
+        monkeypatch.delenv("COST_PACKING", raising=False)
+    else:
+        monkeypatch.setenv("COST_PACKING", value)
+    assert is_cost_packing_enabled() is enabled
@@ -0,0 +1,220 @@
+"Tests for the polling planner"
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+
+from polling_planner import (get_threshold_gap, get_poll_interval, get_next_due_at,
+                             is_due, get_due_products, get_schedule,
+                             is_adaptive_polling_enabled,
+                             get_priority, sort_by_priority, get_failure_cooldown,
+                             is_cooling_down, remove_cooling_down, get_broken_products,
+                             MIN_POLL_INTERVAL, MAX_POLL_INTERVAL, MAX_FAILURE_COOLDOWN)
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def make_history(days_tracked: float, price_changes: int = 0,
+                 days_since_change: float | None = None, minutes_since_reading: float = 3,
+                 thresholds: list | None = None, minutes_until_due: float | None = None) -> dict:
+    "Builds a polling history row"
+    return {"next_due_at": (NOW + timedelta(minutes=minutes_until_due)
+                            if minutes_until_due is not None else None),
+            "first_reading_at": NOW - timedelta(days=days_tracked),
+            "last_reading_at": NOW - timedelta(minutes=minutes_since_reading),
+            "price_changes": price_changes,
+            "last_change_at": (NOW - timedelta(days=days_since_change)
+                               if days_since_change is not None else None),
+            "thresholds": thresholds or [],
+            "subscribers": len(thresholds or [])}
+
+
+@pytest.mark.parametrize("price, thresholds, gap", [
+    (100, [Decimal("90.00")], 0.1),
+    (Decimal("100.00"), [50, 80], 0.2),
+    (100, [120], None),
+    (100, [], None),
+    (None, [90], None),
+    (0, [90], None)])
+def test_get_threshold_gap(price, thresholds, gap) -> None:
+    "Testing the gap to the nearest threshold below the price"
+    assert get_threshold_gap(price, thresholds) == pytest.approx(gap)
+
+
+def test_get_poll_interval_stable_product_capped() -> None:
+    "Testing a product stable for six months is polled at most daily"
+    assert get_poll_interval(make_history(180), 100, NOW) == MAX_POLL_INTERVAL
+
+
+def test_get_poll_interval_volatile_product() -> None:
+    "Testing a product that changes every hour is polled at the minimum interval"
+    history = make_history(2, price_changes=48, days_since_change=0.05)
+    assert get_poll_interval(history, 100, NOW) == MIN_POLL_INTERVAL
+
+
+def test_get_poll_interval_weekly_changes() -> None:
+    "Testing a weekly changing product is polled many times per change"
+    history = make_history(70, price_changes=10, days_since_change=6)
+    assert MIN_POLL_INTERVAL < get_poll_interval(history, 100, NOW) <= timedelta(days=7) / 50
+
+
+def test_get_poll_interval_near_threshold() -> None:
+    "Testing a stable product near a subscriber's threshold is polled at the minimum interval"
+    assert get_poll_interval(make_history(180, thresholds=[95]), 100, NOW) == MIN_POLL_INTERVAL
+
+
+def test_get_next_due_at_never_polled() -> None:
+    "Testing products without readings are polled again at the minimum interval"
+    assert get_next_due_at(None, None, NOW) == NOW + MIN_POLL_INTERVAL
+    assert get_next_due_at({"last_reading_at": None}, None, NOW) == NOW + MIN_POLL_INTERVAL
+
+
+@pytest.mark.parametrize("days_since_reading", [181, 200, 400])
+def test_get_next_due_at_long_stable_product(days_since_reading) -> None:
+    "Testing products last read over six months ago are polled at the maximum interval"
+    history = make_history(days_since_reading + 30,
+                           minutes_since_reading=days_since_reading * 24 * 60)
+    history["subscribers"] = 1
+    assert get_next_due_at(history, 100, NOW) == NOW + MAX_POLL_INTERVAL
+    assert get_next_due_at(history | {"thresholds": [95]}, 100, NOW) == NOW + MIN_POLL_INTERVAL
+    assert get_priority(history, 100) == 0.0
+
+
+def test_get_next_due_at_stable_product() -> None:
+    "Testing a stable product is next due after its poll interval"
+    assert get_next_due_at(make_history(180), 100, NOW) == NOW + MAX_POLL_INTERVAL
+
+
+@pytest.mark.parametrize("history, due", [
+    (None, True),
+    (make_history(180), True),
+    (make_history(180, minutes_until_due=-10), True),
+    (make_history(180, minutes_until_due=2), True),
+    (make_history(180, minutes_until_due=3), False),
+    (make_history(180, minutes_until_due=600), False)])
+def test_is_due(history, due) -> None:
+    "Testing products falling due before the next scheduled run are due now"
+    assert is_due(history, NOW) is due
+
+
+def test_get_due_products() -> None:
+    "Testing only due products are returned"
+    products = [{"product_id": 1, "price": 100}, {"product_id": 2, "price": 100},
+                {"product_id": 3, "price": None}]
+    history = {1: make_history(180, minutes_until_due=600),
+               2: make_history(2, price_changes=48, days_since_change=0.05,
+                               minutes_until_due=0)}
+    assert get_due_products(products, history, NOW) == products[1:]
+
+
+def test_get_schedule() -> None:
+    "Testing each polled product is scheduled by its own poll interval"
+    products = [{"product_id": 1, "price": 100}, {"product_id": 2, "price": None}]
+    assert get_schedule(products, {1: make_history(180)}, NOW) == {
+        1: NOW + MAX_POLL_INTERVAL, 2: NOW + MIN_POLL_INTERVAL}
+
+
+def test_get_due_products_invalid_input() -> None:
+    "Testing an error is raised for invalid products or time"
+    with pytest.raises(TypeError):
+        get_due_products({"product_id": 1}, {}, NOW)
+    with pytest.raises(TypeError):
+        get_due_products([], {}, "now")
+
+
+@pytest.mark.parametrize("value, enabled", [(None, True), ("true", True), ("False", False)])
+def test_is_adaptive_polling_enabled(value, enabled) -> None:
+    "Testing adaptive polling is on unless disabled"
+    env = {} if value is None else {"ADAPTIVE_POLLING": value}
+    with patch.dict("polling_planner.ENV", env, clear=True):
+        assert is_adaptive_polling_enabled() is enabled
+
+
+def test_get_priority_new_product() -> None:
+    "Testing products never read yet get a high priority"
+    assert get_priority(None, None) == 1.0
+    assert get_priority({"last_reading_at": None, "subscribers": 2}, None) == 3.0
+
+
+def test_get_priority_no_threshold_below_price() -> None:
+    "Testing products nobody is waiting on have no priority"
+    assert get_priority(make_history(10, thresholds=[120]), 100) == 0.0
+
+
+def test_get_priority_closer_threshold_ranks_higher() -> None:
+    "Testing a smaller gap to the threshold gives a higher priority"
+    near = get_priority(make_history(10, thresholds=[99]), 100)
+    far = get_priority(make_history(10, thresholds=[50]), 100)
+    assert near > far > 0
+
+
+def test_get_priority_more_subscribers_rank_higher() -> None:
+    "Testing more subscribers at the same gap give a higher priority"
+    assert (get_priority(make_history(10, thresholds=[90, 90]), 100)
+            > get_priority(make_history(10, thresholds=[90]), 100))
+
+
+def test_sort_by_priority() -> None:
+    "Testing products are ordered highest priority first, keeping ties in order"
+    products = [{"product_id": 1, "price": 100}, {"product_id": 2, "price": 100},
+                {"product_id": 3, "price": 100}, {"product_id": 4, "price": 100}]
+    history = {1: make_history(10), 2: make_history(10, thresholds=[95]),
+               3: make_history(10), 4: make_history(10, thresholds=[60])}
+    assert [product["product_id"] for product in sort_by_priority(products, history)] == [
+        2, 4, 1, 3]
+    assert products[1]["priority"] == 1.3333
+
+
+def test_sort_by_priority_invalid_input() -> None:
+    "Testing an error is raised when the data is not a list"
+    with pytest.raises(TypeError):
+        sort_by_priority({"product_id": 1}, {})
+
+
+def make_failure(failure_count: int, hours_since_failure: float) -> dict:
+    "Builds a failure ledger row"
+    return {"url": "http://example.com/gone", "reason": "NotFound",
+            "failure_count": failure_count,
+            "last_failed_at": NOW - timedelta(hours=hours_since_failure)}
+
+
+@pytest.mark.parametrize("failure_count, cooldown", [
+    (1, timedelta(hours=1)), (2, timedelta(hours=2)), (4, timedelta(hours=8)),
+    (9, MAX_FAILURE_COOLDOWN), (1000, MAX_FAILURE_COOLDOWN)])
+def test_get_failure_cooldown(failure_count, cooldown) -> None:
+    "Testing the cool-down doubles with every failure up to the maximum"
+    assert get_failure_cooldown(failure_count) == cooldown
+
+
+@pytest.mark.parametrize("failure, cooling_down", [
+    (None, False), (make_failure(1, 0.5), True), (make_failure(1, 1.5), False),
+    (make_failure(3, 3), True), (make_failure(3, 5), False)])
+def test_is_cooling_down(failure, cooling_down) -> None:
+    "Testing products are skipped until their cool-down has passed"
+    assert is_cooling_down(failure, NOW) == cooling_down
+
+
+def test_remove_cooling_down() -> None:
+    "Testing cooling products are skipped and other failing products carry their count"
+    products = [{"product_id": 1}, {"product_id": 2}, {"product_id": 3}]
+    ledger = {1: make_failure(2, 1), 3: make_failure(2, 3)}
+    assert remove_cooling_down(products, ledger, NOW) == [
+        {"product_id": 2}, {"product_id": 3, "failure_count": 2}]
+
+
+def test_remove_cooling_down_invalid_input() -> None:
+    "Testing an error is raised when the data is not a list or now is not a datetime"
+    with pytest.raises(TypeError):
+        remove_cooling_down({"product_id": 1}, {}, NOW)
+    with pytest.raises(TypeError):
+        remove_cooling_down([], {}, "now")
+
+
+def test_get_broken_products() -> None:
+    "Testing only products that have failed many runs in a row are reported"
+    ledger = {1: make_failure(8, 1), 2: make_failure(7, 1)}
+    assert get_broken_products(ledger) == [
+        {"product_id": 1, "url": "http://example.com/gone", "reason": "NotFound",
+         "failure_count": 8}]
@@ -0,0 +1,87 @@
+"Tests for the product cache"
+
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from product_cache import (get_cache_version, load_products, apply_changes, get_cached_rows,
+                           set_cached_values, clear_product_cache, is_product_cache_enabled,
+                           CACHE_MAX_AGE, PRODUCT_CACHE)
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def test_get_cache_version_cold() -> None:
+    "Testing an empty cache has to be loaded in full"
+    assert get_cache_version(NOW) is None
+
+
+def test_load_products() -> None:
+    "Testing a full load keeps every row and the snapshot version it was read at"
+    load_products(iter([(1, "a", 4), (2, "b", 9), (3, "c", 2)]), NOW, 7)
+    assert get_cached_rows() == [(1, "a", 4), (2, "b", 9), (3, "c", 2)]
+    assert get_cache_version(NOW) == 7
+
+
+def test_load_products_empty() -> None:
+    "Testing an empty catalogue is cached at its snapshot version"
+    load_products(iter([]), NOW, 3)
+    assert get_cached_rows() == []
+    assert get_cache_version(NOW) == 3
+
+
+def test_apply_changes() -> None:
+    "Testing changed rows replace cached ones in place, new rows are added and deleted ones go"
+    load_products(iter([(1, "a", 4), (2, "b", 9), (3, "c", 2)]), NOW, 9)
+    apply_changes(iter([(2, "B", 10), (4, "d", 11)]), [(1, 12), (7, 13)], 12)
+    assert get_cached_rows() == [(2, "B", 10), (3, "c", 2), (4, "d", 11)]
+    assert get_cache_version(NOW) == 12
+
+
+def test_apply_changes_keeps_transactions_in_progress() -> None:
+    """Testing the version only moves to the snapshot version, so a change still in progress
+    with a lower version than the ones read is read next time"""
+    load_products(iter([(1, "a", 4)]), NOW, 5)
+    apply_changes(iter([(2, "b", 9)]), [], 6)
+    assert get_cache_version(NOW) == 6
+
+
+def test_set_cached_values() -> None:
+    "Testing a field of the cached rows is replaced in place, skipping uncached products"
+    load_products(iter([(1, "a", 4), (2, "b", 9)]), NOW, 9)
+    set_cached_values(1, {2: "B", 5: "e"})
+    assert get_cached_rows() == [(1, "a", 4), (2, "B", 9)]
+    assert get_cache_version(NOW) == 9
+
+
+def test_get_cache_version_expired() -> None:
+    "Testing the cache is loaded in full again once it is CACHE_MAX_AGE old"
+    load_products(iter([(1, "a", 4)]), NOW, 4)
+    assert get_cache_version(NOW + CACHE_MAX_AGE - timedelta(seconds=1)) == 4
+    assert get_cache_version(NOW + CACHE_MAX_AGE) is None
+
+
+def test_get_cache_version_new_process() -> None:
+    "Testing a cache inherited by another process is not trusted"
+    load_products(iter([(1, "a", 4)]), NOW, 4)
+    with patch.dict(PRODUCT_CACHE, {"pid": -1}):
+        assert get_cache_version(NOW) is None
+
+
+def test_clear_product_cache() -> None:
+    "Testing a cleared cache is loaded in full"
+    load_products(iter([(1, "a", 4)]), NOW, 4)
+    clear_product_cache()
+    assert get_cached_rows() == []
+    assert get_cache_version(NOW) is None
+
+
+@pytest.mark.parametrize("value, enabled", [(None, True), ("true", True), ("FALSE", False)])
+def test_is_product_cache_enabled(value, enabled, monkeypatch) -> None:
+    "Testing the cache is on unless CACHE_PRODUCTS is false"
+    if value is None:
+        monkeypatch.delenv("CACHE_PRODUCTS", raising=False)
+    else:
+        monkeypatch.setenv("CACHE_PRODUCTS", value)
+    assert is_product_cache_enabled() is enabled
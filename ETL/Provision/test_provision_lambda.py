@@ -1,7 +1,17 @@
 "Tests for the provision lambda"
 
-from provision_lambda import group_data, read_database
-from unittest.mock import MagicMock
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from provision_lambda import (group_data, read_database, read_polling_history, write_schedule,
+                              read_failure_ledger, stream_products, plan_streamed_products,
+                              iter_product_outputs, stream_planned_products,
+                              get_packing_inputs, read_product_deletions, read_cached_products,
+                              read_snapshot_version, handler, PRODUCT_COLUMNS, HISTORY_COLUMNS)
+from product_cache import get_cached_rows, get_cache_version
+from polling_planner import remove_cooling_down, get_due_products, sort_by_priority
+from claim_check import check_out, is_claim_check
+from unittest.mock import MagicMock, patch
 
 import pytest
 from psycopg2.extensions import connection
@@ -27,6 +37,12 @@ def test_group_data_batch_of_30(fake_readings) -> None:
                                          {"product_id": 4, "url": "http://example.com/product4", "price": 228.99}]]
 
 
+def test_group_data_batch_sizes(fake_readings) -> None:
+    "Testing that batches follow the given sizes, falling back to the batch size after them"
+    assert group_data(fake_readings, 2, [1, 2]) == [fake_readings[:1], fake_readings[1:3],
+                                                    fake_readings[3:]]
+
+
 def test_group_data_invalid_data() -> None:
     "Testing that an error is raised when the data is not in a list"
     with pytest.raises(TypeError):
@@ -42,6 +58,17 @@ def test_group_data_invalid_product_data() -> None:
              ["product_id", 2, "url", "http://example.com/product2", "price", 24.99]], 2)
 
 
+def test_group_data_stream(fake_readings) -> None:
+    "Testing that a stream of products is grouped into the same batches as a list"
+    assert group_data(iter(fake_readings), 3) == [fake_readings[:3], fake_readings[3:]]
+
+
+def test_group_data_stream_invalid_product_data(fake_readings) -> None:
+    "Testing that an error is raised when a streamed product is not a dictionary"
+    with pytest.raises(TypeError):
+        group_data(iter(fake_readings + [("product_id", 5)]), 2)
+
+
 def test_read_database() -> None:
     "Testing that the correct executions are made when reading from the database"
     mock_conn = MagicMock(spec=connection)
@@ -52,11 +79,304 @@ def test_read_database() -> None:
 
     mock_cursor.execute.assert_called_once()
     call_args = mock_cursor.execute.call_args[0]
-    assert "SELECT DISTINCT ON (product_id)" in call_args[0]
     assert "FROM products" in call_args[0]
+    assert "LEFT JOIN latest_prices" in call_args[0]
+    assert "price_readings" not in call_args[0]
 
 
 def test_read_database_raises_error_if_connection_not_given() -> None:
     "Testing that an error is raised if the incorrect datatype is given for conn"
     with pytest.raises(TypeError):
         read_database(23)
+
+
+def test_read_polling_history() -> None:
+    "Testing the polling history is keyed by product id"
+    mock_conn = MagicMock(spec=connection)
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+    mock_cursor.fetchall.return_value = [{"product_id": 1, "price_changes": 0}]
+
+    assert read_polling_history(mock_conn) == {1: {"product_id": 1, "price_changes": 0}}
+    query = mock_cursor.execute.call_args[0][0]
+    assert "LEFT JOIN latest_prices" in query
+    assert "price_readings" not in query
+
+
+def test_read_polling_history_raises_error_if_connection_not_given() -> None:
+    "Testing that an error is raised if the incorrect datatype is given for conn"
+    with pytest.raises(TypeError):
+        read_polling_history(23)
+
+
+def test_write_schedule() -> None:
+    "Testing the schedule is written in one statement and committed"
+    mock_conn = MagicMock(spec=connection)
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+    with patch("provision_lambda.psycopg2.extras.execute_values") as mock_execute_values:
+        write_schedule(mock_conn, {1: datetime(2024, 6, 1, 12, 0)})
+
+    mock_execute_values.assert_called_once()
+    assert "UPDATE products SET next_due_at" in mock_execute_values.call_args[0][1]
+    assert mock_execute_values.call_args[0][2] == [(1, datetime(2024, 6, 1, 12, 0))]
+    mock_conn.commit.assert_called_once()
+
+
+def test_write_schedule_empty() -> None:
+    "Testing nothing is written for an empty schedule"
+    mock_conn = MagicMock(spec=connection)
+    write_schedule(mock_conn, {})
+    mock_conn.cursor.assert_not_called()
+    mock_conn.commit.assert_not_called()
+
+
+def test_write_schedule_raises_error_if_connection_not_given() -> None:
+    "Testing that an error is raised if the incorrect datatype is given for conn"
+    with pytest.raises(TypeError):
+        write_schedule(23, {})
+
+
+def test_read_failure_ledger() -> None:
+    "Testing the failure ledger is keyed by product id"
+    mock_conn = MagicMock(spec=connection)
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+    mock_cursor.fetchall.return_value = [{"product_id": 1, "failure_count": 2}]
+
+    assert read_failure_ledger(mock_conn) == {1: {"product_id": 1, "failure_count": 2}}
+    assert "FROM product_failures" in mock_cursor.execute.call_args[0][0]
+
+
+def test_read_failure_ledger_raises_error_if_connection_not_given() -> None:
+    "Testing that an error is raised if the incorrect datatype is given for conn"
+    with pytest.raises(TypeError):
+        read_failure_ledger(23)
+
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def make_row(product_id: int, price: float | None, minutes_until_due: float | None = None,
+             thresholds: list | None = None, fetch_seconds: float | None = None,
+             row_version: int = 1) -> tuple:
+    "Builds a streamed product row with its polling history and version"
+    return (product_id, str(product_id), f"http://example.com/product{product_id}", price,
+            "patagonia", f"Product {product_id}", fetch_seconds,
+            NOW + timedelta(minutes=minutes_until_due) if minutes_until_due is not None else None,
+            NOW - timedelta(days=30), NOW - timedelta(minutes=3), 0, None,
+            thresholds or [], len(thresholds or []), row_version)
+
+
+def test_stream_products() -> None:
+    "Testing products are read in chunks through a named server-side cursor"
+    mock_conn = MagicMock(spec=connection)
+    mock_cursor = MagicMock()
+    mock_cursor.__iter__.return_value = iter([make_row(1, 10), make_row(2, 20)])
+    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+    rows = list(stream_products(mock_conn, 100))
+
+    assert [row[0] for row in rows] == [1, 2]
+    assert mock_conn.cursor.call_args.kwargs["name"] == "provision_products"
+    assert mock_cursor.itersize == 100
+    query = mock_cursor.execute.call_args[0][0]
+    assert "LEFT JOIN latest_prices" in query
+    assert "price_readings" not in query
+    assert "row_version >=" not in query
+
+
+def test_stream_products_since_version() -> None:
+    "Testing only the products changed since a version are read, history included"
+    mock_conn = MagicMock(spec=connection)
+    mock_cursor = MagicMock()
+    mock_cursor.__iter__.return_value = iter([make_row(2, 20, row_version=8)])
+    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+    assert list(stream_products(mock_conn, since_version=7)) == [make_row(2, 20, row_version=8)]
+
+    query, params = mock_cursor.execute.call_args[0]
+    assert query.count("row_version >= %s") == 2
+    assert params == (7, 7)
+
+
+def test_read_product_deletions() -> None:
+    "Testing deleted products are read from the version given"
+    mock_conn = MagicMock(spec=connection)
+    mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+    mock_cursor.fetchall.return_value = [(3, 12)]
+
+    assert read_product_deletions(mock_conn, 10) == [(3, 12)]
+    assert "FROM product_deletions" in mock_cursor.execute.call_args[0][0]
+    assert mock_cursor.execute.call_args[0][1] == (10,)
+
+
+def test_read_snapshot_version() -> None:
+    "Testing the oldest transaction still in progress is read"
+    mock_conn = MagicMock(spec=connection)
+    mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+    mock_cursor.fetchone.return_value = (812,)
+
+    assert read_snapshot_version(mock_conn) == 812
+    assert "pg_snapshot_xmin" in mock_cursor.execute.call_args[0][0]
+
+
+def test_read_snapshot_version_raises_error_if_connection_not_given() -> None:
+    "Testing that an error is raised if the incorrect datatype is given for conn"
+    with pytest.raises(TypeError):
+        read_snapshot_version(23)
+
+
+def test_read_product_deletions_raises_error_if_connection_not_given() -> None:
+    "Testing that an error is raised if the incorrect datatype is given for conn"
+    with pytest.raises(TypeError):
+        read_product_deletions(23, 0)
+
+
+def test_read_cached_products_reads_only_changes() -> None:
+    "Testing a warm invocation reads only the changed and deleted products"
+    mock_conn = MagicMock(spec=connection)
+    with patch("provision_lambda.stream_products") as mock_stream, \
+            patch("provision_lambda.read_product_deletions") as mock_deletions, \
+            patch("provision_lambda.read_snapshot_version", side_effect=[3, 6]):
+        mock_stream.return_value = iter([make_row(product_id, 10, row_version=product_id)
+                                         for product_id in range(1, 4)])
+        read_cached_products(mock_conn, NOW)
+        mock_stream.assert_called_once_with(mock_conn)
+        mock_deletions.assert_not_called()
+
+        mock_stream.return_value = iter([make_row(2, 15, row_version=5),
+                                         make_row(4, 40, row_version=6)])
+        mock_deletions.return_value = [(1, 7)]
+        rows = read_cached_products(mock_conn, NOW + timedelta(minutes=10))
+
+    assert mock_stream.call_args == ((mock_conn,), {"since_version": 3})
+    mock_deletions.assert_called_once_with(mock_conn, 3)
+    assert get_cache_version(NOW + timedelta(minutes=10)) == 6
+    assert rows == [make_row(2, 15, row_version=5), make_row(3, 10, row_version=3),
+                    make_row(4, 40, row_version=6)]
+
+
+def test_stream_products_raises_error_if_connection_not_given() -> None:
+    "Testing that an error is raised if the incorrect datatype is given for conn"
+    with pytest.raises(TypeError):
+        list(stream_products(23))
+
+
+@pytest.mark.parametrize("adaptive", [True, False])
+def test_plan_streamed_products_matches_list_planner(adaptive) -> None:
+    "Testing streamed rows are planned into the same products as the list planner gives"
+    rows = [make_row(1, 100, minutes_until_due=600),
+            make_row(2, 100, thresholds=[95], fetch_seconds=0.4),
+            make_row(3, None), make_row(4, 50, thresholds=[Decimal("49.00")]),
+            make_row(5, 80, minutes_until_due=0)]
+    ledger = {3: {"failure_count": 1, "last_failed_at": NOW - timedelta(days=1)},
+              5: {"failure_count": 2, "last_failed_at": NOW}}
+    products = [dict(zip(PRODUCT_COLUMNS, row)) for row in rows]
+    history = {row[0]: dict(zip(HISTORY_COLUMNS, row[len(PRODUCT_COLUMNS):])) for row in rows}
+    expected = remove_cooling_down(products, ledger, NOW)
+    if adaptive:
+        expected = get_due_products(expected, history, NOW)
+    expected = sort_by_priority(expected, history)
+
+    emitted, schedule = plan_streamed_products(iter(rows), ledger, NOW, adaptive)
+
+    assert list(iter_product_outputs(emitted)) == expected
+    assert emitted == []
+    assert set(schedule) == ({2, 3, 4} if adaptive else set())
+
+
+def test_stream_planned_products_writes_schedule_after_streaming() -> None:
+    "Testing the schedule is only written once every row has been read"
+    mock_conn = MagicMock(spec=connection)
+    read = []
+
+    def rows(*_args):
+        for row in [make_row(1, 100), make_row(2, 50)]:
+            read.append(row[0])
+            yield row
+
+    def check_schedule(_conn, schedule):
+        assert read == [1, 2]
+        assert set(schedule) == {1, 2}
+
+    with patch("provision_lambda.stream_products", side_effect=rows), \
+            patch("provision_lambda.read_snapshot_version", return_value=1), \
+            patch("provision_lambda.write_schedule", side_effect=check_schedule) as mock_write, \
+            patch.dict("provision_lambda.ENV", {"ADAPTIVE_POLLING": "true"}):
+        emitted = stream_planned_products(mock_conn, {}, NOW)
+    mock_write.assert_called_once()
+    assert [row[0] for _, row, _ in emitted] == [1, 2]
+
+
+def test_stream_planned_products_updates_cached_schedule() -> None:
+    """Testing the cached rows get the schedule Provision wrote, since writing it gives the
+    products no new version"""
+    mock_conn = MagicMock(spec=connection)
+    next_due_at = len(PRODUCT_COLUMNS) + HISTORY_COLUMNS.index("next_due_at")
+    with patch("provision_lambda.stream_products",
+               return_value=iter([make_row(1, 100), make_row(2, 50, minutes_until_due=600)])), \
+            patch("provision_lambda.read_snapshot_version", return_value=1), \
+            patch("provision_lambda.write_schedule") as mock_write, \
+            patch.dict("provision_lambda.ENV", {"ADAPTIVE_POLLING": "true"}):
+        stream_planned_products(mock_conn, {}, NOW)
+    schedule = mock_write.call_args[0][1]
+    assert set(schedule) == {1}
+    assert [row[next_due_at] for row in get_cached_rows()] == [
+        schedule[1], NOW + timedelta(minutes=600)]
+
+
+def test_stream_planned_products_without_cache() -> None:
+    "Testing every product is streamed on every invocation when CACHE_PRODUCTS is false"
+    mock_conn = MagicMock(spec=connection)
+    with patch("provision_lambda.stream_products",
+               side_effect=lambda *_args: iter([make_row(1, 100)])) as mock_stream, \
+            patch("provision_lambda.write_schedule"), \
+            patch.dict("provision_lambda.ENV", {"CACHE_PRODUCTS": "false"}):
+        stream_planned_products(mock_conn, {}, NOW)
+        stream_planned_products(mock_conn, {}, NOW)
+    assert mock_stream.call_args_list == [((mock_conn,),), ((mock_conn,),)]
+
+
+def test_get_packing_inputs() -> None:
+    "Testing each emitted row gives its website and fetch cost"
+    emitted = [(1.0, make_row(1, 100, fetch_seconds=0.4)[:len(PRODUCT_COLUMNS)], None),
+               (0.5, make_row(2, 100)[:len(PRODUCT_COLUMNS)], 2)]
+    assert get_packing_inputs(emitted) == [("patagonia", 0.4), ("patagonia", None)]
+
+
+@pytest.mark.parametrize("stream", ["true", "false"])
+def test_handler_packs_batches_by_cost(stream) -> None:
+    "Testing cheap products share batches while expensive ones are spread out"
+    rows = [make_row(1, 100, fetch_seconds=4.0), make_row(2, 100, fetch_seconds=4.0)] + [
+        make_row(product_id, 100, fetch_seconds=0.5) for product_id in range(3, 7)]
+    products = [dict(zip(PRODUCT_COLUMNS, row)) for row in rows]
+    history = {row[0]: dict(zip(HISTORY_COLUMNS, row[len(PRODUCT_COLUMNS):])) for row in rows}
+    with patch("provision_lambda.get_connection", return_value=MagicMock(spec=connection)), \
+            patch("provision_lambda.read_failure_ledger", return_value={}), \
+            patch("provision_lambda.stream_products", return_value=iter(rows)), \
+            patch("provision_lambda.read_database", return_value=products), \
+            patch("provision_lambda.read_polling_history", return_value=history), \
+            patch.dict("provision_lambda.ENV", {"PROCESSING_BATCH_SIZE": "2",
+                                                "STREAM_PRODUCTS": stream,
+                                                "ADAPTIVE_POLLING": "false"}):
+        output = handler(None, None)["output"]
+    assert [[product["product_id"] for product in batch] for batch in output] == [
+        [1], [2], [3, 4, 5, 6]]
+
+
+def test_handler_claim_check(tmp_path) -> None:
+    "Testing each batch is checked in and only references are returned"
+    rows = [make_row(product_id, Decimal("10.00")) for product_id in range(1, 4)]
+    with patch("provision_lambda.get_connection", return_value=MagicMock(spec=connection)), \
+            patch("provision_lambda.read_failure_ledger", return_value={}), \
+            patch("provision_lambda.stream_products", return_value=iter(rows)), \
+            patch.dict("provision_lambda.ENV", {"PROCESSING_BATCH_SIZE": "2",
+                                                "ADAPTIVE_POLLING": "false",
+                                                "CLAIM_CHECK": f"file://{tmp_path}"}):
+        output = handler(None, None)["output"]
+    assert all(is_claim_check(reference) for reference in output)
+    batches = [check_out(reference) for reference in output]
+    assert [[product["product_id"] for product in batch] for batch in batches] == [[1, 2], [3]]
+    assert batches[0][0]["price"] == 10.0
@@ -73,6 +73,13 @@ resource "aws_lambda_function" "provisioning_lambda" {
           DB_NAME             = var.DB_NAME
           DB_SCHEMA           = var.DB_SCHEMA
           PROCESSING_BATCH_SIZE = var.PROCESSING_BATCH_SIZE
+          ADAPTIVE_POLLING    = var.ADAPTIVE_POLLING
+          STREAM_PRODUCTS     = var.STREAM_PRODUCTS
+          COST_PACKING        = var.COST_PACKING
+          CACHE_PRODUCTS      = var.CACHE_PRODUCTS
+          CLAIM_CHECK         = var.CLAIM_CHECK
+          ACCESS_KEY          = var.ACCESS_KEY
+          SECRET_ACCESS_KEY   = var.SECRET_ACCESS_KEY
         }
     }
     package_type = "Image"
@@ -114,10 +121,21 @@ resource "aws_lambda_function" "etl_lambda" {
     function_name = var.etl_lambda_name
     role = aws_iam_role.iam_for_etl_lambda.arn
     image_uri = "129033205317.dkr.ecr.eu-west-2.amazonaws.com/c11-hermes-extract-readings:latest"
+    memory_size = 3008
     environment {
         variables = {
             ACCESS_KEY = var.ACCESS_KEY,
-            SECRET_ACCESS_KEY = var.SECRET_ACCESS_KEY
+            SECRET_ACCESS_KEY = var.SECRET_ACCESS_KEY,
+            EXTRACTION_MODE = var.EXTRACTION_MODE,
+            MAX_CONCURRENCY = var.MAX_CONCURRENCY,
+            MAX_CONCURRENCY_PER_WEBSITE = var.MAX_CONCURRENCY_PER_WEBSITE,
+            RESPONSE_CACHE = var.RESPONSE_CACHE,
+            RESPONSE_ARCHIVE = var.RESPONSE_ARCHIVE,
+            STREAM_PAGES = var.STREAM_PAGES,
+            POOL_THREADS_PER_PROCESS = var.POOL_THREADS_PER_PROCESS,
+            FETCH_THREADS = var.FETCH_THREADS,
+            FETCHED_QUEUE_SIZE = var.FETCHED_QUEUE_SIZE,
+            CLAIM_CHECK = var.CLAIM_CHECK
         }
     }
     package_type = "Image"
@@ -166,7 +184,8 @@ resource "aws_lambda_function" "email_load_lambda" {
             DB_USER = var.DB_USER,
             DB_PASSWORD = var.DB_PASSWORD,
             ACCESS_KEY = var.ACCESS_KEY,
-            SECRET_ACCESS_KEY = var.SECRET_ACCESS_KEY
+            SECRET_ACCESS_KEY = var.SECRET_ACCESS_KEY,
+            CLAIM_CHECK = var.CLAIM_CHECK
         }
     }
     package_type = "Image"
@@ -70,4 +70,74 @@ variable "DB_SCHEMA" {
 
 variable "PROCESSING_BATCH_SIZE" {
     type = number
+}
+
+variable "EXTRACTION_MODE" {
+    type = string
+    default = "pool"
+}
+
+variable "MAX_CONCURRENCY" {
+    type = number
+    default = 100
+}
+
+variable "MAX_CONCURRENCY_PER_WEBSITE" {
+    type = number
+    default = 25
+}
+
+variable "POOL_THREADS_PER_PROCESS" {
+    type = number
+    default = 8
+}
+
+variable "FETCH_THREADS" {
+    type = number
+    default = 16
+}
+
+variable "FETCHED_QUEUE_SIZE" {
+    type = number
+    default = 32
+}
+
+variable "RESPONSE_CACHE" {
+    type = string
+    default = ""
+}
+
+variable "RESPONSE_ARCHIVE" {
+    type = string
+    default = ""
+}
+
+variable "CLAIM_CHECK" {
+    type = string
+    default = ""
+}
+
+variable "STREAM_PAGES" {
+    type = string
+    default = "false"
+}
+
+variable "ADAPTIVE_POLLING" {
+    type = string
+    default = "true"
+}
+
+variable "STREAM_PRODUCTS" {
+    type = string
+    default = "true"
+}
+
+variable "COST_PACKING" {
+    type = string
+    default = "true"
+}
+
+variable "CACHE_PRODUCTS" {
+    type = string
+    default = "true"
 }
\ No newline at end of file